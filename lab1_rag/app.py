@@ -1,9 +1,142 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
 import gradio as gr
-from lab1_rag.pipeline import get_query_engine
+from shared.env import load_env
 
-# Initialize the query engine once at startup
-print("Initializing Query Engine...")
-query_engine = get_query_engine()
+load_env()  # before any setting below is read (see shared/env.py)
+
+# Serving limits:
+# - RAG_CONCURRENCY: how many chats are answered at the same time.
+# - RAG_QUEUE_SIZE: how many more may wait in line before new ones are rejected.
+# Answers are awaited (not computed on a worker thread), so concurrency is bounded by
+# what the LLM provider and Qdrant can take, not by Gradio's thread pool.
+RAG_CONCURRENCY = int(os.getenv("RAG_CONCURRENCY", "16"))
+RAG_QUEUE_SIZE = int(os.getenv("RAG_QUEUE_SIZE", "64"))
+RAG_PORT = int(os.getenv("RAG_PORT", "7860"))
+# Question answered once before `/ready` reports 200 (empty: skip the self-test),
+# and how long that answer may take (see `self_test`).
+READY_PROBE = os.getenv("READY_PROBE", "What is the work from home policy?")
+READY_PROBE_TIMEOUT_S = float(os.getenv("READY_PROBE_TIMEOUT_S", "20"))
+
+# --- Lazy Startup ---
+# Building the engine means importing llama_index and the provider SDKs, connecting to
+# Qdrant and maybe ingesting: seconds to minutes. We don't make the server wait for it:
+# the port is bound at once, `warm_up()` builds the engine on a background thread, and
+# `/ready` answers 503 until it is done (so a load balancer or autoscaler only sends
+# traffic to warm instances). A question asked meanwhile simply waits for the engine.
+#
+# The engine is built in `warm_up` (started from the __main__ block), never at import
+# time: streaming ingestion's worker processes re-import this module, and must not
+# start a second ingestion.
+# Resolves to the default tenant's query engine (None if there is no default tenant),
+# or to the warm-up error.
+engine_future: Future = Future()
+
+# --- Tenants ---
+# The app serves the default tenant at `/` and any other tenant at `/?tenant=<id>`
+# (see tenants.py). Engines of other tenants are built on their first question and
+# kept in an LRU; the default tenant's engine is built by the warm-up and always kept,
+# outside the LRU. With TENANTS_DIR set and no folder for DEFAULT_TENANT, there is no
+# default tenant: warm-up builds nothing and every chat must name its tenant.
+tenant_engines = None  # TenantEngineCache, created by warm_up
+
+def warm_up():
+    """Builds the query engine in the background."""
+    global tenant_engines
+    start = time.perf_counter()
+    try:
+        # Deferred: these imports alone take a few seconds.
+        from lab1_rag.pipeline import RAG_STREAMING, get_query_engine
+        from lab1_rag.tenants import DEFAULT_TENANT, TENANTS_DIR, TenantEngineCache, list_tenants
+
+        def build(tenant_id):
+            return get_query_engine(streaming=RAG_STREAMING, tenant_id=tenant_id)
+
+        tenant_engines = TenantEngineCache(build)
+        engine = None
+        if TENANTS_DIR and DEFAULT_TENANT not in list_tenants():
+            print(f"ℹ️ No '{DEFAULT_TENANT}' tenant in {TENANTS_DIR}: chats must open /?tenant=<id>.")
+        else:
+            print("Initializing Query Engine...")
+            engine = build(DEFAULT_TENANT)
+    except Exception as e:
+        print(f"❌ Warm-up failed: {e}")
+        engine_future.set_exception(e)
+        return
+    print(f"✅ {'Query engine ready' if engine is not None else 'Warm-up done'} ({time.perf_counter() - start:.1f}s warm-up)")
+    engine_future.set_result(engine)
+
+# --- Readiness Self-Test ---
+# "The engine is built" is not "the app can answer": a missing async client, a wrong
+# API key or an empty collection only show up on the first question. So, once, as soon
+# as warm-up has finished, the server asks READY_PROBE through the same path as a chat
+# (`aquery` on the server's event loop, the whole answer streamed), and `/ready` only
+# reports ready if it worked. Probes just read the outcome: the (paid) question is
+# asked once per start, never per probe. It fails fast, within READY_PROBE_TIMEOUT_S
+# and without gateway retries, so a broken instance is reported before an orchestrator
+# gives up on it; restart the instance to test again.
+# Resolves to None (passed, or skipped) or to the error message.
+self_test_future: Future = Future()
+
+async def self_test():
+    """Answers READY_PROBE once with the default engine and records the outcome."""
+    try:
+        engine = await asyncio.wrap_future(engine_future)
+    except Exception:
+        return  # `/ready` reports the warm-up error
+    # Imported only now: importing llama_index here while warm-up imports it on its
+    # thread would race on partially initialized modules.
+    from llama_index.core.base.response.schema import AsyncStreamingResponse
+    from shared.gateway import no_retries
+
+    # Without a default tenant no engine exists before the first chat: nothing to test.
+    if not READY_PROBE or engine is None:
+        self_test_future.set_result(None)
+        return
+
+    async def ask():
+        response = await engine.aquery(READY_PROBE)
+        if isinstance(response, AsyncStreamingResponse):
+            async for _ in response.async_response_gen():
+                pass
+
+    error = None
+    try:
+        with no_retries():
+            await asyncio.wait_for(ask(), timeout=READY_PROBE_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        error = f"TimeoutError: no answer to READY_PROBE within {READY_PROBE_TIMEOUT_S:g}s"
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    print(f"❌ Readiness self-test failed: {error}" if error else "✅ Readiness self-test passed")
+    self_test_future.set_result(error)
+
+def pinned_engine(tenant_id=None):
+    """
+    The warm-up's engine if `tenant_id` is the default tenant (None counts as it),
+    else None: other tenants come from the LRU. Call once warm-up has finished.
+    """
+    from lab1_rag.tenants import DEFAULT_TENANT, UnknownTenantError
+
+    if tenant_id is not None and tenant_id != DEFAULT_TENANT:
+        return None
+    engine = engine_future.result()
+    if engine is None:
+        raise UnknownTenantError("There is no default tenant: open the app with /?tenant=<id>.")
+    return engine
+
+def get_query_engine_for(tenant_id=None):
+    """The query engine of a tenant (default: the default tenant); waits for warm-up."""
+    engine_future.result()
+    return pinned_engine(tenant_id) or tenant_engines.get(tenant_id)
+
+async def aget_query_engine(tenant_id=None):
+    """The query engine of a tenant (default: the default tenant), once warm-up has finished."""
+    await asyncio.wrap_future(engine_future)
+    return pinned_engine(tenant_id) or await tenant_engines.aget(tenant_id)
 
 def format_sources(response):
     """
@@ -29,7 +162,7 @@ def format_sources(response):
     
     return "\n".join(sources)
 
-def chat_response(message, history):
+def chat_response(message, history, tenant_id=None):
     """
     Gradio chat function.
     Args:
@@ -37,11 +170,16 @@ def chat_response(message, history):
         history: Chat history (unused here as LlamaIndex engine maintains its own context if configured, 
                  but for simple QueryEngine we might treat each query independently or upgrade to ChatEngine).
     """
-    # Query the RAG engine
-    response = query_engine.query(message)
-    
-    # Extract answer text
-    answer = str(response)
+    from lab1_rag.metrics import track_query
+
+    engine = get_query_engine_for(tenant_id)  # waits for warm-up if needed
+    # Query the RAG engine (traced: stage timings, tokens and sources go to lab1_rag/metrics.py)
+    with track_query(message, tenant=tenant_id) as trace:
+        response = engine.query(message)
+        trace.observe_response(response)
+        
+        # Extract answer text
+        answer = str(response)
     
     # Extract sources
     sources_html = format_sources(response)
@@ -50,6 +188,74 @@ def chat_response(message, history):
     # Since ChatInterface is restrictive, we'll use a custom Blocks layout to update multiple outputs.
     return answer, sources_html
 
+async def achat_response(message, history, tenant_id=None):
+    """
+    Async version of `chat_response`, used by the UI.
+
+    `aquery` awaits the embedding call, the Qdrant search and the LLM call, so while
+    one chat waits on the network the event loop serves the others. The query engine
+    holds no per-request state, so one instance is safely shared by every session.
+    """
+    from llama_index.core.base.response.schema import AsyncStreamingResponse
+    from lab1_rag.metrics import track_query
+
+    engine = await aget_query_engine(tenant_id)
+    with track_query(message, tenant=tenant_id) as trace:
+        response = await engine.aquery(message)
+        if isinstance(response, AsyncStreamingResponse):
+            response = await response.get_response()
+        trace.observe_response(response)
+    return str(response), format_sources(response)
+
+async def astream_chat_response(message, history, submitted_at=None, tenant_id=None):
+    """
+    Streaming version of `achat_response`: yields (answer_so_far, sources_html).
+
+    With a streaming engine, `aquery` returns right after retrieval, before the LLM
+    has written anything. We show the sources at that moment, then grow the answer
+    token by token: the user sees progress after the time-to-first-token instead of
+    after the whole generation.
+
+    `submitted_at` is when the user sent the message, to measure the queue wait.
+    `tenant_id` selects whose documents answer (None: the default tenant).
+    """
+    from llama_index.core.base.response.schema import AsyncStreamingResponse
+    from lab1_rag.metrics import track_query
+
+    engine = await aget_query_engine(tenant_id)
+    updates = asyncio.Queue()
+
+    async def produce():
+        # The whole answer is produced in this one task. Gradio may resume our generator
+        # from a different task at every `yield`, and the active trace (a context
+        # variable) must be visible to the instrumentation events of *every* step:
+        # retrieval, synthesis and the LLM call that ends with the last token.
+        with track_query(message, submitted_at=submitted_at, tenant=tenant_id) as trace:
+            response = await engine.aquery(message)
+            trace.observe_response(response)
+            sources_html = format_sources(response)
+
+            # A plain Response (non-streaming engine, or a semantic cache hit) is already complete.
+            if not isinstance(response, AsyncStreamingResponse):
+                updates.put_nowait((str(response), sources_html))
+                return
+
+            updates.put_nowait(("", sources_html))
+            answer = ""
+            async for token in response.async_response_gen():
+                trace.mark("first_token")
+                answer += token
+                updates.put_nowait((answer, sources_html))
+
+    producer = asyncio.create_task(produce())
+    producer.add_done_callback(lambda _: updates.put_nowait(None))
+    try:
+        while (update := await updates.get()) is not None:
+            yield update
+        await producer  # re-raises a pipeline error
+    finally:
+        producer.cancel()  # the user left mid-answer: stop generating
+
 # Build Custom UI Layout
 with gr.Blocks(title="Practical AI Lab: Policy Assistant", theme=gr.themes.Soft(), analytics_enabled=False) as demo:
     gr.Markdown("# 🏢 Practical AI Corp: Policy Assistant")
@@ -82,22 +288,93 @@ with gr.Blocks(title="Practical AI Lab: Policy Assistant", theme=gr.themes.Soft(
             gr.Markdown("### 📚 Retrieved Context")
             sources_box = gr.HTML(value="<em>Sources will appear here...</em>")
 
+    # When the user pressed Enter: the gap until bot_response starts is the queue wait.
+    submitted_at = gr.State(None)
+
     def user_message(user_input, history):
-        return "", history + [{"role": "user", "content": user_input}]
+        return "", history + [{"role": "user", "content": user_input}], time.time()
 
-    def bot_response(history):
+    async def bot_response(history, submitted_at, request: gr.Request):
+        # An async generator: every `yield` pushes the partial answer to the Chatbot.
+        from lab1_rag.tenants import UnknownTenantError
+
+        # The tenant comes from the page URL: /?tenant=finance
+        tenant_id = request.query_params.get("tenant") if request is not None else None
         user_input = history[-1]["content"]
-        answer, sources = chat_response(user_input, history[:-1])
-        history.append({"role": "assistant", "content": answer})
-        return history, sources
+        history.append({"role": "assistant", "content": ""})
+        try:
+            async for answer, sources in astream_chat_response(user_input, history[:-2], submitted_at, tenant_id):
+                history[-1]["content"] = answer
+                yield history, sources
+        except UnknownTenantError as e:
+            raise gr.Error(str(e))
 
     # Event Wiring
-    msg.submit(user_message, [msg, chatbot], [msg, chatbot], queue=False).then(
-        bot_response, [chatbot], [chatbot, sources_box]
+    msg.submit(user_message, [msg, chatbot], [msg, chatbot, submitted_at], queue=False).then(
+        bot_response, [chatbot, submitted_at], [chatbot, sources_box]
     )
     clear.click(lambda: [], None, chatbot, queue=False)
 
+def create_server():
+    """
+    The Gradio UI mounted on a FastAPI app, next to two probes and the metrics:
+
+    - `/healthz`: the process is up (liveness). Always 200.
+    - `/ready`: the query engine is built and has answered READY_PROBE (readiness).
+      503 while warming up, or if warm-up or the self-test failed, with the error
+      in the body.
+    - `/metrics`: per-query timings, tokens and cache hits in the Prometheus text
+      format (see metrics.py).
+    """
+    from contextlib import asynccontextmanager
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse, Response
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Started with the server, on its event loop: it waits for warm-up, then runs once.
+        task = asyncio.create_task(self_test())
+        yield
+        task.cancel()
+
+    server = FastAPI(lifespan=lifespan)
+
+    @server.get("/healthz")
+    def healthz():
+        return {"status": "ok"}
+
+    @server.get("/ready")
+    async def ready():
+        if not engine_future.done():
+            return JSONResponse({"status": "warming_up"}, status_code=503)
+        if engine_future.exception() is not None:
+            return JSONResponse({"status": "failed", "error": str(engine_future.exception())}, status_code=503)
+        if not self_test_future.done():
+            return JSONResponse({"status": "self_testing"}, status_code=503)
+        if self_test_future.result() is not None:
+            return JSONResponse({"status": "failed", "error": self_test_future.result()}, status_code=503)
+        return {"status": "ready"}
+
+    @server.get("/metrics")
+    def metrics():
+        # A plain `def`: FastAPI runs it on a worker thread, so the first scrape's
+        # (deferred) import of metrics.py never blocks the event loop.
+        from lab1_rag.metrics import METRICS_CONTENT_TYPE, REGISTRY
+
+        return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+    return gr.mount_gradio_app(server, demo, path="/")
+
 if __name__ == "__main__":
+    # Bound concurrency and queue depth (see RAG_CONCURRENCY / RAG_QUEUE_SIZE above)
+    demo.queue(default_concurrency_limit=RAG_CONCURRENCY, max_size=RAG_QUEUE_SIZE)
+
+    # Build the engine in the background while the server starts listening.
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
     # Launch the app
-    # server_name="0.0.0.0" allows access from outside the container if dockerized
-    demo.launch(server_name="0.0.0.0", server_port=7860, share=False)
+    # host="0.0.0.0" allows access from outside the container if dockerized
+    import uvicorn
+
+    print(f"Serving on http://0.0.0.0:{RAG_PORT} (readiness: /ready)")
+    uvicorn.run(create_server(), host="0.0.0.0", port=RAG_PORT, access_log=False)
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import platform
+import tempfile
+import subprocess
+from typing import Any, Dict, List
+
+import typer
+from rich.console import Console
+
+# --- Offline by Default ---
+# The benchmark must be reproducible on a laptop or a CI runner: no API keys, no
+# Docker, no network. Unless --live is passed, we select the deterministic mock
+# models (MockLLM + HashingEmbedding) and an in-process Qdrant *before* anything
+# imports the pipeline, and disable the embedding cache so every run pays full cost.
+OFFLINE_ENV = {
+    "LLM_PROVIDER": "mock",
+    "QDRANT_URL": ":memory:",
+    "EMBED_CACHE": "off",
+}
+
+app = typer.Typer()
+console = Console()
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 in milliseconds plus sequential queries per second."""
+    from lab1_rag.loadtest import percentile
+
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "qps": len(latencies) / sum(latencies),
+    }
+
+
+def bench_ingestion(data_dir: str, collection_name: str, num_docs: int, workers: int, batch_size: int) -> Dict[str, Any]:
+    """Parses, chunks, embeds and upserts the corpus through the streaming pipeline."""
+    from lab1_rag.ingestion import iter_data_files, stream_ingest
+    from lab1_rag.pipeline import get_splitter, get_vector_store
+
+    vector_store, _ = get_vector_store(collection_name=collection_name)
+    start = time.perf_counter()
+    report = stream_ingest(
+        vector_store, iter_data_files(data_dir), get_splitter(), workers=workers, batch_size=batch_size
+    )
+    elapsed = time.perf_counter() - start
+    return {
+        "docs": num_docs,
+        "chunks": report.embedded_chunks,
+        "seconds": elapsed,
+        "docs_per_s": num_docs / elapsed,
+        "chunks_per_s": report.embedded_chunks / elapsed,
+    }
+
+
+def bench_embedding(texts: List[str], batch_sizes: List[int]) -> List[Dict[str, Any]]:
+    """Embedding throughput of the configured embed model at several batch sizes."""
+    from llama_index.core import Settings
+
+    results = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            Settings.embed_model.get_text_embedding_batch(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        results.append({"batch_size": batch_size, "texts": len(texts), "texts_per_s": len(texts) / elapsed})
+    return results
+
+
+def bench_retrieval(collection_name: str, top_ks: List[int], questions: List[str], repeats: int) -> List[Dict[str, Any]]:
+    """Retrieval-only and end-to-end (mock LLM) latency for each similarity_top_k."""
+    from llama_index.core import QueryBundle, VectorStoreIndex
+    from lab1_rag.pipeline import get_vector_store
+
+    vector_store, _ = get_vector_store(collection_name=collection_name)
+    index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
+    results = []
+    for top_k in top_ks:
+        retriever = index.as_retriever(similarity_top_k=top_k)
+        query_engine = index.as_query_engine(similarity_top_k=top_k)
+        retrieval, end_to_end = [], []
+        for _ in range(repeats):
+            for question in questions:
+                start = time.perf_counter()
+                retriever.retrieve(QueryBundle(question))
+                retrieval.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                query_engine.query(question)
+                end_to_end.append(time.perf_counter() - start)
+        results.append({
+            "top_k": top_k,
+            "queries": len(retrieval),
+            "retrieval": summarize_latencies(retrieval),
+            "end_to_end": summarize_latencies(end_to_end),
+        })
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+@app.command()
+def main(
+    sizes: str = typer.Option("30,300", help="Comma-separated corpus sizes (number of PDFs)."),
+    top_ks: str = typer.Option("1,3,5,10", help="Comma-separated similarity_top_k values."),
+    embed_batch_sizes: str = typer.Option("1,16,64", help="Comma-separated embedding batch sizes."),
+    repeats: int = typer.Option(5, help="How many times the question set is run per top_k."),
+    workers: int = typer.Option(os.cpu_count() or 1, help="Parse workers for ingestion."),
+    batch_size: int = typer.Option(64, help="Embed/upsert batch size for ingestion."),
+    output: str = typer.Option(".cache/benchmark.json", help="Where to write the JSON results."),
+    live: bool = typer.Option(False, help="Use the models and Qdrant configured in .env instead of offline mocks."),
+    embed_provider: str = typer.Option("", help="Embedding provider to benchmark (openai | local | mock). Default: follows the LLM."),
+):
+    """
+    Benchmarks ingestion, embedding and retrieval at several corpus sizes.
+
+    Writes machine-readable JSON so results of two releases can be diffed.
+    Run it once with `--embed-provider local` and once with `openai` to compare
+    a local embedding model against the remote API.
+    """
+    if not live:
+        os.environ.update(OFFLINE_ENV)
+    if embed_provider:
+        os.environ["EMBED_PROVIDER"] = embed_provider
+
+    from shared.generate_pdfs import generate_corpus
+    from shared.utils import init_settings
+    from lab1_rag.loadtest import QUESTIONS
+
+    settings = init_settings()
+    # Pay one-off costs (a local model's load, a client's first connection) up front,
+    # so they don't skew the throughput of the first run.
+    start = time.perf_counter()
+    settings.embed_model.get_query_embedding("warm up")
+    warmup_s = time.perf_counter() - start
+    console.print(f"Embedding warm-up: {warmup_s:.2f}s")
+
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": "live" if live else "offline",
+            "llm": type(settings.llm).__name__,
+            "embed_model": type(settings.embed_model).__name__,
+            "embed_provider": os.getenv("EMBED_PROVIDER", "") or "default",
+            "embed_model_name": settings.embed_model.model_name,
+            "embed_warmup_s": warmup_s,
+            "workers": workers,
+            "ingest_batch_size": batch_size,
+        },
+        "runs": [],
+    }
+
+    for num_docs in [int(s) for s in sizes.split(",")]:
+        console.print(f"\n[bold blue]Corpus of {num_docs} PDFs[/bold blue]")
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate_corpus(data_dir, num_docs)
+            collection_name = f"benchmark_{num_docs}_{int(time.time())}"
+
+            ingestion = bench_ingestion(data_dir, collection_name, num_docs, workers, batch_size)
+            console.print(f"  ingestion: {ingestion['docs_per_s']:.1f} docs/s, {ingestion['chunks_per_s']:.1f} chunks/s")
+
+            # Embedding throughput is measured on the real chunk texts of this corpus.
+            from lab1_rag.ingestion import chunk_file, iter_data_files
+            from lab1_rag.pipeline import get_splitter
+            sample = [
+                node.get_content()
+                for path in list(iter_data_files(data_dir))[:20]
+                for node in chunk_file(path, "", get_splitter())
+            ]
+            embedding = bench_embedding(sample, [int(b) for b in embed_batch_sizes.split(",")])
+            for row in embedding:
+                console.print(f"  embedding (batch {row['batch_size']}): {row['texts_per_s']:.1f} texts/s")
+
+            retrieval = bench_retrieval(collection_name, [int(k) for k in top_ks.split(",")], QUESTIONS, repeats)
+            for row in retrieval:
+                console.print(
+                    f"  top_k={row['top_k']}: retrieval p50 {row['retrieval']['p50_ms']:.2f} ms, "
+                    f"p99 {row['retrieval']['p99_ms']:.2f} ms, {row['retrieval']['qps']:.0f} QPS"
+                )
+
+            # Don't leave benchmark collections behind on a live Qdrant server.
+            from shared.qdrant import get_qdrant_client
+            get_qdrant_client().delete_collection(collection_name)
+
+        results["runs"].append({
+            "corpus_docs": num_docs,
+            "ingestion": ingestion,
+            "embedding": embedding,
+            "retrieval": retrieval,
+        })
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"\n[green]Results written to {output}[/green]")
+
+
+if __name__ == "__main__":
+    app()
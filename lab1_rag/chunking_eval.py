@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import time
+import platform
+from typing import Any, Dict, List, Optional, Tuple
+
+import typer
+from rich.console import Console
+from rich.table import Table
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.embedding import EmbeddingEndEvent
+
+from lab1_rag.benchmark import OFFLINE_ENV, git_commit
+
+# --- Chunking Evaluation ---
+# Chunk size is the one knob that moves everything at once: small chunks mean more
+# vectors to embed and store but a precise match, large chunks mean fewer vectors but
+# every retrieved chunk drags a page of unrelated text into the prompt. Too small, and
+# the answer gets cut in half at a chunk boundary. There is no universal best value:
+# it depends on the documents and on the questions, so we measure it.
+#
+# For every splitter (see `get_splitter` in pipeline.py) and size, this script chunks
+# the PDFs in lab1_rag/data with the *same* code as ingestion, indexes them in an
+# in-process Qdrant, asks every question of an evaluation set and reports:
+# - hit rate: questions whose answer is inside one of the top-k chunks of the right file.
+# - MRR: mean of 1/rank of that chunk (1.0 = always the first chunk).
+# - embedding: texts embedded (and embedding calls) to build the index.
+# - index size: vectors plus payloads, as stored in Qdrant.
+# - prompt tokens: what the LLM reads per question.
+#
+# The best configuration is the one with the highest hit rate, then MRR, then the
+# fewest prompt tokens, and is printed as the .env lines that select it.
+#
+# It runs offline: hashing embeddings by default, or `--embed-provider local` for the
+# sentence-transformers model (`uv sync --extra local`). The LLM is always the mock:
+# prompt tokens do not depend on the answer.
+
+# Each question names the file that answers it and a phrase of the answer, as written
+# in the document. A chunk "hits" if it comes from that file and contains the phrase.
+EVAL_SET: List[Dict[str, str]] = [
+    {"question": "How many days a week must I be in the office?", "file": "policy_01_wfh.pdf", "answer": "at least 3 days per week"},
+    {"question": "When do new employees become eligible for hybrid work?", "file": "policy_01_wfh.pdf", "answer": "first 30 days of employment"},
+    {"question": "What are the core collaboration hours?", "file": "policy_01_wfh.pdf", "answer": "10:00 AM to 3:00 PM"},
+    {"question": "How much is the home office stipend?", "file": "policy_01_wfh.pdf", "answer": "Home Office Stipend of $500"},
+    {"question": "What internet speed do I need to work remotely?", "file": "policy_01_wfh.pdf", "answer": "minimum 50 Mbps down"},
+    {"question": "Can I use a personal device for work?", "file": "policy_01_wfh.pdf", "answer": "Personal devices should not be used"},
+    {"question": "What is the reimbursement limit for team dinners?", "file": "policy_02_expenses.pdf", "answer": "$60 per person (dinner)"},
+    {"question": "What is the nightly lodging limit in Tier 1 cities?", "file": "policy_02_expenses.pdf", "answer": "Tokyo): $300/night"},
+    {"question": "Which class must domestic flights be booked in?", "file": "policy_02_expenses.pdf", "answer": "must be booked in Economy Class"},
+    {"question": "When do I need a receipt for an expense?", "file": "policy_02_expenses.pdf", "answer": "required for any single expense over $25"},
+    {"question": "How long do I have to submit an expense report?", "file": "policy_02_expenses.pdf", "answer": "within 30 days of the expense date"},
+    {"question": "How often must passwords be rotated?", "file": "policy_03_security.pdf", "answer": "rotated every 90 days"},
+    {"question": "What is the minimum password length?", "file": "policy_03_security.pdf", "answer": "Minimum length: 14 characters"},
+    {"question": "Can I use SMS codes for multi-factor authentication?", "file": "policy_03_security.pdf", "answer": "SMS-based MFA is prohibited"},
+    {"question": "How quickly must a lost laptop be reported?", "file": "policy_03_security.pdf", "answer": "immediately (within 1 hour)"},
+    {"question": "Which VPN is required to access production?", "file": "policy_03_security.pdf", "answer": "corporate VPN (WireGuard)"},
+]
+
+app = typer.Typer()
+console = Console()
+
+
+class EmbeddingCounter(BaseEventHandler):
+    """Counts embedding calls and embedded texts, wherever they come from."""
+
+    calls: int = 0
+    texts: int = 0
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "EmbeddingCounter"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        if isinstance(event, EmbeddingEndEvent):
+            self.calls += 1
+            self.texts += len(event.chunks)
+
+    def reset(self) -> None:
+        self.calls = 0
+        self.texts = 0
+
+
+def _normalize(text: str) -> str:
+    # PDF text and chunk boundaries reflow whitespace; the words are what must match.
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def answer_rank(source_nodes: List[Any], expected: Dict[str, str]) -> Optional[int]:
+    """1-based rank of the first retrieved chunk holding the expected answer, or None."""
+    answer = _normalize(expected["answer"])
+    for rank, node in enumerate(source_nodes, start=1):
+        if node.node.metadata.get("file_name") == expected["file"] and answer in _normalize(node.node.get_content()):
+            return rank
+    return None
+
+
+def index_bytes(nodes: List[Any], dim: int) -> int:
+    """
+    Bytes Qdrant stores for the chunks: a float32 vector and the JSON payload each.
+
+    The payload is what the LlamaIndex Qdrant store writes (the chunk text and its
+    metadata); the HNSW graph adds a fixed ~128 bytes per point on top.
+    """
+    from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+    payload = sum(
+        len(json.dumps(node_to_metadata_dict(node, remove_text=False, flat_metadata=False)).encode("utf-8"))
+        for node in nodes
+    )
+    return len(nodes) * dim * 4 + payload
+
+
+def sweep(splitters: List[str], sizes: List[int], overlaps: List[int]) -> List[Tuple[str, int, int]]:
+    """(splitter, chunk size, overlap) per configuration; the semantic splitter has no size."""
+    configs = []
+    for kind in splitters:
+        if kind == "semantic":
+            configs.append((kind, 0, 0))
+            continue
+        configs += [(kind, size, overlap) for size in sizes for overlap in overlaps if overlap < size]
+    return configs
+
+
+def config_name(kind: str, size: int, overlap: int) -> str:
+    return kind if kind == "semantic" else f"{kind} {size}/{overlap}"
+
+
+def evaluate(
+    kind: str,
+    size: int,
+    overlap: int,
+    files: List[Tuple[str, List[Any]]],
+    eval_set: List[Dict[str, str]],
+    top_k: int,
+    dim: int,
+    counter: EmbeddingCounter,
+) -> Dict[str, Any]:
+    """Chunks, indexes and queries the corpus with one configuration."""
+    from llama_index.core import StorageContext, VectorStoreIndex
+    from lab1_rag.ingestion import chunk_documents
+    from lab1_rag.metrics import track_query
+    from lab1_rag.pipeline import get_splitter, get_vector_store
+
+    splitter = get_splitter(kind, size, overlap)
+    # Dense retrieval only: the comparison is about chunks, not about BM25.
+    collection_name = "chunking_eval_" + re.sub(r"\W+", "_", config_name(kind, size, overlap))
+    vector_store, client = get_vector_store(hybrid=False, collection_name=collection_name)
+    # Counted from here: provisioning the collection embeds a probe text.
+    counter.reset()
+    start = time.perf_counter()
+    # The same chunking as ingestion: metadata, content hashes and all.
+    nodes = [node for file_name, documents in files for node in chunk_documents(file_name, "", documents, splitter)]
+    index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(vector_store=vector_store))
+    ingest_s = time.perf_counter() - start
+    embed_calls, embed_texts = counter.calls, counter.texts
+
+    query_engine = index.as_query_engine(similarity_top_k=top_k)
+    ranks: List[Optional[int]] = []
+    prompt_tokens: List[int] = []
+    for expected in eval_set:
+        with track_query(expected["question"]) as trace:
+            response = query_engine.query(expected["question"])
+            trace.observe_response(response)
+        ranks.append(answer_rank(response.source_nodes, expected))
+        prompt_tokens.append(trace.prompt_tokens)
+    client.delete_collection(collection_name)
+
+    return {
+        "config": config_name(kind, size, overlap),
+        "splitter": kind,
+        "chunk_size": size or None,
+        "chunk_overlap": overlap if kind != "semantic" else None,
+        "chunks": len(nodes),
+        "hit_rate": sum(rank is not None for rank in ranks) / len(ranks),
+        "mrr": sum(1 / rank for rank in ranks if rank is not None) / len(ranks),
+        "embed_calls": embed_calls,
+        "embed_texts": embed_texts,
+        "index_bytes": index_bytes(nodes, dim),
+        "prompt_tokens_per_query": sum(prompt_tokens) / len(prompt_tokens),
+        "ingest_s": ingest_s,
+        "misses": [expected["question"] for expected, rank in zip(eval_set, ranks) if rank is None],
+    }
+
+
+def pick_best(rows: List[Dict[str, Any]], max_prompt_tokens: int = 0) -> Optional[Dict[str, Any]]:
+    """Quality first (hit rate, then MRR), then cost (prompt tokens, then embedded texts)."""
+    candidates = [
+        row for row in rows if not max_prompt_tokens or row["prompt_tokens_per_query"] <= max_prompt_tokens
+    ]
+    if not candidates:
+        return None
+    return min(
+        candidates,
+        key=lambda row: (
+            -round(row["hit_rate"], 3), -round(row["mrr"], 3), row["prompt_tokens_per_query"], row["embed_texts"]
+        ),
+    )
+
+
+def env_lines(row: Dict[str, Any]) -> List[str]:
+    lines = [f"CHUNK_SPLITTER={row['splitter']}"]
+    if row["chunk_size"] is not None:
+        lines += [f"CHUNK_SIZE={row['chunk_size']}", f"CHUNK_OVERLAP={row['chunk_overlap']}"]
+    return lines
+
+
+@app.command()
+def main(
+    splitters: str = typer.Option("sentence,token,semantic", help="Comma-separated splitters: sentence | token | semantic."),
+    sizes: str = typer.Option("128,256,512,1024", help="Comma-separated chunk sizes in tokens."),
+    overlaps: str = typer.Option("20", help="Comma-separated chunk overlaps in tokens."),
+    top_k: int = typer.Option(3, help="Chunks retrieved per question (SIMILARITY_TOP_K)."),
+    questions: str = typer.Option("", help="JSON file with a list of {question, file, answer} (default: the built-in set)."),
+    data_dir: str = typer.Option("", help="Folder of documents to chunk (default: lab1_rag/data)."),
+    max_prompt_tokens: int = typer.Option(0, help="Only pick a best config within this many prompt tokens per question (0: no limit)."),
+    embed_provider: str = typer.Option("", help="Embedding provider (mock | local). Default: the hashing mock."),
+    output: str = typer.Option(".cache/chunking_eval.json", help="Where to write the JSON results."),
+):
+    """
+    Sweeps splitters and chunk sizes over the policy PDFs and a question set.
+
+    Reports retrieval quality (hit rate, MRR) next to cost (embedded texts, index
+    bytes, prompt tokens) per configuration, and prints the best one as .env lines.
+    """
+    os.environ.update(OFFLINE_ENV)
+    if embed_provider:
+        os.environ["EMBED_PROVIDER"] = embed_provider
+    # Evaluation queries stay out of the app's query log.
+    os.environ["METRICS_LOG_PATH"] = ""
+
+    from llama_index.core import SimpleDirectoryReader
+    from shared.utils import ensure_settings
+    from lab1_rag.collection import embedding_dimensions
+    from lab1_rag.ingestion import iter_data_files
+    from lab1_rag.pipeline import CHUNK_OVERLAP, CHUNK_SIZE, CHUNK_SPLITTER, DATA_DIR, SPLITTERS
+
+    kinds = [kind.strip().lower() for kind in splitters.split(",")]
+    for kind in kinds:
+        if kind not in SPLITTERS:
+            raise typer.BadParameter(f"Unknown splitter '{kind}' (expected one of {SPLITTERS})")
+    eval_set = EVAL_SET
+    if questions:
+        with open(questions) as f:
+            eval_set = json.load(f)
+
+    settings = ensure_settings()
+    dim = embedding_dimensions()
+    # Parse every PDF once; each configuration only re-chunks.
+    files = [
+        (os.path.basename(path), SimpleDirectoryReader(input_files=[path]).load_data())
+        for path in iter_data_files(data_dir or DATA_DIR)
+    ]
+    counter = EmbeddingCounter()
+    get_dispatcher().add_event_handler(counter)
+
+    rows: List[Dict[str, Any]] = []
+    for kind, size, overlap in sweep(kinds, [int(s) for s in sizes.split(",")], [int(o) for o in overlaps.split(",")]):
+        console.print(f"[bold blue]{config_name(kind, size, overlap)}[/bold blue]")
+        rows.append(evaluate(kind, size, overlap, files, eval_set, top_k, dim, counter))
+
+    best = pick_best(rows, max_prompt_tokens)
+    table = Table(title=f"Chunking configurations ({len(files)} files, {len(eval_set)} questions, top-{top_k})")
+    for column in ("config", "chunks", "hit rate", "MRR", "embed calls", "embed texts", "index KB", "prompt tokens"):
+        table.add_column(column, justify="left" if column == "config" else "right")
+    for row in rows:
+        table.add_row(
+            f"[bold green]{row['config']}[/bold green]" if row is best else row["config"],
+            str(row["chunks"]), f"{row['hit_rate']:.0%}", f"{row['mrr']:.2f}",
+            str(row["embed_calls"]), str(row["embed_texts"]),
+            f"{row['index_bytes'] / 1024:.0f}", f"{row['prompt_tokens_per_query']:.0f}",
+        )
+    console.print(table)
+
+    if best is None:
+        console.print(f"[red]No configuration stays within {max_prompt_tokens} prompt tokens per question.[/red]")
+    else:
+        # What the app would use right now (.env, or the environment, which wins over .env).
+        current = env_lines({
+            "splitter": CHUNK_SPLITTER,
+            "chunk_size": None if CHUNK_SPLITTER == "semantic" else CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+        })
+        if env_lines(best) == current:
+            console.print(f"\nBest: [bold green]{best['config']}[/bold green], already your configuration.")
+        else:
+            console.print(
+                f"\nBest: [bold green]{best['config']}[/bold green]. Put this in .env "
+                f"(currently {', '.join(current)}) and re-ingest:"
+            )
+            console.print("\n".join(env_lines(best)))
+        for question in best["misses"]:
+            console.print(f"  [yellow]missed:[/yellow] {question}")
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embed_model": settings.embed_model.class_name(),
+            "top_k": top_k,
+            "questions": len(eval_set),
+            "max_prompt_tokens": max_prompt_tokens or None,
+        },
+        "rows": rows,
+        "best": None if best is None else {"config": best["config"], "env": env_lines(best)},
+    }
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"\n[green]Results written to {output}[/green]")
+
+
+if __name__ == "__main__":
+    app()
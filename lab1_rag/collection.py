@@ -0,0 +1,184 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Union
+
+from qdrant_client import models
+from llama_index.vector_stores.qdrant.base import DEFAULT_DENSE_VECTOR_NAME, DEFAULT_SPARSE_VECTOR_NAME
+
+from shared.qdrant import is_local_mode
+from lab1_rag.ingestion import TENANT_KEY
+
+# --- Collection Provisioning ---
+# Left to itself, LlamaIndex creates the collection on the first upsert with Qdrant's
+# defaults: full float32 vectors in RAM (4 bytes x dimensions per chunk), default HNSW
+# parameters and no payload indexes. That is most of the memory of a Qdrant node.
+# We create the collection ourselves instead, before LlamaIndex sees it, with the
+# settings below. LlamaIndex then simply finds an existing (empty) collection.
+#
+# Collection settings only apply when the collection is *created*: delete it and
+# re-ingest to change them. Search settings (ef, rescore, oversampling) apply at once.
+
+# Quantized vectors stay in RAM for the HNSW search; the originals can then live on
+# disk and are only read to rescore the few best candidates.
+QUANTIZATION_TYPES = ("none", "scalar", "binary")
+
+# Payload fields we filter on (metadata filters, incremental ingestion) and their types.
+# A payload index turns a filtered search from "scan every point's payload" into a lookup.
+PAYLOAD_INDEXES: Dict[str, Union[models.PayloadSchemaType, models.KeywordIndexParams]] = {
+    "doc_id": models.PayloadSchemaType.KEYWORD,  # LlamaIndex deletes by document id
+    "file_name": models.PayloadSchemaType.KEYWORD,
+    "page_label": models.PayloadSchemaType.KEYWORD,
+    # Extracted at ingestion for query routing (routing.py).
+    "category": models.PayloadSchemaType.KEYWORD,
+    "effective_date": models.PayloadSchemaType.KEYWORD,
+    "effective_year": models.PayloadSchemaType.INTEGER,
+    # Collections shared by several tenants (tenants.py): `is_tenant` makes Qdrant store
+    # each tenant's points together, so a tenant's search reads only its own segment.
+    TENANT_KEY: models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+}
+
+
+@dataclass
+class CollectionConfig:
+    """
+    How the Qdrant collection is stored and searched, read from `QDRANT_*` variables:
+
+    - QUANTIZATION: "none", "scalar" (int8, 4x smaller) or "binary" (1 bit, 32x smaller;
+      best for large embeddings, e.g. 1536 dimensions).
+    - QUANTIZATION_ALWAYS_RAM: keep the quantized vectors in RAM (recommended).
+    - ON_DISK: keep the original float32 vectors on disk (memory-mapped) instead of RAM.
+    - HNSW_M / HNSW_EF_CONSTRUCT / HNSW_ON_DISK: graph links per node, build-time
+      beam width, and whether the graph itself is memory-mapped.
+    - SEARCH_EF: search-time beam width (0 = Qdrant's default). Higher = better recall, slower.
+    - RESCORE / OVERSAMPLING: with quantization, fetch OVERSAMPLING x top_k candidates
+      with the quantized vectors, then rescore them with the originals.
+    """
+    quantization: str = "none"
+    quantization_always_ram: bool = True
+    on_disk: bool = False
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 100
+    hnsw_on_disk: bool = False
+    search_ef: int = 0
+    rescore: bool = True
+    oversampling: float = 2.0
+
+    @classmethod
+    def from_env(cls) -> "CollectionConfig":
+        config = cls(
+            quantization=os.getenv("QDRANT_QUANTIZATION", "none").lower(),
+            quantization_always_ram=os.getenv("QDRANT_QUANTIZATION_ALWAYS_RAM", "on").lower() == "on",
+            on_disk=os.getenv("QDRANT_ON_DISK", "off").lower() == "on",
+            hnsw_m=int(os.getenv("QDRANT_HNSW_M", "16")),
+            hnsw_ef_construct=int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100")),
+            hnsw_on_disk=os.getenv("QDRANT_HNSW_ON_DISK", "off").lower() == "on",
+            search_ef=int(os.getenv("QDRANT_SEARCH_EF", "0")),
+            rescore=os.getenv("QDRANT_RESCORE", "on").lower() == "on",
+            oversampling=float(os.getenv("QDRANT_OVERSAMPLING", "2.0")),
+        )
+        if config.quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unsupported QDRANT_QUANTIZATION: {config.quantization} (expected one of {QUANTIZATION_TYPES})")
+        return config
+
+    def with_changes(self, **changes) -> "CollectionConfig":
+        return replace(self, **changes)
+
+    def describe(self) -> str:
+        parts = [
+            f"quantization={self.quantization}",
+            f"vectors={'disk' if self.on_disk else 'ram'}",
+            f"m={self.hnsw_m}",
+            f"ef_construct={self.hnsw_ef_construct}",
+        ]
+        if self.hnsw_on_disk:
+            parts.append("hnsw=disk")
+        return ", ".join(parts)
+
+
+def quantization_config(config: CollectionConfig) -> Optional[models.QuantizationConfig]:
+    if config.quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                # Ignore the 1% most extreme values when choosing the int8 range.
+                quantile=0.99,
+                always_ram=config.quantization_always_ram,
+            )
+        )
+    if config.quantization == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=config.quantization_always_ram)
+        )
+    return None
+
+
+def dense_vector_params(config: CollectionConfig, vector_size: int) -> models.VectorParams:
+    return models.VectorParams(
+        size=vector_size,
+        distance=models.Distance.COSINE,
+        on_disk=config.on_disk,
+        hnsw_config=models.HnswConfigDiff(
+            m=config.hnsw_m,
+            ef_construct=config.hnsw_ef_construct,
+            on_disk=config.hnsw_on_disk,
+        ),
+    )
+
+
+def search_params(config: Optional[CollectionConfig] = None) -> Optional[models.SearchParams]:
+    """Search-time parameters for every query, or None to use Qdrant's defaults."""
+    config = config or CollectionConfig.from_env()
+    quantization = None
+    if config.quantization != "none":
+        quantization = models.QuantizationSearchParams(
+            rescore=config.rescore,
+            oversampling=config.oversampling if config.rescore else None,
+        )
+    if config.search_ef <= 0 and quantization is None:
+        return None
+    return models.SearchParams(hnsw_ef=config.search_ef or None, quantization=quantization)
+
+
+def embedding_dimensions() -> int:
+    """The output size of the configured embed model (one embedding, served from the cache next time)."""
+    from llama_index.core import Settings
+
+    return len(Settings.embed_model.get_text_embedding("dimension probe"))
+
+
+def provision_collection(
+    client,
+    collection_name: str,
+    hybrid: bool = False,
+    vector_size: Optional[int] = None,
+    config: Optional[CollectionConfig] = None,
+    sparse_config: Optional[models.SparseVectorParams] = None,
+) -> bool:
+    """
+    Creates the collection with the configured storage, HNSW and quantization settings,
+    plus payload indexes. Returns False (and changes nothing) if it already exists.
+
+    The vector layout matches what LlamaIndex would create itself: one unnamed dense
+    vector, or for hybrid collections a named dense vector next to a sparse one.
+    """
+    if client.collection_exists(collection_name):
+        return False
+    config = config or CollectionConfig.from_env()
+    vector_size = vector_size or embedding_dimensions()
+
+    dense = dense_vector_params(config, vector_size)
+    print(f"🧱 Creating collection '{collection_name}' ({vector_size} dimensions, {config.describe()})")
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config={DEFAULT_DENSE_VECTOR_NAME: dense} if hybrid else dense,
+        sparse_vectors_config={DEFAULT_SPARSE_VECTOR_NAME: sparse_config} if hybrid else None,
+        quantization_config=quantization_config(config),
+    )
+
+    # The in-process store (":memory:") has no payload indexes: it scans everything anyway.
+    if not is_local_mode():
+        for field_name, field_schema in PAYLOAD_INDEXES.items():
+            client.create_payload_index(
+                collection_name=collection_name, field_name=field_name, field_schema=field_schema
+            )
+    return True
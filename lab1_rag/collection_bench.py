@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import uuid
+import platform
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import typer
+from rich.console import Console
+from rich.table import Table
+from qdrant_client import models
+
+from lab1_rag.collection import CollectionConfig, provision_collection, search_params
+from lab1_rag.benchmark import git_commit, summarize_latencies
+from shared.qdrant import get_qdrant_client, is_local_mode
+
+# --- Recall vs Latency vs Memory ---
+# Every storage option trades one of the three for the others: quantization shrinks
+# the vectors held in RAM but approximates the distances, on-disk vectors free RAM but
+# make rescoring read from disk, and HNSW `ef` buys recall with latency. This benchmark
+# provisions one collection per storage option with the *same* code the app uses
+# (collection.py), fills it with synthetic clustered embeddings, and measures
+# recall@k against exact (brute-force) neighbours at several search `ef` values.
+#
+# It needs a Qdrant server (`docker-compose up -d`): the in-process ":memory:" store
+# ignores HNSW and quantization and always searches exhaustively.
+
+# Storage options compared by default (search-time options vary per row).
+STORAGE_CONFIGS: Dict[str, CollectionConfig] = {
+    "float32": CollectionConfig(),
+    "float32-disk": CollectionConfig(on_disk=True),
+    "scalar": CollectionConfig(quantization="scalar"),
+    "scalar-disk": CollectionConfig(quantization="scalar", on_disk=True),
+    "binary-disk": CollectionConfig(quantization="binary", on_disk=True),
+}
+
+app = typer.Typer()
+console = Console()
+
+
+def make_vectors(centers: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Unit vectors scattered around the given cluster centers.
+
+    Real embeddings are far from uniform: documents on the same topic crowd together.
+    Clustered data makes neighbours hard to tell apart, as they are in a real index.
+    """
+    noise = rng.standard_normal((count, centers.shape[1])).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.6 * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_neighbours(vectors: np.ndarray, queries: np.ndarray, top_k: int) -> List[set]:
+    """The true top-k of every query (cosine similarity of unit vectors = dot product)."""
+    scores = queries @ vectors.T
+    return [set(row) for row in np.argsort(-scores, axis=1)[:, :top_k].tolist()]
+
+
+def estimate_memory(config: CollectionConfig, count: int, dim: int) -> Dict[str, float]:
+    """
+    Estimated RAM and disk (MB) for the vectors and the HNSW graph.
+
+    Qdrant has no per-collection memory API, so we count what each option keeps in RAM:
+    float32 originals (4 bytes/dim), int8 (1 byte/dim) or binary (1 bit/dim) copies, and
+    about 2*m links of 4 bytes per point on the HNSW base layer.
+    """
+    original = count * dim * 4
+    quantized = {"none": 0, "scalar": count * dim, "binary": count * dim / 8}[config.quantization]
+    graph = count * config.hnsw_m * 2 * 4
+    ram = (0 if config.on_disk else original) + (graph if not config.hnsw_on_disk else 0)
+    ram += quantized if config.quantization_always_ram else 0
+    disk = original + quantized + graph  # everything is persisted; RAM is what stays resident
+    return {"ram_mb": ram / 1e6, "disk_mb": disk / 1e6}
+
+
+def fill_collection(
+    client, name: str, config: CollectionConfig, vectors: np.ndarray, batch_size: int, timeout_s: float = 1800
+) -> float:
+    """Provisions and fills one collection, waits for its HNSW index. Returns seconds taken."""
+    start = time.perf_counter()
+    provision_collection(client, name, vector_size=vectors.shape[1], config=config)
+    # Small benchmark collections would otherwise stay below Qdrant's indexing threshold
+    # and be searched exhaustively: force the HNSW graph to be built.
+    client.update_collection(name, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1))
+    for i in range(0, len(vectors), batch_size):
+        batch = vectors[i:i + batch_size]
+        client.upsert(
+            name,
+            points=models.Batch(ids=list(range(i, i + len(batch))), vectors=batch.tolist()),
+            wait=True,
+        )
+    while True:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN and (info.indexed_vectors_count or 0) >= len(vectors):
+            break
+        if time.perf_counter() - start > timeout_s:
+            raise TimeoutError(f"'{name}' was not indexed after {timeout_s:.0f}s")
+        time.sleep(0.5)
+    return time.perf_counter() - start
+
+
+def bench_search(client, name: str, params: Optional[models.SearchParams], queries: np.ndarray, truth: List[set], top_k: int) -> Dict[str, Any]:
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        points = client.query_points(name, query=query.tolist(), limit=top_k, search_params=params).points
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({p.id for p in points} & expected) / top_k)
+    return {"recall": sum(recalls) / len(recalls), **summarize_latencies(latencies)}
+
+
+@app.command()
+def main(
+    configs: str = typer.Option(",".join(STORAGE_CONFIGS), help=f"Comma-separated storage options ({', '.join(STORAGE_CONFIGS)})."),
+    num_vectors: int = typer.Option(20000, help="Points per collection."),
+    dim: int = typer.Option(1536, help="Vector size (1536 = OpenAI text-embedding-3-small / ada-002)."),
+    num_queries: int = typer.Option(200, help="Queries per row."),
+    top_k: int = typer.Option(10, help="Neighbours per query (recall@k)."),
+    efs: str = typer.Option("16,64,128", help="Comma-separated search-time HNSW ef values."),
+    hnsw_m: int = typer.Option(16, help="HNSW links per node for every collection."),
+    ef_construct: int = typer.Option(100, help="HNSW build-time beam width for every collection."),
+    oversampling: float = typer.Option(2.0, help="Candidates fetched per result before rescoring."),
+    batch_size: int = typer.Option(256, help="Upsert batch size."),
+    seed: int = typer.Option(0, help="Random seed for the synthetic data."),
+    output: str = typer.Option(".cache/collection_bench.json", help="Where to write the JSON results."),
+    keep: bool = typer.Option(False, help="Keep the benchmark collections afterwards."),
+):
+    """
+    Benchmarks recall@k, search latency and estimated memory per storage option.
+
+    Quantized collections are searched with and without rescoring. Needs a Qdrant server.
+    """
+    if is_local_mode():
+        console.print("[red]QDRANT_URL=:memory: ignores HNSW and quantization. Start Qdrant (docker-compose up -d).[/red]")
+        raise typer.Exit(code=1)
+
+    client = get_qdrant_client()
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(10, num_vectors // 200), dim)).astype(np.float32)
+    vectors = make_vectors(centers, num_vectors, rng)
+    queries = make_vectors(centers, num_queries, rng)
+    truth = exact_neighbours(vectors, queries, top_k)
+    ef_values = [int(e) for e in efs.split(",")]
+
+    rows: List[Dict[str, Any]] = []
+    for config_name in configs.split(","):
+        config = STORAGE_CONFIGS[config_name].with_changes(
+            hnsw_m=hnsw_m, hnsw_ef_construct=ef_construct, oversampling=oversampling
+        )
+        name = f"bench_{config_name.replace('-', '_')}_{uuid.uuid4().hex[:8]}"
+        console.print(f"\n[bold blue]{config_name}[/bold blue]: {config.describe()}")
+        try:
+            build_s = fill_collection(client, name, config, vectors, batch_size)
+            memory = estimate_memory(config, num_vectors, dim)
+            console.print(f"  built in {build_s:.1f}s, ~{memory['ram_mb']:.0f} MB RAM")
+            rescore_options = [True, False] if config.quantization != "none" else [True]
+            for ef in ef_values:
+                for rescore in rescore_options:
+                    params = search_params(config.with_changes(search_ef=ef, rescore=rescore))
+                    result = bench_search(client, name, params, queries, truth, top_k)
+                    rows.append({
+                        "config": config_name,
+                        "ef": ef,
+                        "rescore": rescore if config.quantization != "none" else None,
+                        "build_s": build_s,
+                        **memory,
+                        **result,
+                    })
+        finally:
+            if not keep:
+                client.delete_collection(name)
+
+    table = Table(title=f"recall@{top_k} vs latency vs memory ({num_vectors} x {dim})")
+    for column in ("config", "ef", "rescore", f"recall@{top_k}", "p50 ms", "p95 ms", "RAM MB", "disk MB"):
+        table.add_column(column, justify="left" if column == "config" else "right")
+    for row in rows:
+        table.add_row(
+            row["config"], str(row["ef"]), "-" if row["rescore"] is None else ("yes" if row["rescore"] else "no"),
+            f"{row['recall']:.3f}", f"{row['p50_ms']:.2f}", f"{row['p95_ms']:.2f}",
+            f"{row['ram_mb']:.0f}", f"{row['disk_mb']:.0f}",
+        )
+    console.print(table)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "num_vectors": num_vectors,
+            "dim": dim,
+            "num_queries": num_queries,
+            "top_k": top_k,
+            "hnsw_m": hnsw_m,
+            "ef_construct": ef_construct,
+            "oversampling": oversampling,
+        },
+        "rows": rows,
+    }
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"\n[green]Results written to {output}[/green]")
+
+
+if __name__ == "__main__":
+    app()
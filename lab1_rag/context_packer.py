@@ -0,0 +1,188 @@
+import os
+import re
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Set
+
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from lab1_rag.hybrid import tokenize
+from lab1_rag.metrics import count_tokens
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# --- Context Packing ---
+# A 1024-token chunk that answers "what is the team dinner limit?" usually does so in
+# one or two lines; the rest is the lodging table, the flight rules and the receipts
+# policy. The LLM still reads (and we still pay for) every token, and prefill time
+# grows with the prompt. The packer sits between retrieval and synthesis and rewrites
+# each retrieved chunk down to what matters for *this* question:
+#
+# 1. Split every chunk into sentences (PDF lines and bullet points count as sentences).
+# 2. Drop sentences already seen in a higher-ranked chunk (chunk overlap, repeated
+#    boilerplate, the same paragraph found by dense and sparse search).
+# 3. Score the rest by the question's terms they contain, rare terms weighing more.
+# 4. Take the best sentences, plus PACK_WINDOW neighbours each for context (headings,
+#    the line a bullet belongs to), until PACK_TOKEN_BUDGET is spent.
+# 5. Put the kept sentences back in document order, with "…" where text was cut.
+#
+# Each packed chunk keeps its node id, score and metadata, so the sources panel still
+# shows which file and page an answer came from (with the text the LLM actually saw).
+#
+# Settings:
+# - CONTEXT_PACKING: "on" to add the stage (off by default).
+# - PACK_TOKEN_BUDGET: tokens of chunk text sent to the LLM for one question.
+# - PACK_WINDOW: neighbouring sentences kept around every relevant sentence.
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "off").lower() == "on"
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "600"))
+PACK_WINDOW = int(os.getenv("PACK_WINDOW", "1"))
+
+# Sentence ends, or line breaks (PDF text puts headings and bullets on their own line).
+# A period after a digit is a section number ("1. Purpose"), not a sentence end.
+SENTENCE_BOUNDARY = re.compile(r"(?<=[^\d\s][.!?])\s+(?=[A-Z0-9\"'(-])|\s*\n+\s*")
+GAP_MARKER = "…"
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+
+
+def stem(token: str) -> str:
+    """A crude plural/tense folding, so "dinners" matches "dinner" and "rotated" "rotate"."""
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(token) > len(suffix) + 3 and token.endswith(suffix):
+            return token[: -len(suffix)]
+    return token
+
+
+def terms(text: str) -> Set[str]:
+    return {stem(t) for t in tokenize(text)}
+
+
+def _normalize(sentence: str) -> str:
+    return " ".join(sentence.lower().split())
+
+
+@dataclass
+class Sentence:
+    node: int  # rank of the chunk it comes from
+    position: int  # position inside that chunk
+    text: str
+    tokens: int
+    terms: Set[str]
+    score: float = 0.0
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """
+    Shrinks the retrieved chunks to the sentences relevant to the question, within a
+    token budget. Chunks left with no kept sentence are dropped.
+
+    Scoring is lexical (question terms weighted by their IDF among the candidate
+    sentences): it needs no model and adds well under a millisecond per chunk.
+    If no sentence shares a term with the question, the leading sentences of the
+    best chunks are kept instead, so the LLM is never left without context.
+    """
+
+    token_budget: int = Field(default=PACK_TOKEN_BUDGET)
+    window: int = Field(default=PACK_WINDOW)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if not nodes or query_bundle is None:
+            return nodes
+
+        sentences = self._unique_sentences(nodes)
+        if not sentences:
+            return nodes
+        self._score(sentences, terms(query_bundle.query_str))
+        kept = self._select(sentences)
+        return self._rebuild(nodes, sentences, kept)
+
+    def _unique_sentences(self, nodes: List[NodeWithScore]) -> List[Sentence]:
+        """Every sentence of every chunk, in rank order, skipping ones already seen."""
+        sentences: List[Sentence] = []
+        seen: Set[str] = set()
+        for rank, node in enumerate(nodes):
+            parts = split_sentences(node.node.get_content())
+            for position, text in enumerate(parts):
+                key = _normalize(text)
+                if key in seen:
+                    continue
+                # Overlapping chunks share a cut-off sentence at their edges: a prefix or
+                # suffix of a sentence we already have.
+                edge = position == 0 or position == len(parts) - 1
+                if edge and len(key) > 20 and any(key in other for other in seen):
+                    continue
+                seen.add(key)
+                sentences.append(Sentence(rank, position, text, count_tokens(text), terms(text)))
+        return sentences
+
+    @staticmethod
+    def _score(sentences: List[Sentence], query_terms: Set[str]) -> None:
+        # Document frequency among the candidates: "policy" is in every sentence and
+        # says nothing, "dinner" is in three and says a lot.
+        df = Counter(term for s in sentences for term in s.terms & query_terms)
+        n = len(sentences)
+        for s in sentences:
+            s.score = sum(math.log(1 + n / df[term]) for term in s.terms & query_terms)
+
+    def _select(self, sentences: List[Sentence]) -> Set[int]:
+        """Indices (into `sentences`) of the sentences that fit the budget, best first."""
+        by_place = {(s.node, s.position): i for i, s in enumerate(sentences)}
+        ranked = sorted(
+            (i for i, s in enumerate(sentences) if s.score > 0),
+            key=lambda i: (-sentences[i].score, sentences[i].node, sentences[i].position),
+        )
+        if not ranked:
+            # Nothing matches the question's words (e.g. a paraphrase): trust retrieval.
+            ranked = list(range(len(sentences)))
+
+        kept: Set[int] = set()
+        used = 0
+        for i in ranked:
+            s = sentences[i]
+            if i not in kept and used + s.tokens > self.token_budget:
+                continue  # a shorter, lower-scored sentence may still fit
+            group = [i] + [
+                by_place[(s.node, s.position + offset)]
+                for offset in range(-self.window, self.window + 1)
+                if offset != 0 and (s.node, s.position + offset) in by_place
+            ]
+            for j in group:
+                if j not in kept and used + sentences[j].tokens <= self.token_budget:
+                    kept.add(j)
+                    used += sentences[j].tokens
+            if used >= self.token_budget:
+                break
+        return kept
+
+    @staticmethod
+    def _rebuild(nodes: List[NodeWithScore], sentences: List[Sentence], kept: Set[int]) -> List[NodeWithScore]:
+        packed: List[NodeWithScore] = []
+        for rank, node in enumerate(nodes):
+            lines: List[str] = []
+            last_position = -1
+            for i, s in enumerate(sentences):
+                if s.node != rank or i not in kept:
+                    continue
+                if last_position >= 0 and s.position != last_position + 1:
+                    lines.append(GAP_MARKER)
+                lines.append(s.text)
+                last_position = s.position
+            if not lines:
+                continue
+            # A copy: the retrieved node may be shared (e.g. by a cached response).
+            chunk = node.node.model_copy()
+            chunk.set_content("\n".join(lines))
+            packed.append(NodeWithScore(node=chunk, score=node.score))
+        return packed
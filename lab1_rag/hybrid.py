@@ -0,0 +1,115 @@
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from qdrant_client import models
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+
+# --- Sparse (BM25) Encoding ---
+# Dense embeddings capture meaning, but they blur exact tokens: "$60", "MFA" or
+# "FileVault" are rare strings the embedding model has no strong opinion about.
+# A sparse vector keeps one dimension per *word*, so an exact-term query lands on the
+# chunk that literally contains it.
+#
+# We compute the BM25 term-frequency part here and let Qdrant apply the IDF part
+# (`Modifier.IDF` on the sparse vector config): Qdrant knows the document frequencies
+# of the whole collection, so IDF stays correct as documents are added or removed.
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Typical chunk length in tokens, used for BM25 length normalization.
+# (True BM25 uses the collection average; a fixed value keeps encoding stateless.)
+BM25_AVG_DOC_LEN = 200.0
+
+# Dollar amounts / numbers (keeping "$", "." and "%") or words.
+TOKEN_PATTERN = re.compile(r"\$?\d+(?:[.,]\d+)*%?|[a-z][a-z0-9]*(?:-[a-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its may must my "
+    "of on or our should that the their this to was what when where which who will "
+    "with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def token_id(token: str) -> int:
+    """Maps a token to a stable sparse dimension (CRC32, so ids survive restarts)."""
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def _to_sparse(weights: Dict[int, float]) -> Tuple[List[int], List[float]]:
+    indices = sorted(weights)
+    return indices, [weights[i] for i in indices]
+
+
+def bm25_doc_encoder(texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+    """Encodes chunks as BM25 term-frequency weights (`sparse_doc_fn` for QdrantVectorStore)."""
+    all_indices, all_values = [], []
+    for text in texts:
+        tokens = tokenize(text)
+        length_norm = 1 - BM25_B + BM25_B * len(tokens) / BM25_AVG_DOC_LEN
+        weights: Dict[int, float] = {}
+        for token, tf in Counter(tokens).items():
+            # Hash collisions are rare; if they happen, the two terms simply share weight.
+            tid = token_id(token)
+            weights[tid] = weights.get(tid, 0.0) + tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+        indices, values = _to_sparse(weights)
+        all_indices.append(indices)
+        all_values.append(values)
+    return all_indices, all_values
+
+
+def bm25_query_encoder(texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+    """Encodes queries as a set of terms with weight 1 (`sparse_query_fn`); Qdrant adds IDF."""
+    all_indices, all_values = [], []
+    for text in texts:
+        indices, values = _to_sparse({token_id(t): 1.0 for t in tokenize(text)})
+        all_indices.append(indices)
+        all_values.append(values)
+    return all_indices, all_values
+
+
+# The sparse vector config for new hybrid collections: IDF computed by Qdrant.
+BM25_SPARSE_CONFIG = models.SparseVectorParams(
+    index=models.SparseIndexParams(),
+    modifier=models.Modifier.IDF,
+)
+
+
+# --- Fusion ---
+# Dense cosine scores and BM25 scores live on different scales, so adding them is
+# meaningless. Reciprocal Rank Fusion only looks at *ranks*: a chunk ranked high by
+# either retriever scores well, and one ranked high by both scores best.
+
+RRF_K = 60  # the constant from the original RRF paper; dampens the weight of rank 1
+
+
+def reciprocal_rank_fusion(
+    dense_result: VectorStoreQueryResult,
+    sparse_result: VectorStoreQueryResult,
+    alpha: float = 0.5,
+    top_k: int = 2,
+) -> VectorStoreQueryResult:
+    """
+    `hybrid_fusion_fn` for QdrantVectorStore: fuses dense and sparse hits with RRF.
+
+    `alpha` is part of the fusion-function signature (used by score-based fusion);
+    rank fusion treats both retrievers equally and ignores it.
+    """
+    scores: Dict[str, float] = {}
+    nodes = {}
+    for result in (dense_result, sparse_result):
+        for rank, node in enumerate(result.nodes or [], start=1):
+            scores[node.node_id] = scores.get(node.node_id, 0.0) + 1.0 / (RRF_K + rank)
+            nodes[node.node_id] = node
+
+    best = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return VectorStoreQueryResult(
+        nodes=[nodes[node_id] for node_id in best],
+        similarities=[scores[node_id] for node_id in best],
+        ids=best,
+    )
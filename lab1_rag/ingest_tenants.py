@@ -0,0 +1,46 @@
+import time
+from typing import List
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+# --- Per-Tenant Ingestion ---
+# The app ingests a tenant lazily, on its first question. For many tenants (or large
+# ones) it is better to ingest ahead of time, e.g. from a nightly job, one tenant at
+# a time so one tenant's documents are never mixed into another's collection or payload:
+#
+#   uv run python -m lab1_rag.ingest_tenants                   # every tenant in TENANTS_DIR
+#   uv run python -m lab1_rag.ingest_tenants --tenant finance  # just one
+#
+# With the default "incremental" mode, a re-run only re-embeds the files that changed.
+
+app = typer.Typer()
+console = Console()
+
+
+@app.command()
+def main(
+    tenant: List[str] = typer.Option([], help="Tenant to ingest (repeatable). Default: every tenant."),
+    mode: str = typer.Option("incremental", help="Ingestion mode: smart | incremental | streaming."),
+):
+    """Ingests (or syncs) the documents of each tenant into its collection."""
+    from lab1_rag.pipeline import build_or_load_index, get_tenant
+    from lab1_rag.tenants import TENANCY, list_tenants
+
+    tenant_ids = tenant or list_tenants()
+    table = Table(title=f"Ingestion per tenant ({TENANCY} layout, {mode} mode)")
+    for column in ("tenant", "collection", "folder", "seconds"):
+        table.add_column(column, justify="right" if column == "seconds" else "left")
+
+    for tenant_id in tenant_ids:
+        resolved = get_tenant(tenant_id)
+        console.print(f"\n[bold blue]{tenant_id}[/bold blue] -> {resolved.collection_name}")
+        start = time.perf_counter()
+        build_or_load_index(mode=mode, tenant=resolved)
+        table.add_row(tenant_id, resolved.collection_name, resolved.data_dir, f"{time.perf_counter() - start:.1f}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,390 @@
+import os
+import uuid
+import hashlib
+import multiprocessing
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from qdrant_client import models
+from llama_index.core import Settings, SimpleDirectoryReader, VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.node_parser import NodeParser
+from llama_index.core.schema import BaseNode, Document, MetadataMode
+from llama_index.core.vector_stores.types import BasePydanticVectorStore
+
+from lab1_rag.routing import annotate_documents
+
+# Payload keys we add to every chunk so Qdrant itself becomes our manifest.
+# Storing the hashes next to the vectors (instead of in a sidecar file) means the
+# manifest can never drift away from what is actually indexed.
+FILE_HASH_KEY = "file_hash"
+CHUNK_HASH_KEY = "chunk_hash"
+
+# Payload key of the owning tenant, when several tenants share one collection
+# (see tenants.py). Collections with one tenant each leave it out.
+TENANT_KEY = "tenant_id"
+
+# A fixed namespace for deterministic point ids (uuid5). The same chunk of the same
+# file always gets the same id, so "is this chunk already indexed?" becomes a set lookup.
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a6e-5b1e-4d8a-9a53-0c6f3c1d2b7e")
+
+# Collection-level metadata key that changes every time ingestion writes to the
+# collection. Caches built on top of the index (e.g. the semantic answer cache)
+# compare it to know when their answers may be stale.
+INGESTION_VERSION_KEY = "ingestion_version"
+
+
+@dataclass
+class FileManifest:
+    """What Qdrant currently holds for one source file."""
+    file_hashes: Set[str] = field(default_factory=set)
+    point_ids: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class IngestionReport:
+    """Summary of one ingestion run, printed at the end of ingestion."""
+    unchanged_files: List[str] = field(default_factory=list)
+    changed_files: List[str] = field(default_factory=list)
+    removed_files: List[str] = field(default_factory=list)
+    embedded_chunks: int = 0
+    reused_chunks: int = 0
+    deleted_chunks: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"files: {len(self.unchanged_files)} unchanged, "
+            f"{len(self.changed_files)} new/changed, {len(self.removed_files)} removed | "
+            f"chunks: {self.embedded_chunks} embedded, {self.reused_chunks} reused, "
+            f"{self.deleted_chunks} deleted"
+        )
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file's bytes, read in 1 MB blocks so large PDFs don't sit in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_chunk(node: BaseNode) -> str:
+    """
+    SHA-256 of what makes a chunk unique: its text and the page it came from.
+
+    We deliberately leave out `file_path` and file dates, so moving the repo or
+    touching a file without editing it does not force a re-embed.
+    """
+    page_label = node.metadata.get("page_label", "")
+    return hashlib.sha256(f"{page_label}\n{node.get_content()}".encode("utf-8")).hexdigest()
+
+
+def iter_data_files(data_dir: str) -> Iterator[str]:
+    """Yields the path of every (non-hidden) file in the data directory, in name order."""
+    for file_name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, file_name)
+        if not file_name.startswith(".") and os.path.isfile(path):
+            yield path
+
+
+def scan_data_dir(data_dir: str) -> Dict[str, str]:
+    """Returns {file_name: file_hash} for every (non-hidden) file in the data directory."""
+    return {os.path.basename(path): hash_file(path) for path in iter_data_files(data_dir)}
+
+
+def tenant_filter(tenant_id: str) -> Optional[models.Filter]:
+    """The Qdrant filter selecting one tenant's points in a shared collection (None: no tenant)."""
+    if not tenant_id:
+        return None
+    return models.Filter(must=[models.FieldCondition(key=TENANT_KEY, match=models.MatchValue(value=tenant_id))])
+
+
+def tag_tenant(items: Iterable, tenant_id: str) -> None:
+    """Stamps documents or nodes with their tenant (kept out of the embedding and the prompt)."""
+    if not tenant_id:
+        return
+    for item in items:
+        item.metadata[TENANT_KEY] = tenant_id
+        item.excluded_embed_metadata_keys.append(TENANT_KEY)
+        item.excluded_llm_metadata_keys.append(TENANT_KEY)
+
+
+def load_manifest(client, collection_name: str, tenant_id: str = "") -> Dict[str, FileManifest]:
+    """
+    Rebuilds the per-file manifest from the payloads already stored in Qdrant.
+
+    We scroll with `with_vectors=False` and only the two payload keys we need,
+    so this stays cheap even for large collections. In a shared collection only
+    the tenant's own points are read: another tenant's files are not "removed".
+    """
+    manifest: Dict[str, FileManifest] = {}
+    if not client.collection_exists(collection_name):
+        return manifest
+
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=256,
+            offset=offset,
+            scroll_filter=tenant_filter(tenant_id),
+            with_payload=["file_name", FILE_HASH_KEY],
+            with_vectors=False,
+        )
+        for point in points:
+            payload = point.payload or {}
+            entry = manifest.setdefault(payload.get("file_name", ""), FileManifest())
+            # Chunks ingested before incremental mode existed have no hash:
+            # an empty hash never matches the file on disk, so they get replaced.
+            entry.file_hashes.add(payload.get(FILE_HASH_KEY, ""))
+            entry.point_ids.add(str(point.id))
+        if offset is None:
+            return manifest
+
+
+def parse_file(path: str) -> Tuple[str, str, List[Document]]:
+    """
+    Hashes and parses a single file. Returns (path, file_hash, documents).
+
+    This is a plain module-level function so it can run inside a worker process.
+    """
+    return path, hash_file(path), SimpleDirectoryReader(input_files=[path]).load_data()
+
+
+def chunk_documents(
+    file_name: str,
+    file_hash: str,
+    documents: List[Document],
+    splitter: NodeParser,
+    tenant_id: str = "",
+) -> List[BaseNode]:
+    """
+    Splits the documents of one file, stamping every chunk with its content hashes.
+
+    The node id is derived from (file name, chunk hash, occurrence), so re-chunking an
+    edited file yields the *same* ids for the paragraphs that did not change.
+    In a shared collection the tenant is part of the id too: two tenants may both
+    own a "policy_01_wfh.pdf", and must not overwrite each other's points.
+    """
+    # Category and effective date go into every chunk's payload, for filtered search.
+    documents = annotate_documents(documents)
+    tag_tenant(documents, tenant_id)
+    nodes = splitter.get_nodes_from_documents(documents)
+    id_prefix = f"{tenant_id}/{file_name}" if tenant_id else file_name
+
+    occurrences: Counter = Counter()
+    for node in nodes:
+        chunk_hash = hash_chunk(node)
+        # Identical boilerplate chunks in one file still need distinct ids.
+        occurrences[chunk_hash] += 1
+        node.id_ = str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{id_prefix}:{chunk_hash}:{occurrences[chunk_hash]}"))
+        node.metadata[FILE_HASH_KEY] = file_hash
+        node.metadata[CHUNK_HASH_KEY] = chunk_hash
+        # Hashes are bookkeeping only: keep them out of the embedding and the LLM prompt.
+        node.excluded_embed_metadata_keys.extend([FILE_HASH_KEY, CHUNK_HASH_KEY])
+        node.excluded_llm_metadata_keys.extend([FILE_HASH_KEY, CHUNK_HASH_KEY])
+    return nodes
+
+
+def chunk_file(path: str, file_hash: str, splitter: NodeParser, tenant_id: str = "") -> List[BaseNode]:
+    """Parses and splits a single file in the current process."""
+    documents = SimpleDirectoryReader(input_files=[path]).load_data()
+    return chunk_documents(os.path.basename(path), file_hash, documents, splitter, tenant_id)
+
+
+def _version_key(tenant_id: str) -> str:
+    # One version per tenant of a shared collection: re-ingesting one tenant must not
+    # flush the caches of all the others. (Qdrant merges collection metadata updates.)
+    return f"{INGESTION_VERSION_KEY}:{tenant_id}" if tenant_id else INGESTION_VERSION_KEY
+
+
+def get_ingestion_version(client, collection_name: str, tenant_id: str = "") -> str:
+    """Returns the collection's (or tenant's) current ingestion version ("" if never set)."""
+    if not client.collection_exists(collection_name):
+        return ""
+    metadata = client.get_collection(collection_name).config.metadata or {}
+    return metadata.get(_version_key(tenant_id), "")
+
+
+def bump_ingestion_version(client, collection_name: str, tenant_id: str = "") -> str:
+    """Stamps the collection (or tenant) with a fresh ingestion version and returns it."""
+    version = uuid.uuid4().hex
+    if client.collection_exists(collection_name):
+        client.update_collection(
+            collection_name=collection_name,
+            metadata={_version_key(tenant_id): version},
+        )
+    return version
+
+
+def delete_points(client, collection_name: str, point_ids: Set[str]) -> None:
+    """Deletes points by id (no-op for an empty set)."""
+    if point_ids:
+        client.delete(
+            collection_name=collection_name,
+            points_selector=models.PointIdsList(points=list(point_ids)),
+        )
+
+
+def sync_data_dir(
+    index: VectorStoreIndex,
+    client,
+    collection_name: str,
+    data_dir: str,
+    splitter: NodeParser,
+    tenant_id: str = "",
+) -> IngestionReport:
+    """
+    Brings the Qdrant collection (or one tenant's part of it) in line with the files in `data_dir`.
+
+    1. Hash every file on disk and compare with the manifest stored in Qdrant.
+    2. Unchanged files: skip them entirely (no parsing, no embedding).
+    3. New/changed files: re-chunk, embed only the chunks whose ids are not indexed yet,
+       then delete the chunks that disappeared from the file.
+    4. Removed files: delete all of their points.
+    """
+    report = IngestionReport()
+    on_disk = scan_data_dir(data_dir)
+    manifest = load_manifest(client, collection_name, tenant_id)
+
+    for file_name, file_hash in on_disk.items():
+        indexed = manifest.get(file_name, FileManifest())
+        if indexed.file_hashes == {file_hash}:
+            report.unchanged_files.append(file_name)
+            continue
+
+        report.changed_files.append(file_name)
+        nodes = chunk_file(os.path.join(data_dir, file_name), file_hash, splitter, tenant_id)
+        new_nodes = [n for n in nodes if n.node_id not in indexed.point_ids]
+        kept_ids = {n.node_id for n in nodes} & indexed.point_ids
+        stale_ids = indexed.point_ids - kept_ids
+
+        # Insert before deleting, so queries running during the sync never
+        # see a file with zero chunks.
+        if new_nodes:
+            index.insert_nodes(new_nodes)
+        if kept_ids:
+            # Reused chunks still carry the previous file hash; update it in place
+            # (a payload-only write, no re-embedding).
+            client.set_payload(
+                collection_name=collection_name,
+                payload={FILE_HASH_KEY: file_hash},
+                points=list(kept_ids),
+            )
+        delete_points(client, collection_name, stale_ids)
+
+        report.embedded_chunks += len(new_nodes)
+        report.reused_chunks += len(kept_ids)
+        report.deleted_chunks += len(stale_ids)
+
+    for file_name, indexed in manifest.items():
+        if file_name not in on_disk:
+            report.removed_files.append(file_name)
+            delete_points(client, collection_name, indexed.point_ids)
+            report.deleted_chunks += len(indexed.point_ids)
+
+    if report.changed_files or report.removed_files:
+        bump_ingestion_version(client, collection_name, tenant_id)
+    return report
+
+
+# --- Streaming Ingestion ---
+# `SimpleDirectoryReader(DATA_DIR).load_data()` + `from_documents` holds the whole
+# corpus (documents, then nodes, then embeddings) in memory at once and uses one core.
+# The functions below form a pipeline of generator stages instead:
+#
+#   parse (process pool) -> chunk -> embed (batched) -> upsert (batched)
+#
+# Every stage pulls from the previous one only when it needs more work, so at any
+# moment we hold at most a few parsed files and one batch of nodes: peak memory depends
+# on the window and batch sizes, not on the corpus size.
+
+
+def iter_parsed_files(
+    paths: Iterable[str], workers: int
+) -> Iterator[Tuple[str, str, List[Document]]]:
+    """
+    Stage 1: parses files in a process pool, yielding (path, file_hash, documents) in order.
+
+    Backpressure: we keep at most `2 * workers` files in flight. The pool never runs
+    ahead of the consumer by more than that, however many files `paths` yields.
+    """
+    # "spawn" gives every worker a clean interpreter; forking a process that already
+    # holds network clients (Qdrant, OpenAI) and their threads can deadlock.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        in_flight = deque()
+        for path in paths:
+            in_flight.append(pool.submit(parse_file, path))
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def iter_chunks(
+    parsed_files: Iterable[Tuple[str, str, List[Document]]], splitter: NodeParser, tenant_id: str = ""
+) -> Iterator[BaseNode]:
+    """Stage 2: splits each parsed file into hash-stamped chunks, one node at a time."""
+    for path, file_hash, documents in parsed_files:
+        yield from chunk_documents(os.path.basename(path), file_hash, documents, splitter, tenant_id)
+
+
+def iter_embedded_batches(
+    nodes: Iterable[BaseNode], embed_model: BaseEmbedding, batch_size: int
+) -> Iterator[List[BaseNode]]:
+    """Stage 3: groups nodes into fixed-size batches and embeds each batch in one call."""
+    batch: List[BaseNode] = []
+    for node in nodes:
+        batch.append(node)
+        if len(batch) == batch_size:
+            yield _embed_batch(batch, embed_model)
+            batch = []
+    if batch:
+        yield _embed_batch(batch, embed_model)
+
+
+def _embed_batch(batch: List[BaseNode], embed_model: BaseEmbedding) -> List[BaseNode]:
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+    for node, embedding in zip(batch, embed_model.get_text_embedding_batch(texts)):
+        node.embedding = embedding
+    return batch
+
+
+def stream_ingest(
+    vector_store: BasePydanticVectorStore,
+    paths: Iterable[str],
+    splitter: NodeParser,
+    embed_model: Optional[BaseEmbedding] = None,
+    workers: Optional[int] = None,
+    batch_size: int = 64,
+    tenant_id: str = "",
+) -> IngestionReport:
+    """
+    Stage 4: drives the pipeline and upserts every embedded batch as soon as it is ready.
+
+    While the main process waits on the embedding API or Qdrant, the worker pool
+    keeps parsing the next files, so I/O and CPU work overlap.
+    Chunks carry the same hashes and ids as incremental mode, so a collection built
+    here can later be kept up to date with `sync_data_dir`.
+    """
+    report = IngestionReport()
+    embed_model = embed_model or Settings.embed_model
+    workers = workers or os.cpu_count() or 1
+
+    def track_files(parsed_files):
+        for parsed in parsed_files:
+            report.changed_files.append(os.path.basename(parsed[0]))
+            yield parsed
+
+    parsed = track_files(iter_parsed_files(paths, workers))
+    for batch in iter_embedded_batches(iter_chunks(parsed, splitter, tenant_id), embed_model, batch_size):
+        vector_store.add(batch)
+        report.embedded_chunks += len(batch)
+        print(f"  ↳ upserted {report.embedded_chunks} chunks from {len(report.changed_files)} files")
+
+    bump_ingestion_version(vector_store.client, vector_store.collection_name, tenant_id)
+    return report
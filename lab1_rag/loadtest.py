@@ -0,0 +1,81 @@
+import time
+import asyncio
+from typing import List
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from lab1_rag.pipeline import get_query_engine
+
+app = typer.Typer()
+console = Console()
+
+# Questions cycled through by every simulated chat (the same ones offered in the UI).
+QUESTIONS = [
+    "What is the reimbursement limit for team dinners?",
+    "Can I use a personal device for work?",
+    "How many days a week must I be in the office?",
+    "How often must passwords be rotated?",
+    "What is the nightly lodging limit in Tier 1 cities?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile: the smallest value with at least pct% of values <= it."""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+async def simulate_chat(engine, chat_id: int, turns: int, use_sync: bool, latencies: List[float]):
+    """One user sending `turns` questions back to back, like a real chat session."""
+    for turn in range(turns):
+        question = QUESTIONS[(chat_id + turn) % len(QUESTIONS)]
+        start = time.perf_counter()
+        if use_sync:
+            # The old path: a blocking `query` parked on a worker thread.
+            await asyncio.to_thread(engine.query, question)
+        else:
+            await engine.aquery(question)
+        latencies.append(time.perf_counter() - start)
+
+
+@app.command()
+def main(
+    chats: int = typer.Option(8, help="Number of simultaneous chats."),
+    turns: int = typer.Option(3, help="Questions sent by each chat."),
+    use_sync: bool = typer.Option(False, "--sync", help="Use blocking query() on threads instead of aquery()."),
+    semantic_cache: bool = typer.Option(False, help="Keep the semantic cache on (hits skew latencies)."),
+):
+    """
+    Measures answer latency (p50/p95/p99) and throughput under N simultaneous chats.
+
+    Runs against the real configured LLM and Qdrant, exactly like the Gradio app does.
+    """
+    engine = get_query_engine(semantic_cache=semantic_cache)
+    latencies: List[float] = []
+
+    async def run_all():
+        await asyncio.gather(
+            *(simulate_chat(engine, i, turns, use_sync, latencies) for i in range(chats))
+        )
+
+    console.print(f"[italic]Running {chats} chats x {turns} turns ({'sync' if use_sync else 'async'})...[/italic]")
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    wall = time.perf_counter() - start
+
+    table = Table(title="RAG latency under concurrent chats")
+    table.add_column("metric")
+    table.add_column("value", justify="right")
+    table.add_row("queries", str(len(latencies)))
+    table.add_row("p50 (s)", f"{percentile(latencies, 50):.3f}")
+    table.add_row("p95 (s)", f"{percentile(latencies, 95):.3f}")
+    table.add_row("p99 (s)", f"{percentile(latencies, 99):.3f}")
+    table.add_row("throughput (q/s)", f"{len(latencies) / wall:.2f}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    app()
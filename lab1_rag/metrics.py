@@ -0,0 +1,420 @@
+import os
+import json
+import queue
+import atexit
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events import BaseEvent
+from llama_index.core.instrumentation.events.embedding import EmbeddingEndEvent, EmbeddingStartEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatEndEvent,
+    LLMChatStartEvent,
+    LLMCompletionEndEvent,
+    LLMCompletionStartEvent,
+)
+from llama_index.core.instrumentation.events.rerank import ReRankEndEvent, ReRankStartEvent
+from llama_index.core.instrumentation.events.retrieval import RetrievalEndEvent, RetrievalStartEvent
+from llama_index.core.instrumentation.events.synthesis import SynthesizeEndEvent, SynthesizeStartEvent
+
+from shared.gateway import claim_hedge_win
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# Observability settings:
+# - METRICS_LOG_PATH: one JSON line per answered query, e.g. ".cache/rag_queries.jsonl".
+#   Off (empty) by default: the log contains the users' questions verbatim.
+METRICS_LOG_PATH = os.getenv("METRICS_LOG_PATH", "")
+
+# Histogram buckets in seconds: from a cached embedding (ms) to a slow local LLM (a minute).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+NODE_BUCKETS = (0, 1, 2, 3, 5, 10, 20)
+
+
+# --- Per-Query Trace ---
+# "The assistant is slow" is not actionable; "the LLM took 4.1 s of a 4.3 s answer" is.
+# A QueryTrace collects everything we know about one question while it is answered:
+# how long each stage took, how many tokens went in and out, how many chunks were
+# retrieved and whether the semantic cache answered it.
+
+@dataclass
+class QueryTrace:
+    query: str
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: float = field(default_factory=time.time)
+    # Accumulated seconds per stage: queue, embed, search, rerank, synthesize, llm, first_token, total.
+    stages: Dict[str, float] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retrieved_nodes: int = 0
+    cache_hit: Optional[bool] = None  # None: no semantic cache in front of the engine
+    tenant: Optional[str] = None  # None: the default tenant
+    filters: Optional[str] = None  # metadata filters chosen by the query router, if any
+    error: Optional[str] = None
+    # Start times of the stages currently running, keyed by (stage, span id).
+    _open: Dict[Tuple[str, str], float] = field(default_factory=dict, repr=False)
+    _clock: float = field(default_factory=time.perf_counter, repr=False)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._clock
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def mark(self, stage: str) -> None:
+        """Records the time since the query started, e.g. the time to first token."""
+        self.stages.setdefault(stage, self.elapsed())
+
+    def observe_response(self, response: Any) -> None:
+        """Reads retrieved-node count and cache hit/miss off a (streaming) response."""
+        self.retrieved_nodes = len(getattr(response, "source_nodes", None) or [])
+        metadata = getattr(response, "metadata", None) or {}
+        if "semantic_cache_hit" in metadata:
+            self.cache_hit = bool(metadata["semantic_cache_hit"])
+        self.filters = metadata.get("query_filters", self.filters)
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)),
+            "request_id": self.request_id,
+            "query": self.query,
+            "tenant": self.tenant,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "cache": _cache_label(self.cache_hit),
+            "retrieved_nodes": self.retrieved_nodes,
+            "filters": self.filters,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "stages_ms": {stage: round(s * 1000, 2) for stage, s in self.stages.items()},
+        }
+
+
+def _cache_label(cache_hit: Optional[bool]) -> str:
+    return "off" if cache_hit is None else ("hit" if cache_hit else "miss")
+
+
+# The trace of the query being answered in the current thread / asyncio task.
+# LlamaIndex events carry no request id, so this is how an event finds "its" query.
+_current_trace: contextvars.ContextVar[Optional[QueryTrace]] = contextvars.ContextVar(
+    "rag_query_trace", default=None
+)
+
+
+def current_trace() -> Optional[QueryTrace]:
+    return _current_trace.get()
+
+
+# --- Stage Timing via LlamaIndex Instrumentation ---
+# LlamaIndex emits start/end events around every embedding, retrieval, rerank, synthesis
+# and LLM call. Listening to them times each stage *inside* `query_engine.query` without
+# touching the engine: the same handler works for dense, hybrid and cached engines.
+
+STAGE_EVENTS = {
+    EmbeddingStartEvent: ("embed", True),
+    EmbeddingEndEvent: ("embed", False),
+    RetrievalStartEvent: ("retrieve", True),
+    RetrievalEndEvent: ("retrieve", False),
+    ReRankStartEvent: ("rerank", True),
+    ReRankEndEvent: ("rerank", False),
+    SynthesizeStartEvent: ("synthesize", True),
+    SynthesizeEndEvent: ("synthesize", False),
+    LLMChatStartEvent: ("llm", True),
+    LLMChatEndEvent: ("llm", False),
+    LLMCompletionStartEvent: ("llm", True),
+    LLMCompletionEndEvent: ("llm", False),
+}
+
+
+class StageTimingHandler(BaseEventHandler):
+    """Adds LlamaIndex event timings and token counts to the active QueryTrace."""
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StageTimingHandler"
+
+    def handle(self, event: BaseEvent, **kwargs: Any) -> None:
+        trace = _current_trace.get()
+        stage = STAGE_EVENTS.get(type(event))
+        if trace is None or stage is None:
+            return  # not inside a traced query (e.g. ingestion)
+
+        name, is_start = stage
+        key = (name, event.span_id or "")
+        if is_start:
+            trace._open[key] = time.perf_counter()
+            if name == "llm":
+                trace._open[("llm_prompt", key[1])] = _prompt_tokens(event)
+            return
+
+        started = trace._open.pop(key, None)
+        if started is None:
+            return
+        if name == "llm" and not claim_hedge_win():
+            # The duplicate of a hedged call (shared/gateway.py) whose answer was thrown
+            # away: counting its time and tokens would bill the query twice.
+            trace._open.pop(("llm_prompt", key[1]), None)
+            return
+        seconds = time.perf_counter() - started
+        trace.add_stage(name, seconds)
+
+        # The query embedding usually runs *inside* retrieval. We keep it apart, so that
+        # "search" is the vector database alone (see `finish_trace`).
+        if name == "embed" and any(open_stage == "retrieve" for open_stage, _ in trace._open):
+            trace.add_stage("embed_in_retrieve", seconds)
+
+        if name == "llm":
+            estimated_prompt = trace._open.pop(("llm_prompt", key[1]), 0)
+            prompt, completion = _usage(event.response)
+            trace.prompt_tokens += prompt if prompt is not None else estimated_prompt
+            trace.completion_tokens += (
+                completion if completion is not None else count_tokens(_response_text(event.response))
+            )
+
+
+def _usage(response: Any) -> Tuple[Optional[int], Optional[int]]:
+    """Token usage as reported by the provider (OpenAI `usage`, Ollama eval counts)."""
+    raw = getattr(response, "raw", None)
+    if raw is None:
+        return None, None
+    if not isinstance(raw, dict):
+        raw = raw.model_dump() if hasattr(raw, "model_dump") else getattr(raw, "__dict__", {})
+    usage = raw.get("usage") or {}
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else {}
+    if usage.get("prompt_tokens") is not None:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    if raw.get("prompt_eval_count") is not None:
+        return raw.get("prompt_eval_count"), raw.get("eval_count")
+    return None, None
+
+
+def _response_text(response: Any) -> str:
+    message = getattr(response, "message", None)
+    if message is not None:
+        return message.content or ""
+    return getattr(response, "text", None) or ""
+
+
+def _prompt_tokens(event: BaseEvent) -> int:
+    if isinstance(event, LLMChatStartEvent):
+        return count_tokens("\n".join(m.content or "" for m in event.messages))
+    return count_tokens(getattr(event, "prompt", ""))
+
+
+def count_tokens(text: str) -> int:
+    """
+    Fallback when the provider reports no usage (e.g. streamed OpenAI answers, MockLLM):
+    count with the global tokenizer, or estimate ~4 characters per token without one.
+    """
+    if not text:
+        return 0
+    try:
+        return len(Settings.tokenizer(text))
+    except Exception:
+        return max(1, len(text) // 4)
+
+
+_handler_lock = threading.Lock()
+_handler: Optional[StageTimingHandler] = None
+
+
+def install_event_handler() -> None:
+    """Registers the StageTimingHandler on LlamaIndex's root dispatcher (once)."""
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            _handler = StageTimingHandler()
+            get_dispatcher().add_event_handler(_handler)
+
+
+# --- Prometheus-Style Registry ---
+# Prometheus (or `curl`) scrapes plain text: counters and cumulative histograms.
+# We keep them in process memory with a lock; no client library needed.
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries: Dict[Tuple[str, str], int] = {}  # (cache, status) -> count
+        self.tokens: Dict[str, int] = {"prompt": 0, "completion": 0}
+        self.stage_seconds: Dict[str, Histogram] = {}
+        self.retrieved_nodes = Histogram(NODE_BUCKETS)
+
+    def observe(self, trace: QueryTrace) -> None:
+        with self._lock:
+            key = (_cache_label(trace.cache_hit), "error" if trace.error else "ok")
+            self.queries[key] = self.queries.get(key, 0) + 1
+            self.tokens["prompt"] += trace.prompt_tokens
+            self.tokens["completion"] += trace.completion_tokens
+            for stage, seconds in trace.stages.items():
+                self.stage_seconds.setdefault(stage, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.retrieved_nodes.observe(trace.retrieved_nodes)
+
+    def render(self) -> str:
+        """The Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                "# HELP rag_queries_total Answered RAG queries.",
+                "# TYPE rag_queries_total counter",
+            ]
+            for (cache, status), count in sorted(self.queries.items()):
+                lines.append(f'rag_queries_total{{cache="{cache}",status="{status}"}} {count}')
+
+            lines += ["# HELP rag_tokens_total LLM tokens used.", "# TYPE rag_tokens_total counter"]
+            for kind, count in self.tokens.items():
+                lines.append(f'rag_tokens_total{{kind="{kind}"}} {count}')
+
+            lines += [
+                "# HELP rag_stage_seconds Time spent per query stage.",
+                "# TYPE rag_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stage_seconds.items()):
+                lines += _render_histogram("rag_stage_seconds", histogram, f'stage="{stage}"')
+
+            lines += [
+                "# HELP rag_retrieved_nodes Chunks passed to synthesis per query.",
+                "# TYPE rag_retrieved_nodes histogram",
+            ]
+            lines += _render_histogram("rag_retrieved_nodes", self.retrieved_nodes)
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(name: str, histogram: Histogram, labels: str = "") -> List[str]:
+    prefix = f"{labels}," if labels else ""
+    lines = [
+        f'{name}_bucket{{{prefix}le="{bound}"}} {count}'
+        for bound, count in zip(histogram.buckets, histogram.counts)
+    ]
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.total}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+REGISTRY = MetricsRegistry()
+
+
+# --- Structured Log ---
+# The registry answers "how is it going overall"; the JSONL log answers "what happened
+# to *this* question". Each line is one query, easy to grep, `jq` or load in pandas.
+#
+# Traces finish on the server's event loop (the last token of a streamed answer), where
+# a file append would block every other chat. Records are queued instead, and one
+# writer thread appends whatever is waiting, with a single write per batch.
+
+_log_queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+_log_writer: Optional[threading.Thread] = None
+_log_writer_lock = threading.Lock()
+
+
+def _write_log_batches() -> None:
+    while True:
+        batch = [_log_queue.get()]
+        while True:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        lines: Dict[str, List[str]] = {}
+        for path, record in batch:
+            lines.setdefault(path, []).append(json.dumps(record) + "\n")
+        for path, path_lines in lines.items():
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, "a") as f:
+                    f.writelines(path_lines)
+            except OSError as e:
+                print(f"⚠️ Could not write the query log {path}: {e}")
+        for _ in batch:
+            _log_queue.task_done()
+
+
+def flush_query_log() -> None:
+    """Waits until every queued record is written (e.g. before reading the log)."""
+    if _log_writer is not None:
+        _log_queue.join()
+
+
+def write_query_log(trace: QueryTrace, path: Optional[str] = None) -> None:
+    """Queues the trace's record for the log at `path` (default METRICS_LOG_PATH); never blocks."""
+    global _log_writer
+    path = METRICS_LOG_PATH if path is None else path
+    if not path:
+        return
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = threading.Thread(target=_write_log_batches, name="query-log", daemon=True)
+                _log_writer.start()
+                atexit.register(flush_query_log)
+    _log_queue.put((path, trace.to_record()))
+
+
+def finish_trace(trace: QueryTrace) -> None:
+    """Derives the summary stages, then updates the registry and the query log."""
+    trace.stages["total"] = trace.elapsed()
+    if "retrieve" in trace.stages:
+        trace.stages["search"] = max(0.0, trace.stages.pop("retrieve") - trace.stages.pop("embed_in_retrieve", 0.0))
+    trace.stages.pop("embed_in_retrieve", None)
+    REGISTRY.observe(trace)
+    write_query_log(trace)
+
+
+@contextmanager
+def track_query(query: str, submitted_at: Optional[float] = None, tenant: Optional[str] = None) -> Iterator[QueryTrace]:
+    """
+    Traces one question from submission to last token.
+
+        with track_query(message) as trace:
+            response = query_engine.query(message)
+            trace.observe_response(response)
+
+    `submitted_at` (a `time.time()` timestamp) is when the user pressed Enter: the gap
+    until now is the time the request waited in the Gradio queue.
+    """
+    install_event_handler()
+    trace = QueryTrace(query=query, tenant=tenant)
+    if submitted_at is not None:
+        trace.add_stage("queue", max(0.0, trace.started_at - submitted_at))
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_trace.reset(token)
+        finish_trace(trace)
+
+
+# --- /metrics Endpoint ---
+# Served by the app itself (app.py), next to /healthz and /ready: one port to expose,
+# and nothing that can fail to bind while the app is warming up.
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
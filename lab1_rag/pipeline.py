@@ -1,5 +1,5 @@
 import os
-import qdrant_client
+from typing import Optional
 from llama_index.core import (
     VectorStoreIndex,
     SimpleDirectoryReader,
@@ -7,33 +7,158 @@ from llama_index.core import (
     load_index_from_storage,
 )
 from llama_index.vector_stores.qdrant import QdrantVectorStore
-from llama_index.core.node_parser import SentenceSplitter
-from shared.utils import init_settings
+from llama_index.core.node_parser import NodeParser, SemanticSplitterNodeParser, SentenceSplitter, TokenTextSplitter
+from shared.utils import ensure_settings
+from shared.qdrant import get_async_qdrant_client, get_qdrant_client
+from lab1_rag.ingestion import (
+    bump_ingestion_version,
+    get_ingestion_version,
+    iter_data_files,
+    stream_ingest,
+    sync_data_dir,
+    tag_tenant,
+    tenant_filter,
+)
+from lab1_rag.semantic_cache import SemanticCache, SemanticCacheQueryEngine
+from lab1_rag.metrics import install_event_handler
+from lab1_rag.collection import provision_collection, search_params
+from lab1_rag.rerank import RERANK, RERANK_CANDIDATES, get_reranker
+from lab1_rag.routing import QUERY_ROUTING, RoutedQueryEngine, annotate_documents, filters_key
+from lab1_rag.context_packer import CONTEXT_PACKING, ContextPacker
+from lab1_rag.tenants import DEFAULT_TENANT, Tenant, make_tenant
+from lab1_rag.hybrid import (
+    BM25_SPARSE_CONFIG,
+    bm25_doc_encoder,
+    bm25_query_encoder,
+    reciprocal_rank_fusion,
+)
+from shared.env import load_env
 
-# Initialize Global Settings (LLM & Embeddings)
-init_settings()
+load_env()  # before any setting below is read (see shared/env.py)
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
-COLLECTION_NAME = "practical_ai_policies"
+# The collection of the default tenant; with several tenants, the shared collection
+# or the prefix of every tenant's own collection (see tenants.py).
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "practical_ai_policies")
+
+# Ingestion mode:
+# - "smart" (default): ingest everything only if the collection is empty.
+# - "incremental": hash files and chunks, and only re-embed what changed.
+# - "streaming": like "smart", but large corpora are ingested through a parallel,
+#   bounded-memory pipeline instead of one big `from_documents` call.
+INGESTION_MODE = os.getenv("INGESTION_MODE", "smart").lower()
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# Chunking (see get_splitter). `python -m lab1_rag.chunking_eval` measures the options
+# on a set of questions and prints the values to put here.
+# - CHUNK_SPLITTER: "sentence" (default), "token" or "semantic".
+# - CHUNK_SIZE / CHUNK_OVERLAP: in tokens (ignored by "semantic").
+CHUNK_SPLITTER = os.getenv("CHUNK_SPLITTER", "sentence").lower()
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1024"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "20"))
+SPLITTERS = ("sentence", "token", "semantic")
+
+# Semantic answer cache (off by default): near-duplicate questions reuse a previous answer.
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "off").lower() == "on"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL_S = float(os.getenv("SEMANTIC_CACHE_TTL_S", "3600"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+
+# Token streaming: the UI shows the answer while the LLM is still writing it.
+RAG_STREAMING = os.getenv("RAG_STREAMING", "on").lower() == "on"
 
-def get_vector_store():
+# Retrieval mode:
+# - "dense" (default): embedding similarity only.
+# - "hybrid": dense + sparse (BM25) search, fused with Reciprocal Rank Fusion.
+#   Each retriever fetches HYBRID_CANDIDATES chunks; the best SIMILARITY_TOP_K survive.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense").lower()
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+
+def collection_supports_hybrid(client, collection_name: str = COLLECTION_NAME) -> bool:
+    """
+    A collection can only serve hybrid queries if it was *created* with a sparse vector.
+    A missing collection is fine: it will be created with one on first ingestion.
+    """
+    if not client.collection_exists(collection_name):
+        return True
+    sparse_vectors = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    return len(sparse_vectors) > 0
+
+def get_vector_store(hybrid: bool = RETRIEVAL_MODE == "hybrid", collection_name: str = COLLECTION_NAME):
     """
     Creates and returns the QdrantVectorStore instance.
     
     We use a specific collection name to identify our data in Qdrant.
+
+    With hybrid=True every chunk also gets a sparse BM25 vector at ingestion time
+    (see lab1_rag/hybrid.py), stored next to its dense vector in the same point.
     """
-    # Create a Qdrant client instance
-    client = qdrant_client.QdrantClient(url=QDRANT_URL)
+    # Reuse the process-wide Qdrant clients (see shared/qdrant.py): ingestion upserts
+    # and query-time searches share one pool of keep-alive connections (HTTP or gRPC).
+    client = get_qdrant_client()
+    # ...and its async twin: `query_engine.aquery` searches Qdrant through it,
+    # so the app can await the search instead of blocking a worker thread.
+    # (With QDRANT_URL=:memory: LlamaIndex warns that the two clients are not synced;
+    # ours share one in-process store, see `get_async_qdrant_client`.)
+    aclient = get_async_qdrant_client()
     
+    if hybrid and not collection_supports_hybrid(client, collection_name):
+        print(
+            f"⚠️ Collection '{collection_name}' has no sparse vectors. "
+            "Delete it and re-ingest to use hybrid retrieval. Falling back to dense retrieval."
+        )
+        hybrid = False
+
+    # A new collection is created with our storage settings (quantization, on-disk
+    # vectors, HNSW, payload indexes; see collection.py) *before* LlamaIndex sees it.
+    provision_collection(client, collection_name, hybrid=hybrid, sparse_config=BM25_SPARSE_CONFIG)
+
     # Create the VectorStore wrapper around Qdrant
+    hybrid_kwargs = {}
+    if hybrid:
+        hybrid_kwargs = dict(
+            enable_hybrid=True,
+            sparse_doc_fn=bm25_doc_encoder,
+            sparse_query_fn=bm25_query_encoder,
+            sparse_config=BM25_SPARSE_CONFIG,
+            hybrid_fusion_fn=reciprocal_rank_fusion,
+        )
     vector_store = QdrantVectorStore(
         client=client, 
-        collection_name=COLLECTION_NAME
+        aclient=aclient,
+        collection_name=collection_name,
+        **hybrid_kwargs,
     )
     return vector_store, client
 
-def build_or_load_index():
+def get_tenant(tenant_id: str = DEFAULT_TENANT) -> Tenant:
+    """Resolves a tenant id to its documents folder and Qdrant collection (see tenants.py)."""
+    return make_tenant(tenant_id, COLLECTION_NAME, DATA_DIR)
+
+def get_splitter(kind: str = CHUNK_SPLITTER, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> NodeParser:
+    """
+    Returns the chunking strategy shared by every ingestion path.
+
+    We explicitly define a splitter to control chunk size/overlap.
+    Chunk size 1024 is a good balance for policy docs.
+
+    - "sentence": packs whole sentences up to `chunk_size` tokens.
+    - "token": cuts every `chunk_size` tokens, wherever that falls.
+    - "semantic": cuts where the embedding of consecutive sentences changes most, so
+      chunk boundaries follow topics. It embeds every sentence once while chunking.
+    """
+    if kind == "sentence":
+        return SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if kind == "token":
+        return TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if kind == "semantic":
+        return SemanticSplitterNodeParser(embed_model=ensure_settings().embed_model)
+    raise ValueError(f"Unsupported CHUNK_SPLITTER: {kind} (expected one of {SPLITTERS})")
+
+def build_or_load_index(mode: str = INGESTION_MODE, tenant: Optional[Tenant] = None):
     """
     Implements 'Smart Loading' strategy for the RAG pipeline.
     
@@ -41,23 +166,45 @@ def build_or_load_index():
     2. Checks if our collection already exists and has data.
     3. If YES: Load the index directly from the vector store (Zero Ingestion).
     4. If NO: Load PDFs, chunk them, index them, and upsert to Qdrant.
+
+    With mode="incremental", steps 2-4 are replaced by a content-hash sync:
+    only new or edited files are re-chunked, only their changed chunks are
+    re-embedded, and chunks of deleted files are removed from Qdrant.
+
+    `tenant` selects whose documents and collection (default: the default tenant).
+    In a shared collection, "has data" and every sync only look at the tenant's points.
     
     Returns:
         VectorStoreIndex: The queryable index.
     """
+    # Global Settings (LLM & Embeddings) are initialized on first use, not at import.
+    ensure_settings()
+    tenant = tenant or get_tenant()
+    collection_name, data_dir, tenant_id = tenant.collection_name, tenant.data_dir, tenant.payload_id
     print(f"Connecting to Qdrant at {QDRANT_URL}...")
-    vector_store, client = get_vector_store()
+    vector_store, client = get_vector_store(collection_name=collection_name)
+
+    if mode == "incremental":
+        if not os.path.exists(data_dir):
+            raise FileNotFoundError(f"Data directory not found at: {data_dir}")
+
+        print(f"🔄 Incremental mode: syncing '{collection_name}' with {data_dir}...")
+        index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
+        report = sync_data_dir(index, client, collection_name, data_dir, get_splitter(), tenant_id)
+        print(f"✅ Sync complete ({report}).")
+        return index
     
     # Smart Loading: Check if collection exists
     # Qdrant client `get_collections` returns an object with a list of collections
     try:
         collections = client.get_collections()
         collection_names = [c.name for c in collections.collections]
-        exists = COLLECTION_NAME in collection_names
+        exists = collection_name in collection_names
         
-        # If exists, check if it's not empty (count > 0)
+        # If exists, check if it's not empty (count > 0); in a shared collection,
+        # only this tenant's points count.
         if exists:
-            count_result = client.count(collection_name=COLLECTION_NAME)
+            count_result = client.count(collection_name=collection_name, count_filter=tenant_filter(tenant_id))
             if count_result.count == 0:
                 exists = False # Exists but empty, so we treat as new
     except Exception as e:
@@ -65,27 +212,42 @@ def build_or_load_index():
         exists = False
 
     if exists:
-        print(f"✅ Collection '{COLLECTION_NAME}' found. Loading existing index...")
+        print(f"✅ Collection '{collection_name}' found. Loading existing index...")
         # To load from an existing vector store, we create a StorageContext with it
         # and use VectorStoreIndex.from_vector_store
         storage_context = StorageContext.from_defaults(vector_store=vector_store)
         index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
         return index
     else:
-        print(f"⚠️ Collection '{COLLECTION_NAME}' not found or empty. Starting ingestion...")
+        print(f"⚠️ Collection '{collection_name}' not found or empty. Starting ingestion...")
         
         # 1. Load Data
-        if not os.path.exists(DATA_DIR):
-            raise FileNotFoundError(f"Data directory not found at: {DATA_DIR}")
+        if not os.path.exists(data_dir):
+            raise FileNotFoundError(f"Data directory not found at: {data_dir}")
             
-        print(f"Loading documents from {DATA_DIR}...")
-        documents = SimpleDirectoryReader(DATA_DIR).load_data()
+        if mode == "streaming":
+            print(f"Streaming documents from {data_dir} ({INGEST_WORKERS} workers, batches of {INGEST_BATCH_SIZE})...")
+            report = stream_ingest(
+                vector_store,
+                iter_data_files(data_dir),
+                get_splitter(),
+                workers=INGEST_WORKERS,
+                batch_size=INGEST_BATCH_SIZE,
+                tenant_id=tenant_id,
+            )
+            print(f"✅ Ingestion complete ({report}).")
+            return VectorStoreIndex.from_vector_store(vector_store=vector_store)
+
+        print(f"Loading documents from {data_dir}...")
+        documents = SimpleDirectoryReader(data_dir).load_data()
         print(f"Loaded {len(documents)} documents.")
+        # Category and effective date (and the tenant, in a shared collection) go into
+        # every chunk's payload, for filtered search.
+        annotate_documents(documents)
+        tag_tenant(documents, tenant_id)
         
-        # 2. Chunking Strategy
-        # We explicitly define a splitter to control chunk size/overlap.
-        # Chunk size 1024 is a good balance for policy docs.
-        splitter = SentenceSplitter(chunk_size=1024, chunk_overlap=20)
+        # 2. Chunking Strategy (see get_splitter)
+        splitter = get_splitter()
         
         # 3. Create Index (Ingestion)
         # This step automatically:
@@ -100,21 +262,117 @@ def build_or_load_index():
             transformations=[splitter],
             show_progress=True
         )
+        bump_ingestion_version(client, collection_name, tenant_id)
         print("✅ Ingestion complete.")
         return index
 
-def get_query_engine():
+def get_query_engine(
+    semantic_cache: bool = SEMANTIC_CACHE,
+    streaming: bool = False,
+    rerank: bool = RERANK,
+    routing: str = QUERY_ROUTING,
+    packing: bool = CONTEXT_PACKING,
+    tenant_id: str = DEFAULT_TENANT,
+):
     """
     Returns a query engine configured for the workshop.
+
+    With semantic_cache=True the engine is wrapped in a SemanticCacheQueryEngine:
+    questions that mean the same as a recent one (and have the same metadata
+    filters) are answered from memory, without retrieval or an LLM call.
+
+    With streaming=True, `query`/`aquery` return as soon as retrieval is done, with
+    the source nodes filled in and a token generator for the answer
+    (StreamingResponse / AsyncStreamingResponse).
+
+    With rerank=True, retrieval fetches RERANK_CANDIDATES chunks and a local
+    cross-encoder keeps the best RERANK_TOP_N for the LLM (see rerank.py).
+
+    With packing=True, every retrieved chunk is cut down to the sentences relevant to
+    the question, within PACK_TOKEN_BUDGET tokens (see context_packer.py).
+
+    With routing="explicit" or "auto", a RoutedQueryEngine turns filters written in
+    (or inferred from) the question into a filtered Qdrant search (see routing.py).
+
+    `tenant_id` selects whose documents are searched (see tenants.py); in a shared
+    collection every search is filtered on the tenant.
+
+    Queries run inside `metrics.track_query(...)` get per-stage timings and token
+    counts: the engine's LlamaIndex events are routed to the active trace.
     """
-    index = build_or_load_index()
-    
-    # retrieval_mode='embedding' is standard for dense vector retrieval
-    # similarity_top_k=3 gives us the 3 most relevant chunks
-    return index.as_query_engine(
-        similarity_top_k=3,
-        vector_store_query_mode="default" # standard dense retrieval
-    )
+    install_event_handler()
+    tenant = get_tenant(tenant_id)
+    index = build_or_load_index(tenant=tenant)
+
+    # Search-time HNSW `ef` and quantization rescoring (see collection.py), if configured.
+    retrieval_kwargs = {}
+    params = search_params()
+    if params is not None:
+        retrieval_kwargs["vector_store_kwargs"] = {"search_params": params}
+
+    # With a reranker, retrieval casts a wide net and the cross-encoder picks the few
+    # chunks the LLM reads; without one, retrieval alone decides.
+    top_k = SIMILARITY_TOP_K
+    postprocessors = []
+    if rerank:
+        top_k = RERANK_CANDIDATES
+        postprocessors.append(get_reranker())
+    # The packer runs last: it trims the chunks that will actually reach the LLM.
+    if packing:
+        postprocessors.append(ContextPacker())
+    if postprocessors:
+        retrieval_kwargs["node_postprocessors"] = postprocessors
+
+    cache = None
+    if semantic_cache:
+        print(f"Enabling semantic cache (threshold={SEMANTIC_CACHE_THRESHOLD})")
+        client = index.vector_store.client
+        cache = SemanticCache(
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            ttl_s=SEMANTIC_CACHE_TTL_S,
+            max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            # Re-ingestion bumps this version, which flushes answers built on old documents.
+            version_fn=lambda: get_ingestion_version(client, tenant.collection_name, tenant.payload_id),
+        )
+
+    def make_engine(filters=None):
+        engine = make_search_engine(tenant.scope(filters))
+        if cache is None:
+            return engine
+        # The cache sits *behind* the router: it sees the question without its inline
+        # filters, and answers only questions routed to the same filters (its scope).
+        return SemanticCacheQueryEngine(engine, cache, scope=filters_key(filters))
+
+    def make_search_engine(filters):
+        if index.vector_store.enable_hybrid:
+            # Hybrid: dense and sparse search each return HYBRID_CANDIDATES chunks,
+            # RRF fuses the two rankings, and only the top SIMILARITY_TOP_K reach the LLM.
+            return index.as_query_engine(
+                vector_store_query_mode="hybrid",
+                similarity_top_k=max(HYBRID_CANDIDATES, top_k),
+                sparse_top_k=max(HYBRID_CANDIDATES, top_k),
+                hybrid_top_k=top_k,
+                streaming=streaming,
+                filters=filters,
+                **retrieval_kwargs,
+            )
+        # retrieval_mode='embedding' is standard for dense vector retrieval
+        # similarity_top_k=3 gives us the 3 most relevant chunks
+        return index.as_query_engine(
+            similarity_top_k=top_k,
+            vector_store_query_mode="default", # standard dense retrieval
+            streaming=streaming,
+            filters=filters,
+            **retrieval_kwargs,
+        )
+
+    if routing == "off":
+        query_engine = make_engine()
+    else:
+        # Metadata filters from the question are pushed down into the Qdrant search.
+        query_engine = RoutedQueryEngine(make_engine, mode=routing)
+
+    return query_engine
 
 if __name__ == "__main__":
     # Simple test to ensure pipeline works
@@ -0,0 +1,203 @@
+import os
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.events.rerank import ReRankEndEvent, ReRankStartEvent
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from shared.local_embedding import MicroBatcher
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# --- Reranking ---
+# Dense retrieval is fast but coarse: the query and each chunk are embedded separately,
+# so the best chunk is often ranked 5th or 20th. A cross-encoder reads the question
+# and a chunk *together* and scores how well the chunk answers it: much more precise,
+# but far too slow to run on the whole collection. So we do both:
+#
+#   Qdrant: RERANK_CANDIDATES (e.g. 30) cheap candidates -> cross-encoder -> best RERANK_TOP_N -> LLM
+#
+# The LLM then reads 3 chunks that matter instead of 10 that might, which cuts prompt
+# tokens and generation latency. The cross-encoder runs locally on the CPU.
+#
+# Settings:
+# - RERANK: "on" to add the stage (off by default).
+# - RERANK_MODEL: any sentence-transformers CrossEncoder.
+# - RERANK_CANDIDATES / RERANK_TOP_N: chunks retrieved / chunks kept for synthesis.
+# - RERANK_BATCH_SIZE: (query, chunk) pairs per forward pass.
+# - RERANK_THREADS: CPU threads for inference (0 = runtime default).
+# - RERANK_CACHE_SIZE: (query, chunk) scores kept in memory (0 = no cache).
+RERANK = os.getenv("RERANK", "off").lower() == "on"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", "0"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+
+dispatcher = get_dispatcher(__name__)
+
+
+class ScoreCache:
+    """
+    A thread-safe LRU map of (query, chunk text) -> cross-encoder score.
+
+    Popular questions come back again and again with the same candidates (and the
+    semantic cache only catches the *answer*, when it is on). A cached score costs a
+    dictionary lookup instead of a transformer forward pass.
+    """
+
+    def __init__(self, max_entries: int = RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, query: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\x00{query}\x00{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is None:
+                self.misses += 1
+                return None
+            self._scores.move_to_end(key)
+            self.hits += 1
+            return score
+
+    def put(self, key: str, score: float) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_entries:
+                self._scores.popitem(last=False)
+
+
+class CrossEncoderRerank(BaseNodePostprocessor):
+    """
+    Re-scores the retrieved nodes with a local cross-encoder and keeps the best `top_n`.
+
+    - The model is loaded lazily, on the first query.
+    - All (query, chunk) pairs of a query are scored in batched forward passes, and
+      concurrent queries share batches through a `MicroBatcher`.
+    - Scores are cached per (model, query, chunk text).
+
+    The node's `score` becomes the cross-encoder score: a relevance logit, higher is
+    better, not bounded to [0, 1].
+    """
+
+    model: str = Field(default=RERANK_MODEL)
+    top_n: int = Field(default=RERANK_TOP_N)
+    batch_size: int = Field(default=RERANK_BATCH_SIZE)
+    num_threads: int = Field(default=RERANK_THREADS)
+    device: str = Field(default="cpu")
+
+    _cross_encoder: Any = PrivateAttr(default=None)
+    _load_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batcher: MicroBatcher = PrivateAttr()
+    _cache: ScoreCache = PrivateAttr()
+
+    def __init__(self, cache_size: int = RERANK_CACHE_SIZE, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._batcher = MicroBatcher(self._predict, max_batch=self.batch_size)
+        self._cache = ScoreCache(cache_size)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CrossEncoderRerank"
+
+    @property
+    def cache(self) -> ScoreCache:
+        return self._cache
+
+    def load(self):
+        """Loads the cross-encoder now (it is otherwise loaded on the first query)."""
+        with self._load_lock:
+            if self._cross_encoder is None:
+                try:
+                    import torch
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise ImportError("The reranker needs sentence-transformers: run `uv sync --extra local`.") from e
+                if self.num_threads > 0:
+                    torch.set_num_threads(self.num_threads)
+                print(f"🧠 Loading reranker {self.model} ({self.device})...")
+                self._cross_encoder = CrossEncoder(self.model, device=self.device)
+        return self._cross_encoder
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        # Runs on the batcher thread, so model loading and inference never run twice at once.
+        scores = self.load().predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def _prepare(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle]):
+        """Looks up cached scores; returns (keys, scores with None for misses, missing pairs)."""
+        if query_bundle is None:
+            raise ValueError("Reranking needs the query.")
+        query = query_bundle.query_str
+        texts = [n.node.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes]
+        keys = [ScoreCache.make_key(self.model, query, text) for text in texts]
+        scores = [self._cache.get(key) for key in keys]
+        missing = [(query, text) for text, score in zip(texts, scores) if score is None]
+        return keys, scores, missing
+
+    def _finish(self, nodes, keys, scores, computed: List[float]) -> List[NodeWithScore]:
+        computed_iter = iter(computed)
+        for i, key in enumerate(keys):
+            if scores[i] is None:
+                scores[i] = next(computed_iter)
+                self._cache.put(key, scores[i])
+
+        reranked = [NodeWithScore(node=n.node, score=score) for n, score in zip(nodes, scores)]
+        reranked.sort(key=lambda n: n.score, reverse=True)
+        return reranked[: self.top_n]
+
+    def _postprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        if not nodes:
+            return []
+        dispatcher.event(ReRankStartEvent(query=query_bundle, nodes=nodes, top_n=self.top_n, model_name=self.model))
+        keys, scores, missing = self._prepare(nodes, query_bundle)
+        computed = self._batcher.submit(missing).result()
+        reranked = self._finish(nodes, keys, scores, computed)
+        dispatcher.event(ReRankEndEvent(nodes=reranked))
+        return reranked
+
+    async def _apostprocess_nodes(
+        self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None
+    ) -> List[NodeWithScore]:
+        # Same work, but the event loop keeps serving other chats while the model runs.
+        if not nodes:
+            return []
+        dispatcher.event(ReRankStartEvent(query=query_bundle, nodes=nodes, top_n=self.top_n, model_name=self.model))
+        keys, scores, missing = self._prepare(nodes, query_bundle)
+        computed = await asyncio.wrap_future(self._batcher.submit(missing))
+        reranked = self._finish(nodes, keys, scores, computed)
+        dispatcher.event(ReRankEndEvent(nodes=reranked))
+        return reranked
+
+
+_reranker: Optional[CrossEncoderRerank] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> CrossEncoderRerank:
+    """The process-wide reranker: every query engine shares one model and one score cache."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = CrossEncoderRerank()
+        return _reranker
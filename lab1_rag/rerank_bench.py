@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import platform
+from typing import Any, Dict, List, Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from lab1_rag.benchmark import OFFLINE_ENV, git_commit, summarize_latencies
+
+# --- Plain top-k vs Rerank vs Packing ---
+# Reranking adds a stage (a cross-encoder over ~30 chunks) to shrink another (the LLM
+# reading 3 chunks instead of 10). Whether that pays off depends on the LLM: with a
+# remote model, prompt tokens are money and prefill time; with the offline mock LLM,
+# synthesis is free and the benchmark shows the reranker's raw cost. This script runs
+# the same questions through each setup and compares prompt tokens per query and
+# end-to-end latency, using the per-stage traces from metrics.py.
+#
+# Every setup also runs with the context packer (context_packer.py), which shrinks
+# the chunks to the sentences relevant to the question instead of dropping chunks.
+#
+# The cross-encoder needs the optional `local` dependencies (`uv sync --extra local`);
+# `--no-rerank` compares plain top-k with and without packing only.
+
+app = typer.Typer()
+console = Console()
+
+
+def bench_setup(index, questions: List[str], repeats: int, top_k: int, postprocessors: List[Any]) -> Dict[str, Any]:
+    """Answers every question `repeats` times; latencies, tokens and stage timings."""
+    from lab1_rag.metrics import track_query
+
+    query_engine = index.as_query_engine(similarity_top_k=top_k, node_postprocessors=postprocessors)
+    latencies, prompt_tokens, nodes = [], [], []
+    stages: Dict[str, List[float]] = {}
+    for _ in range(repeats):
+        for question in questions:
+            start = time.perf_counter()
+            with track_query(question) as trace:
+                response = query_engine.query(question)
+                trace.observe_response(response)
+            latencies.append(time.perf_counter() - start)
+            prompt_tokens.append(trace.prompt_tokens)
+            nodes.append(trace.retrieved_nodes)
+            for stage in ("search", "rerank", "llm"):
+                if stage in trace.stages:
+                    stages.setdefault(stage, []).append(trace.stages[stage] * 1000)
+    return {
+        "queries": len(latencies),
+        "prompt_tokens_per_query": sum(prompt_tokens) / len(prompt_tokens),
+        "nodes_per_query": sum(nodes) / len(nodes),
+        "stage_mean_ms": {stage: sum(values) / len(values) for stage, values in stages.items()},
+        **summarize_latencies(latencies),
+    }
+
+
+@app.command()
+def main(
+    top_ks: str = typer.Option("3,10", help="Comma-separated similarity_top_k values without reranking."),
+    candidates: int = typer.Option(30, help="Chunks retrieved for the reranker."),
+    top_n: int = typer.Option(3, help="Chunks the reranker keeps for synthesis."),
+    model: str = typer.Option("", help="Cross-encoder model (default: RERANK_MODEL)."),
+    repeats: int = typer.Option(3, help="How many times the question set is run per setup."),
+    score_cache: bool = typer.Option(False, help="Keep the score cache on (repeats then skip the cross-encoder)."),
+    rerank: bool = typer.Option(True, help="Include the rerank setup (needs the `local` extra)."),
+    pack: bool = typer.Option(True, help="Also run every setup with the context packer."),
+    pack_budget: int = typer.Option(600, help="Token budget of the context packer."),
+    output: str = typer.Option(".cache/rerank_bench.json", help="Where to write the JSON results."),
+    live: bool = typer.Option(False, help="Use the models and Qdrant configured in .env instead of offline mocks."),
+):
+    """
+    Compares plain top-k retrieval, retrieve-then-rerank and context packing on the
+    workshop questions.
+
+    Reports prompt tokens per query and end-to-end latency (p50/p95) for each setup.
+    """
+    if not live:
+        os.environ.update(OFFLINE_ENV)
+    # Benchmark queries stay out of the app's query log.
+    os.environ["METRICS_LOG_PATH"] = ""
+
+    from lab1_rag.loadtest import QUESTIONS
+    from lab1_rag.pipeline import build_or_load_index
+    from lab1_rag.rerank import RERANK_MODEL, CrossEncoderRerank
+    from lab1_rag.context_packer import ContextPacker
+
+    index = build_or_load_index()
+    setups: List[tuple] = [(f"top-{k}", k, []) for k in (int(k) for k in top_ks.split(","))]
+    reranker, load_s = None, None
+    if rerank:
+        reranker = CrossEncoderRerank(model=model or RERANK_MODEL, top_n=top_n, cache_size=10000 if score_cache else 0)
+        # Load the model before timing anything: the first query must not pay for it.
+        start = time.perf_counter()
+        reranker.load()
+        load_s = time.perf_counter() - start
+        console.print(f"Reranker loaded in {load_s:.2f}s")
+        setups.append((f"rerank {candidates}->{top_n}", candidates, [reranker]))
+    if pack:
+        packer = ContextPacker(token_budget=pack_budget)
+        setups += [(f"{name} + pack", top_k, [*postprocessors, packer]) for name, top_k, postprocessors in setups]
+
+    rows: List[Dict[str, Any]] = []
+    for name, top_k, postprocessors in setups:
+        console.print(f"[bold blue]{name}[/bold blue]")
+        rows.append({"setup": name, "top_k": top_k, **bench_setup(index, QUESTIONS, repeats, top_k, postprocessors)})
+
+    table = Table(title=f"Synthesis context per setup ({len(QUESTIONS)} questions x {repeats})")
+    for column in ("setup", "chunks", "prompt tokens", "p50 ms", "p95 ms", "rerank ms", "llm ms"):
+        table.add_column(column, justify="left" if column == "setup" else "right")
+    for row in rows:
+        stage_ms: Dict[str, Optional[float]] = row["stage_mean_ms"]
+        table.add_row(
+            row["setup"], f"{row['nodes_per_query']:.1f}", f"{row['prompt_tokens_per_query']:.0f}",
+            f"{row['p50_ms']:.1f}", f"{row['p95_ms']:.1f}",
+            f"{stage_ms['rerank']:.1f}" if "rerank" in stage_ms else "-",
+            f"{stage_ms['llm']:.1f}" if "llm" in stage_ms else "-",
+        )
+    console.print(table)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": "live" if live else "offline",
+            "rerank_model": reranker.model if reranker is not None else None,
+            "rerank_load_s": load_s,
+            "score_cache": score_cache,
+            "pack_budget": pack_budget if pack else None,
+            "repeats": repeats,
+        },
+        "rows": rows,
+    }
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    console.print(f"\n[green]Results written to {output}[/green]")
+
+
+if __name__ == "__main__":
+    app()
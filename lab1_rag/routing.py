@@ -0,0 +1,242 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import RESPONSE_TYPE
+from llama_index.core.prompts.mixin import PromptMixinType
+from llama_index.core.schema import Document, QueryBundle
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# --- Metadata-Filtered Retrieval ---
+# Most questions are about one policy: "team dinner limit" is an expenses question and
+# "password rotation" a security one. Searching only the chunks of that policy means a
+# smaller candidate set for Qdrant, and no chunk of an unrelated policy can take a seat
+# in the prompt. It takes two halves:
+#
+# 1. Ingestion: every chunk gets a `category`, `effective_date` and `effective_year`
+#    in its payload (next to `file_name`), extracted from the document text.
+# 2. Query: a router turns the question into Qdrant filters, and the search runs with
+#    them. Payload indexes on these fields (collection.py) make the filter a lookup.
+#
+# QUERY_ROUTING:
+# - "explicit" (default): only filters written in the question, e.g.
+#   "category:expenses what is the dinner limit?", "file:policy_03_security.pdf ...",
+#   "year:2024 ...".
+# - "auto": explicit filters, otherwise the category is inferred from the question's
+#   keywords when exactly one category matches. If that filter finds nothing (e.g. a
+#   collection ingested before categories existed), the question is searched unfiltered.
+# - "off": always search the whole collection.
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "explicit").lower()
+ROUTING_MODES = ("off", "explicit", "auto")
+
+# Keywords per policy category, matched at the start of a word ("reimburs" matches
+# "reimbursed"). The same table labels documents at ingestion and routes questions.
+POLICY_CATEGORIES: Dict[str, Tuple[str, ...]] = {
+    "wfh": (
+        "work from home", "wfh", "remote", "hybrid", "in the office", "office days",
+        "anchor day", "home office", "stipend", "collaboration hours", "childcare",
+    ),
+    "expenses": (
+        "expense", "reimburs", "per diem", "travel", "flight", "lodging", "hotel",
+        "meal", "dinner", "lunch", "receipt", "mileage", "expensify",
+    ),
+    "security": (
+        "password", "security", "mfa", "authenticat", "encrypt", "vpn", "phishing",
+        "malware", "breach", "device", "usb", "data classification",
+    ),
+}
+DEFAULT_CATEGORY = "general"
+
+# Payload keys added at ingestion. They are kept out of the embedded text, so vectors
+# (and the embedding cache) stay exactly what they were before.
+METADATA_KEYS = ("category", "effective_date", "effective_year")
+
+_CATEGORY_PATTERNS = {
+    category: re.compile(r"\b(?:" + "|".join(re.escape(k) for k in keywords) + r")", re.IGNORECASE)
+    for category, keywords in POLICY_CATEGORIES.items()
+}
+_EFFECTIVE_DATE = re.compile(
+    r"effective(?:\s+date)?\s*:?\s*(\d{4}-\d{2}-\d{2}|[A-Z][a-z]+\.?\s+\d{1,2},\s*\d{4})", re.IGNORECASE
+)
+# Inline filters: `category:expenses`, `file:policy_02_expenses.pdf`, `year:2024`.
+_INLINE_FILTER = re.compile(r"(?<!\S)(category|file|year):(\S+)", re.IGNORECASE)
+
+
+def keyword_hits(text: str) -> Dict[str, int]:
+    """How many category keywords occur in `text`, per category."""
+    return {category: len(pattern.findall(text)) for category, pattern in _CATEGORY_PATTERNS.items()}
+
+
+def classify_text(text: str) -> str:
+    """The category whose keywords occur most often in a document ("general" if none)."""
+    hits = keyword_hits(text)
+    best = max(hits, key=hits.get)
+    return best if hits[best] > 0 else DEFAULT_CATEGORY
+
+
+def parse_effective_date(text: str) -> Optional[str]:
+    """The first "Effective Date: January 1, 2024" (or ISO date) in the text, as YYYY-MM-DD."""
+    match = _EFFECTIVE_DATE.search(text)
+    if match is None:
+        return None
+    value = match.group(1).replace(".", "")
+    for fmt in ("%Y-%m-%d", "%B %d, %Y", "%b %d, %Y", "%B %d,%Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def annotate_documents(documents: List[Document]) -> List[Document]:
+    """
+    Stamps every document with its file's category and effective date (in place).
+
+    A PDF is loaded as one Document per page, and only the first page says when the
+    policy took effect, so the metadata is extracted per *file* and shared by its pages.
+    """
+    pages_by_file: Dict[str, List[Document]] = defaultdict(list)
+    for document in documents:
+        pages_by_file[document.metadata.get("file_name", document.doc_id)].append(document)
+
+    for pages in pages_by_file.values():
+        text = "\n".join(page.text for page in pages)
+        metadata = {"category": classify_text(text)}
+        effective_date = parse_effective_date(text)
+        if effective_date is not None:
+            metadata["effective_date"] = effective_date
+            metadata["effective_year"] = int(effective_date[:4])
+        for page in pages:
+            page.metadata.update(metadata)
+            for key in METADATA_KEYS:
+                if key not in page.excluded_embed_metadata_keys:
+                    page.excluded_embed_metadata_keys.append(key)
+    return documents
+
+
+# --- Query Routing ---
+
+@dataclass
+class Route:
+    """Where one question is searched: its text without inline filters, and the filters."""
+    query: str
+    filters: Optional[MetadataFilters] = None
+    inferred: bool = False
+
+    def describe(self) -> str:
+        if self.filters is None:
+            return "all documents"
+        conditions = ", ".join(f"{f.key}={f.value}" for f in self.filters.filters)
+        return f"{conditions} ({'inferred' if self.inferred else 'explicit'})"
+
+
+def route_query(query: str, mode: str = QUERY_ROUTING) -> Route:
+    """Extracts the metadata filters of a question (see QUERY_ROUTING)."""
+    if mode == "off":
+        return Route(query=query)
+
+    conditions: List[MetadataFilter] = []
+    for key, value in _INLINE_FILTER.findall(query):
+        key = key.lower()
+        if key == "category":
+            conditions.append(MetadataFilter(key="category", value=value.lower()))
+        elif key == "file":
+            conditions.append(MetadataFilter(key="file_name", value=value))
+        elif key == "year" and value.isdigit():
+            conditions.append(MetadataFilter(key="effective_year", value=int(value), operator=FilterOperator.EQ))
+    if conditions:
+        text = " ".join(_INLINE_FILTER.sub(" ", query).split())
+        return Route(query=text or query, filters=MetadataFilters(filters=conditions))
+
+    if mode == "auto":
+        matched = [category for category, hits in keyword_hits(query).items() if hits > 0]
+        if len(matched) == 1:
+            return Route(query=query, filters=MetadataFilters(filters=[MetadataFilter(key="category", value=matched[0])]), inferred=True)
+    return Route(query=query)
+
+
+def filters_key(filters: Optional[MetadataFilters]) -> str:
+    """A stable string for a set of filters ("" for none): engine and cache key."""
+    return "" if filters is None else json.dumps(filters.model_dump(mode="json"), sort_keys=True)
+
+
+class RoutedQueryEngine(BaseQueryEngine):
+    """
+    Routes every question to a query engine whose retriever carries its filters.
+
+    Filters are fixed when a retriever is built, and one engine serves many chats at
+    once, so we cannot change them per call. Instead `engine_factory(filters)` builds
+    one engine per distinct set of filters; there are only a handful (one per
+    category, file or year), and the last `max_engines` are kept.
+
+    The route is recorded in `response.metadata["query_filters"]`.
+    """
+
+    def __init__(
+        self,
+        engine_factory: Callable[[Optional[MetadataFilters]], BaseQueryEngine],
+        mode: str = QUERY_ROUTING,
+        max_engines: int = 32,
+    ):
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unsupported QUERY_ROUTING: {mode} (expected one of {ROUTING_MODES})")
+        self._engine_factory = engine_factory
+        self._mode = mode
+        self._max_engines = max_engines
+        self._engines: "OrderedDict[str, BaseQueryEngine]" = OrderedDict()
+        self._lock = threading.Lock()
+        unfiltered = self._engine_for(None)
+        super().__init__(callback_manager=unfiltered.callback_manager)
+
+    def _get_prompt_modules(self) -> PromptMixinType:
+        return {"query_engine": self._engine_for(None)}
+
+    def _engine_for(self, filters: Optional[MetadataFilters]) -> BaseQueryEngine:
+        key = filters_key(filters)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._engine_factory(filters)
+                self._engines[key] = engine
+            self._engines.move_to_end(key)
+            while len(self._engines) > self._max_engines:
+                self._engines.popitem(last=False)
+            return engine
+
+    def _route(self, query_bundle: QueryBundle) -> Tuple[Route, QueryBundle]:
+        route = route_query(query_bundle.query_str, self._mode)
+        if route.query != query_bundle.query_str:
+            # The inline filters are not part of the question: embed it without them.
+            query_bundle = QueryBundle(query_str=route.query)
+        return route, query_bundle
+
+    @staticmethod
+    def _tag(response: RESPONSE_TYPE, route: Route) -> RESPONSE_TYPE:
+        response.metadata = {**(response.metadata or {}), "query_filters": route.describe()}
+        return response
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        route, query_bundle = self._route(query_bundle)
+        response = self._engine_for(route.filters).query(query_bundle)
+        if route.inferred and not response.source_nodes:
+            # A guessed filter must never make an answerable question unanswerable.
+            route = Route(query=route.query)
+            response = self._engine_for(None).query(query_bundle)
+        return self._tag(response, route)
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        route, query_bundle = self._route(query_bundle)
+        response = await self._engine_for(route.filters).aquery(query_bundle)
+        if route.inferred and not response.source_nodes:
+            route = Route(query=route.query)
+            response = await self._engine_for(None).aquery(query_bundle)
+        return self._tag(response, route)
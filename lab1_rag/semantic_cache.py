@@ -0,0 +1,278 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import numpy as np
+from llama_index.core import Settings
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.response.schema import (
+    RESPONSE_TYPE,
+    AsyncStreamingResponse,
+    Response,
+    StreamingResponse,
+)
+from llama_index.core.prompts.mixin import PromptMixinType
+from llama_index.core.schema import QueryBundle
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    embedding: np.ndarray  # unit-normalized, so cosine similarity is a dot product
+    response: Response
+    created_at: float
+    scope: str = ""  # entries only answer queries of the same scope (e.g. metadata filters)
+
+
+class SemanticCache:
+    """
+    An in-memory answer cache keyed by *meaning* instead of exact text.
+
+    "What is the team dinner limit?" and "dinner reimbursement limit for teams?" are
+    different strings but almost the same embedding. If a new query's cosine similarity
+    to a cached query is above `threshold`, we return the cached answer and skip the
+    LLM call entirely.
+
+    Entries expire after `ttl_s` seconds, and the least recently used ones are evicted
+    beyond `max_entries`. `version_fn` returns the index's ingestion version: when it
+    changes, the documents changed, so every cached answer is dropped. Callers run
+    `refresh_version()` (or `arefresh_version()`) before a lookup.
+
+    A `scope` partitions the cache: "category:expenses dinner limit?" and "dinner
+    limit?" mean the same, but searched different documents, so they must not share
+    an answer. A lookup only compares entries stored with the same scope.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        ttl_s: float = 3600.0,
+        max_entries: int = 1000,
+        version_fn: Optional[Callable[[], str]] = None,
+        version_check_s: float = 30.0,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.version_fn = version_fn
+        self.version_check_s = version_check_s
+
+        self._entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self._next_id = 0
+        # The app serves many chats at once: one lock guards entries and version state.
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._version_checked_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _version_due(self, now: float) -> bool:
+        # Asking Qdrant for the version on every query would add a round trip,
+        # so we re-check at most every `version_check_s` seconds. The caller that
+        # finds the check due claims it: concurrent queries don't pile onto Qdrant.
+        if self.version_fn is None:
+            return False
+        with self._lock:
+            if now - self._version_checked_at < self.version_check_s:
+                return False
+            self._version_checked_at = now
+            return True
+
+    def _apply_version(self, version: str) -> None:
+        with self._lock:
+            if self._version is not None and version != self._version:
+                print("♻️ Ingestion version changed: clearing the semantic cache.")
+                self._entries.clear()
+            self._version = version
+
+    def refresh_version(self) -> None:
+        """
+        Drops every entry if the ingestion version changed (at most every `version_check_s`).
+
+        `version_fn` is a Qdrant call: it runs outside the lock, so lookups never wait
+        for it. If it fails, the current entries are kept and it is retried later: a
+        cached answer is still better than failing a query over a bookkeeping call.
+        """
+        if not self._version_due(time.time()):
+            return
+        try:
+            version = self.version_fn()
+        except Exception as e:
+            print(f"⚠️ Semantic cache: could not read the ingestion version ({e}), keeping entries.")
+            return
+        self._apply_version(version)
+
+    async def arefresh_version(self) -> None:
+        """Like `refresh_version`, with the blocking `version_fn` call off the event loop."""
+        if not self._version_due(time.time()):
+            return
+        try:
+            version = await asyncio.to_thread(self.version_fn)
+        except Exception as e:
+            print(f"⚠️ Semantic cache: could not read the ingestion version ({e}), keeping entries.")
+            return
+        self._apply_version(version)
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [key for key, e in self._entries.items() if now - e.created_at > self.ttl_s]
+        for key in expired:
+            del self._entries[key]
+
+    def lookup(self, query_embedding: List[float], scope: str = "") -> Optional[Response]:
+        """Returns a copy of the closest cached response of `scope` if it is similar enough."""
+        now = time.time()
+        query = _normalize(query_embedding)
+        with self._lock:
+            self._evict_expired(now)
+            keys = [key for key, e in self._entries.items() if e.scope == scope]
+            if not keys:
+                return None
+
+            # Brute-force cosine similarity: with at most `max_entries` rows this is
+            # one small matrix-vector product, far cheaper than a vector DB round trip.
+            matrix = np.stack([self._entries[k].embedding for k in keys])
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            key = keys[best]
+            self._entries.move_to_end(key)  # mark as most recently used
+            entry = self._entries[key]
+
+        # Return a copy tagged with cache info, so callers can tell a hit from a miss.
+        return Response(
+            response=entry.response.response,
+            source_nodes=entry.response.source_nodes,
+            metadata={
+                **(entry.response.metadata or {}),
+                "semantic_cache_hit": True,
+                "semantic_cache_similarity": float(similarities[best]),
+                "semantic_cache_query": entry.query,
+            },
+        )
+
+    def store(self, query: str, query_embedding: List[float], response: Response, scope: str = "") -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[self._next_id] = CacheEntry(query, _normalize(query_embedding), response, now, scope)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)  # least recently used first
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def _mark_miss(response: RESPONSE_TYPE) -> None:
+    # Hits are tagged in `lookup`; tagging misses too lets metrics tell a miss from
+    # an engine without a cache. (A later hit on this answer overrides the flag.)
+    response.metadata = {**(response.metadata or {}), "semantic_cache_hit": False}
+
+
+class SemanticCacheQueryEngine(BaseQueryEngine):
+    """
+    Wraps a query engine with a `SemanticCache`.
+
+    The query embedding we compute for the cache lookup is passed on in the
+    `QueryBundle`, so on a miss the retriever reuses it instead of embedding twice:
+    a miss costs exactly what it cost before, a hit skips retrieval and synthesis.
+
+    Several engines may share one cache, each with its own `scope` (see SemanticCache).
+    """
+
+    def __init__(
+        self,
+        query_engine: BaseQueryEngine,
+        cache: SemanticCache,
+        embed_model: Optional[BaseEmbedding] = None,
+        scope: str = "",
+    ):
+        super().__init__(callback_manager=query_engine.callback_manager)
+        self._query_engine = query_engine
+        self._cache = cache
+        self._embed_model = embed_model or Settings.embed_model
+        self._scope = scope
+
+    @property
+    def cache(self) -> SemanticCache:
+        return self._cache
+
+    def _get_prompt_modules(self) -> PromptMixinType:
+        return {"query_engine": self._query_engine}
+
+    def _query(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self._embed_model.get_query_embedding(query_bundle.query_str)
+
+        self._cache.refresh_version()
+        cached = self._cache.lookup(query_bundle.embedding, self._scope)
+        if cached is not None:
+            return cached
+
+        response = self._query_engine.query(query_bundle)
+        _mark_miss(response)
+        self._store_when_complete(query_bundle, response)
+        return response
+
+    async def _aquery(self, query_bundle: QueryBundle) -> RESPONSE_TYPE:
+        if query_bundle.embedding is None:
+            query_bundle.embedding = await self._embed_model.aget_query_embedding(query_bundle.query_str)
+
+        await self._cache.arefresh_version()
+        cached = self._cache.lookup(query_bundle.embedding, self._scope)
+        if cached is not None:
+            return cached
+
+        response = await self._query_engine.aquery(query_bundle)
+        _mark_miss(response)
+        self._store_when_complete(query_bundle, response)
+        return response
+
+    def _store_when_complete(self, query_bundle: QueryBundle, response: RESPONSE_TYPE) -> None:
+        """
+        Caches a response once its full text is known.
+
+        A streaming response has no text yet: we wrap its token generator so the
+        answer is cached after the last token has been passed on to the caller.
+        """
+        query, embedding, scope = query_bundle.query_str, query_bundle.embedding, self._scope
+
+        if isinstance(response, Response):
+            self._cache.store(query, embedding, response, scope)
+
+        elif isinstance(response, StreamingResponse) and response.response_gen is not None:
+            tokens = response.response_gen
+
+            def record():
+                text = ""
+                for token in tokens:
+                    text += token
+                    yield token
+                self._cache.store(query, embedding, Response(text, response.source_nodes, response.metadata), scope)
+
+            response.response_gen = record()
+
+        elif isinstance(response, AsyncStreamingResponse) and response.response_gen is not None:
+            atokens = response.response_gen
+
+            async def arecord():
+                text = ""
+                async for token in atokens:
+                    text += token
+                    yield token
+                self._cache.store(query, embedding, Response(text, response.source_nodes, response.metadata), scope)
+
+            response.response_gen = arecord()
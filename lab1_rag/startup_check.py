@@ -0,0 +1,153 @@
+import os
+import sys
+import time
+import json
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from lab1_rag.benchmark import OFFLINE_ENV
+
+# --- Startup Budget ---
+# Cold start is what an autoscaler waits for before a new instance takes traffic, and
+# what every CLI invocation pays before doing anything. This check starts the real
+# processes and fails (exit code 1) when they are slower than their budget, so a
+# heavy import sneaking back to module level shows up in CI, not in production.
+#
+# - listen: `python -m lab1_rag.app` until `/healthz` answers (the port is bound).
+# - ready:  until `/ready` answers 200 (engine built, index loaded or ingested, and
+#           one real question answered, see READY_PROBE in app.py).
+# - cli:    `python -m lab2_agents.cli --help`, median of a few runs.
+#
+# tests/test_startup.py runs the same measurements under pytest.
+LISTEN_BUDGET_S = 6.0
+READY_BUDGET_S = 30.0
+CLI_BUDGET_S = 1.0
+
+app = typer.Typer()
+console = Console()
+
+
+def check_env(port: int, live: bool = False) -> Dict[str, str]:
+    """The environment of the processes under test: offline mocks unless `live`."""
+    env = dict(os.environ)
+    if not live:
+        env.update(OFFLINE_ENV)
+    # A spare port, so the check can run next to an app already serving.
+    env.update(RAG_PORT=str(port), PYTHONUNBUFFERED="1")
+    return env
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout_s: float) -> Optional[float]:
+    """Polls `url` until it returns 200; the seconds since `process` started, or None."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_s:
+        if process.poll() is not None:
+            return None  # the server died
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - start
+        except (urllib.error.URLError, ConnectionError, TimeoutError):
+            pass
+        time.sleep(0.05)
+    return None
+
+
+def measure_server(env: Dict[str, str], port: int, timeout_s: float) -> Dict[str, Optional[float]]:
+    """Starts the RAG app and times how long until it listens and until it is ready."""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "lab1_rag.app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    start = time.perf_counter()
+    try:
+        listen_s = wait_for(f"http://127.0.0.1:{port}/healthz", process, timeout_s)
+        ready_s = None
+        if listen_s is not None:
+            remaining = timeout_s - (time.perf_counter() - start)
+            waited = wait_for(f"http://127.0.0.1:{port}/ready", process, remaining)
+            ready_s = None if waited is None else time.perf_counter() - start
+        return {"listen_s": listen_s, "ready_s": ready_s}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def measure_cli(env: Dict[str, str], runs: int) -> float:
+    """Median wall time of `python -m lab2_agents.cli --help`."""
+    times: List[float] = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "lab2_agents.cli", "--help"], env=env, capture_output=True, check=True
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+@app.command()
+def main(
+    listen_budget_s: float = typer.Option(LISTEN_BUDGET_S, help="Max seconds until the app's port answers."),
+    ready_budget_s: float = typer.Option(READY_BUDGET_S, help="Max seconds until /ready answers 200."),
+    cli_budget_s: float = typer.Option(CLI_BUDGET_S, help="Max seconds for `lab2_agents.cli --help`."),
+    port: int = typer.Option(7861, help="Port for the app under test."),
+    cli_runs: int = typer.Option(3, help="Runs of the CLI measurement (the median is used)."),
+    output: str = typer.Option("", help="Optional JSON file for the results."),
+    live: bool = typer.Option(False, help="Use the models and Qdrant configured in .env instead of offline mocks."),
+):
+    """
+    Measures cold-start times of the RAG app and the agent CLI against a budget.
+
+    Exits with code 1 if any budget is exceeded (or the app never becomes ready).
+    """
+    env = check_env(port, live)
+
+    server = measure_server(env, port, timeout_s=ready_budget_s + listen_budget_s)
+    results = {
+        "listen_s": server["listen_s"],
+        "ready_s": server["ready_s"],
+        "cli_help_s": measure_cli(env, cli_runs),
+    }
+    budgets = {"listen_s": listen_budget_s, "ready_s": ready_budget_s, "cli_help_s": cli_budget_s}
+
+    table = Table(title="Startup budget")
+    table.add_column("Stage")
+    table.add_column("Measured", justify="right")
+    table.add_column("Budget", justify="right")
+    failed = []
+    for name, budget in budgets.items():
+        value = results[name]
+        ok = value is not None and value <= budget
+        if not ok:
+            failed.append(name)
+        measured = "never" if value is None else f"{value:.2f}s"
+        table.add_row(name, f"[{'green' if ok else 'red'}]{measured}[/]", f"{budget:.2f}s")
+    console.print(table)
+
+    if output:
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(output, "w") as f:
+            json.dump({"results": results, "budgets": budgets, "mode": "live" if live else "offline"}, f, indent=2)
+
+    if failed:
+        console.print(f"[bold red]Over budget:[/bold red] {', '.join(failed)}")
+        raise typer.Exit(code=1)
+    console.print("[green]All startup times within budget.[/green]")
+
+
+if __name__ == "__main__":
+    app()
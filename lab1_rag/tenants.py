@@ -0,0 +1,180 @@
+import os
+import re
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from llama_index.core.vector_stores.types import MetadataFilter, MetadataFilters
+
+from lab1_rag.ingestion import TENANT_KEY
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# --- Multi-Tenancy ---
+# One process serves the policy assistant of several business units, each with its
+# own documents. A tenant's documents live in their own folder under TENANTS_DIR:
+#
+#   tenants/
+#     finance/   *.pdf
+#     hr/        *.pdf
+#
+# and are indexed in one of two layouts (TENANCY):
+# - "collection" (default): one Qdrant collection per tenant (`<COLLECTION_NAME>__<tenant>`).
+#   Strong isolation, and a tenant can be dropped by deleting its collection; but every
+#   collection has its own HNSW graph and fixed overhead, which adds up with many tenants.
+# - "shared": every tenant in one collection, each point tagged with `tenant_id` and
+#   every search filtered on it (a payload index marked `is_tenant` lets Qdrant store
+#   each tenant's points together). Scales to many small tenants.
+#
+# Without TENANTS_DIR there is a single tenant, DEFAULT_TENANT, served exactly as
+# before: COLLECTION_NAME and lab1_rag/data.
+#
+# A query engine holds no documents (Qdrant does), but building one loads or ingests
+# the tenant's index, and it carries per-tenant state such as its semantic cache.
+# `TenantEngineCache` keeps the TENANT_CACHE_SIZE most recently used ones.
+TENANCY = os.getenv("TENANCY", "collection").lower()
+TENANCY_MODES = ("collection", "shared")
+TENANTS_DIR = os.getenv("TENANTS_DIR", "")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+TENANT_CACHE_SIZE = int(os.getenv("TENANT_CACHE_SIZE", "8"))
+
+# Tenant ids become collection names and folder names: no dots, slashes or spaces.
+TENANT_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+
+class UnknownTenantError(ValueError):
+    """The tenant id is malformed or has no document folder."""
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """Where one tenant's documents come from and where their chunks are indexed."""
+    tenant_id: str
+    collection_name: str
+    data_dir: str
+    shared: bool = False  # True: the collection is shared, points carry `tenant_id`
+
+    @property
+    def payload_id(self) -> str:
+        """The `tenant_id` stamped on (and filtered for) in the payload; "" in its own collection."""
+        return self.tenant_id if self.shared else ""
+
+    def scope(self, filters: Optional[MetadataFilters] = None) -> Optional[MetadataFilters]:
+        """Adds the tenant condition to a query's filters (shared collections only)."""
+        if not self.shared:
+            return filters
+        tenant = MetadataFilter(key=TENANT_KEY, value=self.tenant_id)
+        if filters is None:
+            return MetadataFilters(filters=[tenant])
+        return MetadataFilters(filters=[tenant, filters])
+
+
+def list_tenants(tenants_dir: str = TENANTS_DIR) -> List[str]:
+    """The tenants with a document folder (just DEFAULT_TENANT without TENANTS_DIR)."""
+    if not tenants_dir:
+        return [DEFAULT_TENANT]
+    return sorted(
+        name for name in os.listdir(tenants_dir)
+        if TENANT_ID_PATTERN.match(name) and os.path.isdir(os.path.join(tenants_dir, name))
+    )
+
+
+def make_tenant(
+    tenant_id: str,
+    collection_name: str,
+    default_data_dir: str,
+    mode: str = TENANCY,
+    tenants_dir: str = TENANTS_DIR,
+) -> Tenant:
+    """Resolves a tenant id to its documents folder and collection."""
+    if mode not in TENANCY_MODES:
+        raise ValueError(f"Unsupported TENANCY: {mode} (expected one of {TENANCY_MODES})")
+    if not tenants_dir:
+        if tenant_id != DEFAULT_TENANT:
+            raise UnknownTenantError(f"Unknown tenant '{tenant_id}': set TENANTS_DIR to serve several tenants.")
+        return Tenant(tenant_id, collection_name, default_data_dir)
+
+    if not TENANT_ID_PATTERN.match(tenant_id):
+        raise UnknownTenantError(f"Invalid tenant id '{tenant_id}' (lowercase letters, digits, '-' and '_').")
+    data_dir = os.path.join(tenants_dir, tenant_id)
+    if not os.path.isdir(data_dir):
+        raise UnknownTenantError(f"Unknown tenant '{tenant_id}': no folder {data_dir}.")
+    if mode == "shared":
+        return Tenant(tenant_id, collection_name, data_dir, shared=True)
+    return Tenant(tenant_id, f"{collection_name}__{tenant_id}", data_dir)
+
+
+class TenantEngineCache:
+    """
+    Query engines per tenant, built on first use and evicted least-recently-used.
+
+    `factory(tenant_id)` builds an engine (loading or ingesting the tenant's index).
+    Concurrent first requests for the same tenant wait for one build instead of
+    starting several; requests for other tenants are not blocked meanwhile.
+    Evicting an engine only drops in-process state: the next request reloads the
+    index from Qdrant, without re-ingesting.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_engines: int = TENANT_CACHE_SIZE):
+        self._factory = factory
+        self._max_engines = max(1, max_engines)
+        self._engines: "OrderedDict[str, Any]" = OrderedDict()
+        self._building: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._engines)
+
+    def _lookup(self, tenant_id: str) -> Optional[Any]:
+        with self._lock:
+            engine = self._engines.get(tenant_id)
+            if engine is not None:
+                self._engines.move_to_end(tenant_id)
+                self.hits += 1
+            return engine
+
+    def get(self, tenant_id: str) -> Any:
+        engine = self._lookup(tenant_id)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            building = self._building.get(tenant_id)
+            owner = building is None
+            if owner:
+                building = self._building[tenant_id] = Future()
+                self.misses += 1
+        if not owner:
+            return building.result()
+
+        try:
+            engine = self._factory(tenant_id)
+        except Exception as e:
+            building.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._building.pop(tenant_id, None)
+
+        with self._lock:
+            self._engines[tenant_id] = engine
+            while len(self._engines) > self._max_engines:
+                evicted, _ = self._engines.popitem(last=False)
+                self.evictions += 1
+                print(f"♻️ Evicted query engine of tenant '{evicted}'")
+        building.set_result(engine)
+        return engine
+
+    async def aget(self, tenant_id: str) -> Any:
+        """`get` for the event loop: a cached engine is returned at once, a build runs on a thread."""
+        engine = self._lookup(tenant_id)
+        if engine is not None:
+            return engine
+        return await asyncio.to_thread(self.get, tenant_id)
@@ -1,12 +1,139 @@
+import os
 import json
-from typing import List, Optional
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Tuple
 from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core.tools import BaseTool
-from llama_index.core.agent import ReActAgent
-from shared.utils import init_settings
+from shared.utils import ensure_settings
+from lab2_agents.memory import TokenBudgetMemory
+from lab2_agents.tools import READ_ONLY_TOOLS, result_fingerprint
+from shared.rate_limit import TokenBucket
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# Tool execution limits:
+# - AGENT_MAX_PARALLEL_TOOLS: tool calls of one step that may run at the same time.
+# - AGENT_TOOL_TIMEOUT_S: a tool running longer than this is reported as timed out.
+AGENT_MAX_PARALLEL_TOOLS = int(os.getenv("AGENT_MAX_PARALLEL_TOOLS", "4"))
+AGENT_TOOL_TIMEOUT_S = float(os.getenv("AGENT_TOOL_TIMEOUT_S", "60"))
+
+class ToolScheduler:
+    """
+    Runs tool calls on threads and hands back their results in submission order.
+
+    - At most `max_parallel` calls run at once; the rest wait their turn.
+    - A call running longer than `timeout_s` is abandoned and reported as an
+      error observation, so one stuck tool cannot hang the agent. (Python cannot
+      kill a thread: the abandoned call finishes in the background.)
+    - Calls for which `exclusive(name)` is true (tools with side effects, e.g.
+      `save_plan`) run alone: after every earlier call has finished, and before any
+      later one starts. A read in the same step then sees the file before or after
+      the write, as the model ordered the calls, never a race between them.
+
+    Calls can be submitted one by one while the LLM is still streaming (see
+    `ManualReActAgent.stream_chat`): `poll()` starts queued calls as slots free up.
+    """
+    # Threads are created lazily, one per running call. The cap only matters if many
+    # abandoned calls are still running: it must stay above `max_parallel`.
+    MAX_THREADS = 64
+
+    def __init__(
+        self,
+        run_fn: Callable[[str, Dict[str, Any]], str],
+        max_parallel: int,
+        timeout_s: float,
+        exclusive: Callable[[str], bool] = lambda name: False,
+    ):
+        self.run_fn = run_fn
+        self.exclusive = exclusive
+        self.max_parallel = max(1, max_parallel)
+        self.timeout_s = timeout_s
+        self._executor = ThreadPoolExecutor(max_workers=max(self.MAX_THREADS, self.max_parallel), thread_name_prefix="tool")
+        self._calls: List[Tuple[str, Dict[str, Any]]] = []
+        self._results: List[Optional[str]] = []
+        self._waiting = deque()
+        self._running = {}  # future -> (call index, start time)
+
+    def submit(self, function_name: str, function_args: Dict[str, Any]) -> int:
+        """Queues a call and starts it right away if a slot is free. Returns its index."""
+        self._calls.append((function_name, function_args))
+        self._results.append(None)
+        self._waiting.append(len(self._calls) - 1)
+        self.poll()
+        return len(self._calls) - 1
+
+    def poll(self) -> None:
+        """Non-blocking: records finished calls, times out slow ones, starts queued ones."""
+        for future in [f for f in self._running if f.done()]:
+            i, _ = self._running.pop(future)
+            self._results[i] = future.result()
+
+        now = time.perf_counter()
+        for future, (i, started) in list(self._running.items()):
+            if now - started >= self.timeout_s:
+                del self._running[future]
+                self._results[i] = f"Error: Tool {self._calls[i][0]} timed out after {self.timeout_s:g}s."
+
+        while self._waiting and len(self._running) < self.max_parallel:
+            i = self._waiting[0]
+            if self._running and (self.exclusive(self._calls[i][0]) or self._exclusive_running()):
+                break  # an exclusive call waits for the running ones, and the next calls for it
+            self._waiting.popleft()
+            # The timeout clock starts when the call starts, not while it waits in line.
+            self._running[self._executor.submit(self.run_fn, *self._calls[i])] = (i, time.perf_counter())
+
+    def _exclusive_running(self) -> bool:
+        return any(self.exclusive(self._calls[i][0]) for i, _ in self._running.values())
+
+    def collect(self) -> List[str]:
+        """Waits for every submitted call and returns the results in submission order."""
+        try:
+            self.poll()
+            while self._running:
+                # Sleep until a tool finishes or the oldest running one hits its timeout.
+                next_deadline = min(started for _, started in self._running.values()) + self.timeout_s
+                wait(self._running, timeout=max(0.0, next_deadline - time.perf_counter()), return_when=FIRST_COMPLETED)
+                self.poll()
+        finally:
+            # Don't wait for abandoned (timed out) calls.
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        return self._results
+
+
+@dataclass
+class AgentEvent:
+    """
+    One thing that happened during a streamed ReAct turn, for a UI to render:
+    "step" (a new LLM call), "thought" (a text token), "action" (a tool was dispatched),
+    "observation" (a tool result) or "answer" (the final answer).
+    """
+    kind: str
+    text: str = ""
+    tool: Optional[str] = None
+    args: Optional[Dict[str, Any]] = None
+    step: int = 0
+
+
+def parse_tool_args(arguments: Any) -> Optional[Dict[str, Any]]:
+    """
+    The arguments of a tool call, or None while they are still incomplete.
+
+    While streaming, arguments arrive as a growing JSON string. A JSON object only
+    parses once its closing brace has arrived (and no valid object is the prefix of a
+    longer one), so "it parses" means "the call is complete".
+    """
+    if isinstance(arguments, dict):
+        return arguments  # some providers (e.g. Ollama) send parsed arguments
+    try:
+        args = json.loads(arguments or "")
+    except json.JSONDecodeError:
+        return None
+    return args if isinstance(args, dict) else None
 
-# Initialize settings to ensure LLM is ready
-init_settings()
 
 class ManualReActAgent:
     """
@@ -19,22 +146,45 @@ class ManualReActAgent:
     We use LlamaIndex's `llm.chat_with_tools` (if available) or standard `llm.chat` 
     to handle the heavy lifting of tool selection, but we control the execution flow.
     """
-    def __init__(self, tools: List[BaseTool], system_prompt: str = ""):
+    def __init__(
+        self,
+        tools: List[BaseTool],
+        system_prompt: str = "",
+        max_parallel_tools: int = AGENT_MAX_PARALLEL_TOOLS,
+        tool_timeout_s: float = AGENT_TOOL_TIMEOUT_S,
+        rate_limiter: Optional[TokenBucket] = None,
+        read_only_tools: Collection[str] = READ_ONLY_TOOLS,
+    ):
         self.tools = {t.metadata.name: t for t in tools}
+        # Any other tool may have side effects: it never runs next to another call.
+        self.read_only_tools = frozenset(read_only_tools)
+        # Shared by all agents of a batch run: every LLM call takes one unit first.
+        self.rate_limiter = rate_limiter
+        self.max_parallel_tools = max(1, max_parallel_tools)
+        self.tool_timeout_s = tool_timeout_s
         self.tools_list = tools
-        from llama_index.core import Settings
-        self.llm = Settings.llm
+        # Models are configured on first use, not when this module is imported.
+        self.llm = ensure_settings().llm
         self.system_prompt = system_prompt
-        self.chat_history: List[ChatMessage] = [
-            ChatMessage(role=MessageRole.SYSTEM, content=system_prompt)
-        ]
+        # The history lives in a token-budgeted memory (see memory.py): long sessions
+        # keep a flat per-step cost instead of resending every old file read.
+        self.memory = TokenBudgetMemory(system_prompt=system_prompt)
+        # Steps are numbered across the whole session, for "unchanged since step N".
+        self.step_count = 0
+        # (tool, args) -> (result fingerprint, step, observation message), see `_observe`.
+        self._observations: Dict[Tuple[str, str], Tuple[Any, int, ChatMessage]] = {}
+
+    @property
+    def chat_history(self) -> List[ChatMessage]:
+        """The (compacted) history that is sent to the LLM at the next step."""
+        return self.memory.get()
 
     def chat(self, user_input: str, verbose: bool = True) -> str:
         """
         Executes the ReAct Loop for a single user turn.
         """
         # 1. Add user message to history
-        self.chat_history.append(ChatMessage(role=MessageRole.USER, content=user_input))
+        self.memory.put(ChatMessage(role=MessageRole.USER, content=user_input))
         
         # 2. Start the Loop (Reason -> Act -> Observe)
         max_iterations = 10
@@ -42,6 +192,7 @@ class ManualReActAgent:
         
         while current_iter < max_iterations:
             current_iter += 1
+            self.step_count += 1
             
             if verbose:
                 print(f"\n--- ReAct Step {current_iter} ---")
@@ -52,11 +203,16 @@ class ManualReActAgent:
             # If the LLM doesn't support native tool calling (some local models), 
             # this method might fallback or fail, but for this workshop we assume 
             # a capable model (OpenAI or Tool-calling Ollama).
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
             try:
                 response = self.llm.chat_with_tools(
                     self.tools_list, 
                     chat_history=self.chat_history,
-                    verbose=False # We handle verbosity manually
+                    verbose=False, # We handle verbosity manually
+                    # Let the model ask for several tools at once: we run them in parallel.
+                    # (With False, LlamaIndex keeps only the first tool call.)
+                    allow_parallel_tool_calls=True,
                 )
             except AttributeError:
                 # Fallback for LLMs that don't implement chat_with_tools directly 
@@ -68,7 +224,7 @@ class ManualReActAgent:
             # APPEND Assistant Message to History
             # The response message contains the content (Thought) and potentially tool_calls
             message = response.message
-            self.chat_history.append(message)
+            self.memory.put(message)
             
             # VISUALIZE "Thought"
             if verbose and message.content:
@@ -84,46 +240,157 @@ class ManualReActAgent:
                 return message.content
 
             # ACT (Execute Tools)
+            # Parse Function Name and Args
+            # Note: OpenAI returns tool calls in a specific format handled by LlamaIndex wrappers
+            # structure: tool_call.function.name, tool_call.function.arguments
+            calls = []
             for tool_call in tool_calls:
-                # Parse Function Name and Args
-                # Note: OpenAI returns tool calls in a specific format handled by LlamaIndex wrappers
-                # structure: tool_call.function.name, tool_call.function.arguments
-                
-                # LlamaIndex standardizes this in message.additional_kwargs usually, 
-                # but let's rely on the abstraction if possible. 
-                # Actually, `chat_with_tools` returns a response where `message.tool_calls` 
-                # might be populated depending on the version.
-                # Let's look at the raw additional_kwargs for OpenAI style.
-                
                 function_name = tool_call.function.name
                 function_args = json.loads(tool_call.function.arguments)
+                calls.append((function_name, function_args))
                 
                 if verbose:
                     print(f"🟡 ACTION: Calling `{function_name}` with {function_args}")
-                
-                # Execute
-                if function_name in self.tools:
-                    tool = self.tools[function_name]
-                    try:
-                        # LlamaIndex tools have a .call method or we use the fn directly
-                        tool_output = tool.call(**function_args)
-                        tool_result_str = str(tool_output.content)
-                    except Exception as e:
-                        tool_result_str = f"Error executing tool: {e}"
-                else:
-                    tool_result_str = f"Error: Tool {function_name} not found."
 
+            # Execute all calls of this step concurrently (see `_execute_tools`)
+            results = self._execute_tools(calls)
+
+            for tool_call, (function_name, function_args), tool_result_str in zip(tool_calls, calls, results):
                 if verbose:
                     print(f"Please observe: {tool_result_str[:100]}...")
 
                 # OBSERVE (Add Tool Output to History)
                 # We must add a message with role=TOOL to the history so the LLM knows the result.
-                tool_msg = ChatMessage(
-                    role=MessageRole.TOOL,
-                    content=tool_result_str,
-                    additional_kwargs={"tool_call_id": tool_call.id}
-                )
-                self.chat_history.append(tool_msg)
+                # Results are appended in tool_call order, whatever order the tools finished in,
+                # so the history is the same on every run.
+                self._observe(tool_call.id, function_name, function_args, tool_result_str)
 
         return "Error: Max iterations reached."
 
+    def stream_chat(self, user_input: str, max_iterations: int = 10) -> Iterator[AgentEvent]:
+        """
+        Streaming version of `chat`: the same ReAct loop, yielding AgentEvents as they happen.
+
+        Two things get faster:
+        - Time to first output: thought tokens are yielded as the LLM writes them,
+          instead of after the whole message.
+        - Wall time: a tool starts as soon as *its* arguments are complete, while the
+          LLM is still writing the next tool call (or the rest of its message).
+        """
+        self.memory.put(ChatMessage(role=MessageRole.USER, content=user_input))
+
+        for step in range(1, max_iterations + 1):
+            self.step_count += 1
+            yield AgentEvent("step", step=step)
+
+            # CALL LLM (streaming). Same fallback as `chat` for LLMs without tool calling.
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                stream = self.llm.stream_chat_with_tools(
+                    self.tools_list, chat_history=self.chat_history, allow_parallel_tool_calls=True
+                )
+            except AttributeError:
+                stream = self.llm.stream_chat(self.chat_history)
+
+            scheduler = self._scheduler()
+            dispatched: Dict[int, Tuple[int, Dict[str, Any]]] = {}  # position in tool_calls -> (scheduler index, args)
+            response = None
+            for response in stream:
+                if response.delta:
+                    yield AgentEvent("thought", text=response.delta)
+
+                # EARLY DISPATCH: start every tool call whose arguments just became complete.
+                tool_calls = response.message.additional_kwargs.get("tool_calls", [])
+                for position, tool_call in enumerate(tool_calls):
+                    if position in dispatched or tool_call.function is None:
+                        continue
+                    args = parse_tool_args(tool_call.function.arguments)
+                    if args is None:
+                        continue
+                    dispatched[position] = (scheduler.submit(tool_call.function.name, args), args)
+                    yield AgentEvent("action", tool=tool_call.function.name, args=args)
+                scheduler.poll()
+
+            message = response.message if response is not None else ChatMessage(role=MessageRole.ASSISTANT, content="")
+            self.memory.put(message)
+
+            tool_calls = message.additional_kwargs.get("tool_calls", [])
+            if not tool_calls:
+                yield AgentEvent("answer", text=message.content or "")
+                return
+
+            # Calls whose arguments never parsed still need an observation for their id.
+            results = scheduler.collect()
+            for position, tool_call in enumerate(tool_calls):
+                if position in dispatched:
+                    index, args = dispatched[position]
+                    result = self._observe(tool_call.id, tool_call.function.name, args, results[index])
+                else:
+                    result = f"Error: Invalid arguments for tool {tool_call.function.name}: {tool_call.function.arguments!r}"
+                    self._observe(tool_call.id, tool_call.function.name, None, result)
+                # OBSERVE, in tool_call order (as in `chat`)
+                yield AgentEvent("observation", text=result, tool=tool_call.function.name)
+
+        yield AgentEvent("answer", text="Error: Max iterations reached.")
+
+    def _observe(self, tool_call_id: str, function_name: str, function_args: Optional[Dict[str, Any]], result: str) -> str:
+        """
+        Adds a tool observation to memory and returns the content that was added.
+
+        If the same call returned the same result (same fingerprint, see tools.py) at an
+        earlier step, and that observation is still verbatim in memory, we send a short
+        "unchanged" note instead of repeating a possibly large result.
+        """
+        key = (function_name, json.dumps(function_args, sort_keys=True)) if function_args is not None else None
+        fingerprint = result_fingerprint(function_name, function_args) if key else None
+        previous = self._observations.get(key) if fingerprint is not None else None
+        unchanged = previous is not None and previous[0] == fingerprint and self.memory.contains(previous[2])
+        content = (
+            f"Unchanged since step {previous[1]}: `{function_name}` returned the same result as then."
+            if unchanged else result
+        )
+
+        message = ChatMessage(
+            role=MessageRole.TOOL,
+            content=content,
+            additional_kwargs={"tool_call_id": tool_call_id}
+        )
+        self.memory.put(message)
+        if fingerprint is not None and not unchanged:
+            self._observations[key] = (fingerprint, self.step_count, message)
+        return content
+
+    def _run_tool(self, function_name: str, function_args: Dict[str, Any]) -> str:
+        """Runs one tool and always returns a string: errors become observations too."""
+        if function_name not in self.tools:
+            return f"Error: Tool {function_name} not found."
+        tool = self.tools[function_name]
+        try:
+            # LlamaIndex tools have a .call method or we use the fn directly
+            tool_output = tool.call(**function_args)
+            return str(tool_output.content)
+        except Exception as e:
+            return f"Error executing tool: {e}"
+
+    def _scheduler(self) -> ToolScheduler:
+        return ToolScheduler(
+            self._run_tool,
+            self.max_parallel_tools,
+            self.tool_timeout_s,
+            exclusive=lambda name: name not in self.read_only_tools,
+        )
+
+    def _execute_tools(self, calls: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """
+        Runs the tool calls of one step concurrently and returns results in call order.
+
+        When the model fans out (read three files and the guidelines), running the
+        calls one after another makes the step as slow as the *sum* of the tools;
+        running them side by side makes it as slow as the *slowest* one.
+        Tools with side effects still run one at a time, in call order (see ToolScheduler).
+        """
+        scheduler = self._scheduler()
+        for function_name, function_args in calls:
+            scheduler.submit(function_name, function_args)
+        return scheduler.collect()
@@ -1,33 +1,38 @@
+import os
+import re
+import json
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set, Tuple
+
 import typer
 from rich.console import Console
 from rich.panel import Panel
+from rich.progress import Progress
 from rich.prompt import Prompt
 from rich.markdown import Markdown
+from rich.markup import escape
+
+from shared.rate_limit import TokenBucket
 
-from lab2_agents.tools import ALL_TOOLS
-from lab2_agents.agent import ManualReActAgent
+# The agent (and with it llama_index and the LLM SDKs) is imported only when an agent
+# is created: `--help`, argument errors and the banner show up at once.
+if TYPE_CHECKING:
+    from lab2_agents.agent import ManualReActAgent
 
 app = typer.Typer()
 console = Console()
 
-@app.command()
-def main():
-    """
-    Starts the Performance Review Assistant (Agent) in CLI mode.
-    """
-    console.print(Panel.fit(
-        "[bold blue]Performance Review Assistant[/bold blue]\n"
-        "Practical AI Corp - ReAct Agent Lab",
-        subtitle="Type 'exit' to quit"
-    ))
-
-    # System Prompt
-    system_prompt = """
+# System Prompt (shared by the interactive and batch modes)
+SYSTEM_PROMPT = """
     You are a helpful HR Assistant for Practical AI Corp.
     Your goal is to help managers draft Performance Reviews and OKRs.
     
     You have access to the following tools:
-    - read_file: To read existing context or drafts.
+    - read_file: To read existing context or drafts (large files page by page).
+    - search_file: To find where something is mentioned in a large file.
     - save_plan: To save the final OKR plan.
     - get_okr_guidelines: To check best practices.
     
@@ -36,10 +41,60 @@ def main():
     then draft the plan and save it.
     """
 
+def create_agent(rate_limiter: Optional[TokenBucket] = None, output_dir: Optional[str] = None) -> "ManualReActAgent":
+    """
+    Imports the agent stack and builds an agent (configuring the models on first use).
+    With `output_dir`, the agent's `save_plan` only writes under that directory.
+    """
+    from lab2_agents.tools import ALL_TOOLS, tools_with_output_dir
+    from lab2_agents.agent import ManualReActAgent
+
+    tools = tools_with_output_dir(output_dir) if output_dir else ALL_TOOLS
+    return ManualReActAgent(tools=tools, system_prompt=SYSTEM_PROMPT, rate_limiter=rate_limiter)
+
+def stream_response(agent: "ManualReActAgent", user_input: str) -> str:
+    """
+    Renders a streamed ReAct turn live: thought tokens as they are written,
+    tool calls as soon as they are dispatched, then their observations.
+    """
+    answer = ""
+    for event in agent.stream_chat(user_input):
+        if event.kind == "step":
+            console.print(f"\n[dim]--- ReAct Step {event.step} ---[/dim]")
+        elif event.kind == "thought":
+            console.print(event.text, end="", style="blue", highlight=False, markup=False)
+        elif event.kind == "action":
+            console.print(f"\n🟡 ACTION: Calling `{event.tool}` with {event.args}", style="yellow", highlight=False)
+        elif event.kind == "observation":
+            console.print(f"   ↳ {event.tool}: {event.text[:100]}...", style="dim", highlight=False, markup=False)
+        elif event.kind == "answer":
+            answer = event.text
+    console.print()
+    return answer
+
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: typer.Context,
+    stream: bool = typer.Option(False, "--stream", help="Stream thoughts live and start tools as soon as their arguments are complete."),
+):
+    """
+    Starts the Performance Review Assistant (Agent) in CLI mode.
+
+    Run `batch` for the headless mode (see `batch --help`).
+    """
+    if ctx.invoked_subcommand is not None:
+        return
+
+    console.print(Panel.fit(
+        "[bold blue]Performance Review Assistant[/bold blue]\n"
+        "Practical AI Corp - ReAct Agent Lab",
+        subtitle="Type 'exit' to quit"
+    ))
+
     # Initialize Agent
     console.print("[italic]Initializing Agent...[/italic]")
     try:
-        agent = ManualReActAgent(tools=ALL_TOOLS, system_prompt=system_prompt)
+        agent = create_agent()
         console.print("[green]Agent Ready![/green]\n")
     except Exception as e:
         console.print(f"[bold red]Error initializing agent:[/bold red] {e}")
@@ -59,6 +114,12 @@ def main():
         console.print("\n[italic dim]Agent is thinking...[/italic dim]")
         
         try:
+            if stream:
+                # The answer has already been written token by token.
+                stream_response(agent, user_input)
+                console.print("\n" + "-"*50 + "\n")
+                continue
+
             # We rely on the agent's internal print statements for the ReAct steps
             # so we just print the final result here nicely.
             response = agent.chat(user_input, verbose=True)
@@ -70,6 +131,170 @@ def main():
         except Exception as e:
             console.print(f"[bold red]An error occurred:[/bold red] {e}")
 
+# --- Batch (Headless) Mode ---
+# Overnight runs: hundreds of independent tasks, each answered by a *fresh* agent
+# (no history leaks between managers). The output file doubles as the checkpoint:
+# every finished task is appended and flushed at once, so after a crash the same
+# command skips what is already done and resumes with the rest.
+# Every task also gets its own directory for the files its agent saves (--output-dir).
+
+def invalid_line_record(line_number: int, error: str) -> Dict[str, Any]:
+    """The result record of a tasks-file line that is not a runnable task."""
+    return {
+        "id": None, "line": line_number, "prompt": None, "started_at": time.time(),
+        "status": "error", "answer": None, "error": error, "seconds": 0.0, "llm_calls": 0,
+    }
+
+def load_tasks(tasks_file: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Reads {"id": ..., "prompt": ...} lines; a missing id defaults to the line number.
+
+    Returns (tasks, invalid): one bad line (not JSON, not an object, no prompt, an id
+    already used above) must not abort a whole overnight batch, so it becomes an error
+    record keyed by its line number instead. Duplicate ids are refused because the
+    resume checkpoint identifies tasks by id.
+    """
+    tasks, invalid = [], []
+    first_line: Dict[str, int] = {}
+    with open(tasks_file) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                task = json.loads(line)
+            except json.JSONDecodeError as e:
+                invalid.append(invalid_line_record(line_number, f"Invalid JSON: {e}"))
+                continue
+            if not isinstance(task, dict):
+                invalid.append(invalid_line_record(line_number, f"Expected a JSON object, got {type(task).__name__}"))
+                continue
+            if not isinstance(task.get("prompt"), str) or not task["prompt"].strip():
+                invalid.append(invalid_line_record(line_number, "Missing prompt"))
+                continue
+            task["id"] = str(task.get("id", line_number))
+            if task["id"] in first_line:
+                invalid.append(invalid_line_record(
+                    line_number, f"Duplicate id {task['id']!r} (first used on line {first_line[task['id']]})"
+                ))
+                continue
+            first_line[task["id"]] = line_number
+            tasks.append(task)
+    return tasks, invalid
+
+def load_finished_ids(output_file: str) -> Set[str]:
+    """Ids of tasks that already succeeded in a previous (possibly crashed) run."""
+    finished = set()
+    if not os.path.exists(output_file):
+        return finished
+    with open(output_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by the crash
+            if record.get("status") == "ok":
+                finished.add(str(record["id"]))
+    return finished
+
+def task_output_dir(output_dir: str, task_id: str) -> str:
+    """`<output_dir>/<task id>`, with the id made safe to use as a directory name."""
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", task_id).strip(".") or "task"
+    if name != task_id:
+        # "a/b" and "a_b" must not share a directory.
+        name += "-" + hashlib.sha256(task_id.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(output_dir, name)
+
+def run_task(task: Dict[str, Any], rate_limiter: Optional[TokenBucket], output_dir: str) -> Dict[str, Any]:
+    """Answers one task with its own agent and returns the result record with timings."""
+    started = time.time()
+    start = time.perf_counter()
+    task_dir = task_output_dir(output_dir, task["id"])
+    record = {"id": task["id"], "prompt": task.get("prompt"), "started_at": started, "output_dir": task_dir}
+    agent = None
+    # Everything that can fail for *one* task (an agent that cannot be created, the run
+    # itself) becomes that task's error record, never a crash of the batch.
+    try:
+        agent = create_agent(rate_limiter, output_dir=task_dir)
+        prompt = f"{task['prompt']}\n\nSave any file for this task in the directory '{task_dir}'."
+        record.update(status="ok", answer=agent.chat(prompt, verbose=False), error=None)
+    except Exception as e:
+        record.update(status="error", answer=None, error=f"{type(e).__name__}: {e}")
+    record.update(
+        seconds=round(time.perf_counter() - start, 3),
+        llm_calls=agent.step_count if agent is not None else 0,
+    )
+    return record
+
+@app.command()
+def batch(
+    tasks_file: str = typer.Argument(..., help="JSONL file with one {\"id\", \"prompt\"} task per line."),
+    output: str = typer.Option("batch_results.jsonl", help="JSONL results file, also used as the resume checkpoint."),
+    concurrency: int = typer.Option(4, help="Agents running at the same time."),
+    rpm: float = typer.Option(60, help="Max LLM requests per minute across all agents (0 = unlimited)."),
+    output_dir: str = typer.Option("batch_out", help="Files saved by the agents go to <output-dir>/<task id>/."),
+):
+    """
+    Runs a JSONL file of tasks headlessly across a pool of independent agents.
+
+    Re-running the same command resumes: tasks already in the output with status "ok"
+    are skipped, failed ones are retried. Invalid lines are recorded as errors with
+    their line number and skipped.
+    """
+    tasks, invalid = load_tasks(tasks_file)
+    for record in invalid:
+        console.print(f"[yellow]⚠️ {escape(tasks_file)}:{record['line']}: {escape(record['error'])} (skipped)[/yellow]")
+    finished = load_finished_ids(output)
+    pending = [t for t in tasks if t["id"] not in finished]
+    console.print(
+        f"[bold blue]Batch:[/bold blue] {len(tasks)} tasks, {len(tasks) - len(pending)} already done, "
+        f"{len(pending)} to run ({concurrency} workers, {rpm:g} RPM)"
+    )
+    if not pending and not invalid:
+        return
+
+    # One bucket for the whole pool: the provider's rate limit is per API key, not per agent.
+    rate_limiter = TokenBucket(rpm, capacity=max(1.0, float(concurrency))) if rpm > 0 else None
+    write_lock = threading.Lock()
+    failures = 0
+    start = time.perf_counter()
+
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output, "a") as out, Progress(console=console) as progress:
+        # Terminate a line cut short by a crash, so the next record starts on its own line.
+        if out.tell() > 0:
+            with open(output, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+        for record in invalid:
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+        bar = progress.add_task("Drafting", total=len(pending))
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="agent")
+        try:
+            futures = [executor.submit(run_task, task, rate_limiter, output_dir) for task in pending]
+            for future in as_completed(futures):
+                record = future.result()
+                failures += record["status"] != "ok"
+                with write_lock:
+                    out.write(json.dumps(record) + "\n")
+                    # Flush to disk now: this line is the checkpoint for a resumed run.
+                    out.flush()
+                    os.fsync(out.fileno())
+                progress.advance(bar)
+        finally:
+            # On Ctrl-C, don't start queued tasks; running ones finish their current call.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    console.print(
+        f"[green]Done:[/green] {len(pending) - failures} ok, [red]{failures} failed[/red], "
+        f"{len(invalid)} invalid line(s) in {elapsed:.1f}s ({len(pending) / elapsed:.2f} tasks/s). "
+        f"Results in {output}, files in {output_dir}/"
+    )
+
 if __name__ == "__main__":
     app()
 
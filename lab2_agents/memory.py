@@ -0,0 +1,178 @@
+import os
+from typing import Callable, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.llms import ChatMessage, MessageRole
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# Memory limits:
+# - AGENT_MEMORY_TOKENS: token budget of the history sent to the LLM at every step.
+# - AGENT_KEEP_RECENT_TURNS: the last N user turns are always kept verbatim.
+# - AGENT_OBSERVATION_TOKENS: older tool outputs are cut down to about this many tokens.
+AGENT_MEMORY_TOKENS = int(os.getenv("AGENT_MEMORY_TOKENS", "8000"))
+AGENT_KEEP_RECENT_TURNS = int(os.getenv("AGENT_KEEP_RECENT_TURNS", "2"))
+AGENT_OBSERVATION_TOKENS = int(os.getenv("AGENT_OBSERVATION_TOKENS", "300"))
+
+# Role, separators and the like cost a few tokens per message on top of the content.
+MESSAGE_OVERHEAD_TOKENS = 4
+# Dropped turns are summarized in one line each; only the most recent ones are kept.
+MAX_SUMMARY_LINES = 20
+
+
+def _default_tokenizer() -> Callable[[str], List]:
+    try:
+        return Settings.tokenizer
+    except Exception:
+        # No tokenizer available (e.g. offline without a cached tiktoken encoding):
+        # ~4 characters per token is close enough for budgeting.
+        return lambda text: range(len(text) // 4 + 1)
+
+
+class TokenBudgetMemory:
+    """
+    The agent's chat history, kept under a token budget.
+
+    Without it, every ReAct step resends the *whole* session to the LLM, including every
+    file ever read: prompt tokens and latency grow with each turn until the context
+    window overflows. When the history is over budget, we compact it in three passes:
+
+    1. Tool observations older than the last `keep_recent_turns` turns are truncated.
+    2. Whole old turns are dropped and replaced by a one-line-per-turn summary.
+    3. If the current turn alone is still too large, its older observations are truncated
+       too (the observations of the latest step are always kept intact).
+
+    The system prompt is never touched. Each message is tokenized once, when it is added
+    (or truncated): the total is kept up to date incrementally, so the cost of a step
+    does not grow with the length of the session.
+    """
+
+    def __init__(
+        self,
+        system_prompt: str = "",
+        token_budget: int = AGENT_MEMORY_TOKENS,
+        keep_recent_turns: int = AGENT_KEEP_RECENT_TURNS,
+        observation_tokens: int = AGENT_OBSERVATION_TOKENS,
+        tokenizer: Optional[Callable[[str], List]] = None,
+    ):
+        self.token_budget = token_budget
+        self.keep_recent_turns = max(1, keep_recent_turns)
+        self.observation_tokens = observation_tokens
+        self._tokenizer = tokenizer or _default_tokenizer()
+
+        self._system = ChatMessage(role=MessageRole.SYSTEM, content=system_prompt)
+        self._system_tokens = self.count_tokens(self._system)
+        self._summary_lines: List[str] = []
+        self._summary_tokens = 0
+        # Conversation messages and their token counts, index for index.
+        self._messages: List[ChatMessage] = []
+        self._tokens: List[int] = []
+        self._conversation_tokens = 0  # running sum of self._tokens
+
+    # --- Token Accounting ---
+
+    def count_tokens(self, message: ChatMessage) -> int:
+        text = message.content or ""
+        # Tool calls of an assistant message are sent to the LLM as JSON arguments.
+        for tool_call in message.additional_kwargs.get("tool_calls", []) or []:
+            function = getattr(tool_call, "function", None)
+            if function is not None:
+                text += f"{function.name}{function.arguments}"
+        return len(self._tokenizer(text)) + MESSAGE_OVERHEAD_TOKENS
+
+    @property
+    def total_tokens(self) -> int:
+        return self._system_tokens + self._summary_tokens + self._conversation_tokens
+
+    # --- Public API ---
+
+    def put(self, message: ChatMessage) -> None:
+        self._messages.append(message)
+        self._tokens.append(self.count_tokens(message))
+        self._conversation_tokens += self._tokens[-1]
+
+    def get(self) -> List[ChatMessage]:
+        """The history to send to the LLM: compacted first if it is over budget."""
+        if self.total_tokens > self.token_budget:
+            self._compact()
+        messages = [self._system]
+        if self._summary_lines:
+            messages.append(self._summary_message())
+        return messages + self._messages
+
+    def contains(self, message: ChatMessage) -> bool:
+        """True if this exact message is still in memory, neither truncated nor dropped."""
+        return any(m is message for m in self._messages)
+
+    # --- Compaction ---
+
+    def _turn_starts(self) -> List[int]:
+        return [i for i, m in enumerate(self._messages) if m.role == MessageRole.USER]
+
+    def _truncate_observation(self, i: int) -> None:
+        message = self._messages[i]
+        if message.role != MessageRole.TOOL or self._tokens[i] <= self.observation_tokens + MESSAGE_OVERHEAD_TOKENS:
+            return
+        # Cut on characters (~4 per token) to avoid a decode step; count the result exactly.
+        content = message.content or ""
+        head = content[: self.observation_tokens * 4]
+        omitted = self._tokens[i] - self.observation_tokens
+        self._messages[i] = ChatMessage(
+            role=message.role,
+            content=f"{head}\n[... truncated about {omitted} tokens of an earlier tool output]",
+            additional_kwargs=message.additional_kwargs,
+        )
+        tokens = self.count_tokens(self._messages[i])
+        self._conversation_tokens += tokens - self._tokens[i]
+        self._tokens[i] = tokens
+
+    def _summarize_turn(self, turn: List[ChatMessage]) -> str:
+        """One extractive line per dropped turn: what was asked, which tools, what came out."""
+        question = (turn[0].content or "").strip().replace("\n", " ")[:150]
+        tools = [
+            tool_call.function.name
+            for m in turn
+            for tool_call in m.additional_kwargs.get("tool_calls", []) or []
+            if getattr(tool_call, "function", None) is not None
+        ]
+        answers = [m for m in turn if m.role == MessageRole.ASSISTANT and m.content]
+        answer = (answers[-1].content or "").strip().replace("\n", " ")[:200] if answers else "(no answer)"
+        used = f" [tools: {', '.join(dict.fromkeys(tools))}]" if tools else ""
+        return f"- User: {question}{used} -> Assistant: {answer}"
+
+    def _summary_message(self) -> ChatMessage:
+        return ChatMessage(
+            role=MessageRole.SYSTEM,
+            content="Summary of the earlier conversation:\n" + "\n".join(self._summary_lines),
+        )
+
+    def _compact(self) -> None:
+        starts = self._turn_starts()
+        recent_start = starts[-self.keep_recent_turns] if len(starts) >= self.keep_recent_turns else 0
+
+        # 1. Truncate observations outside the recent turns.
+        for i in range(recent_start):
+            self._truncate_observation(i)
+
+        # 2. Drop whole old turns (oldest first) into the summary.
+        while self.total_tokens > self.token_budget:
+            starts = self._turn_starts()
+            if len(starts) <= self.keep_recent_turns:
+                break
+            end = starts[1]
+            # Messages before the first user message (none in practice) go with it.
+            self._summary_lines.append(self._summarize_turn(self._messages[:end]))
+            self._summary_lines = self._summary_lines[-MAX_SUMMARY_LINES:]
+            self._summary_tokens = self.count_tokens(self._summary_message())
+            self._conversation_tokens -= sum(self._tokens[:end])
+            del self._messages[:end]
+            del self._tokens[:end]
+
+        # 3. Still over budget: truncate observations of recent turns, except the latest step.
+        if self.total_tokens > self.token_budget:
+            last_assistant = max(
+                (i for i, m in enumerate(self._messages) if m.role == MessageRole.ASSISTANT), default=0
+            )
+            for i in range(last_assistant):
+                self._truncate_observation(i)
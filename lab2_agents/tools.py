@@ -1,23 +1,240 @@
 import os
+import re
+import math
+import mmap
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple, Union
 from llama_index.core.tools import FunctionTool
+from shared.env import load_env
+
+load_env()  # before any setting below is read (see shared/env.py)
+
+# --- Tool Result Memoization ---
+# The agent reads the guidelines and the same files again and again, within one chat
+# and across chats of the same process (e.g. batch runs). The cache lives in memory
+# only: it is empty again at every start (the only pure tool returns a constant, which
+# is not worth a database). A tool result is reused as long as its *fingerprint* is
+# unchanged:
+# - pure tools (same input -> same output) have a constant fingerprint: cached forever;
+# - file readers are fingerprinted by the file's (mtime, size): editing the file
+#   changes the fingerprint, and `save_plan` explicitly drops entries for its path.
+# At most AGENT_TOOL_CACHE_SIZE results are kept, least recently used evicted first:
+# in a long batch run every page of every file read would otherwise stay in memory.
+# AGENT_TOOL_CACHE=off disables both the cache and "unchanged since step N" observations.
+TOOL_CACHE = os.getenv("AGENT_TOOL_CACHE", "on").lower() == "on"
+TOOL_CACHE_SIZE = int(os.getenv("AGENT_TOOL_CACHE_SIZE", "256"))
+
+PURE = "pure"
+
+_cache_lock = threading.Lock()
+# (tool, args) -> (fingerprint, result), least recently used first
+_cache: "OrderedDict[Tuple, Tuple[Hashable, str]]" = OrderedDict()
+_fingerprint_fns: Dict[str, Callable[..., Optional[Hashable]]] = {}
+# Bumped by `invalidate_path`: a write within the mtime resolution that keeps the size
+# would otherwise leave the (mtime, size) fingerprint unchanged.
+_path_generations: Dict[str, int] = {}
+
+
+def file_fingerprint(file_path: str, **kwargs: Any) -> Optional[Hashable]:
+    """(mtime, size, generation) of a file, or None if it does not exist (nothing to cache)."""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, _path_generations.get(os.path.abspath(file_path), 0))
+
+
+def _cache_key(name: str, arguments: Dict[str, Any]) -> Tuple:
+    # Paths are normalized so "plans/a.md" and "./plans/a.md" share an entry.
+    if "file_path" in arguments:
+        arguments = {**arguments, "file_path": os.path.abspath(arguments["file_path"])}
+    return (name, tuple(sorted(arguments.items())))
+
+
+def memoize(fingerprint_fn: Callable[..., Optional[Hashable]]):
+    """
+    Caches a tool function's results while `fingerprint_fn(**arguments)` stays the same.
+    A None fingerprint means "don't cache" (e.g. the file is missing).
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+        _fingerprint_fns[fn.__name__] = fingerprint_fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TOOL_CACHE:
+                return fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            fingerprint = fingerprint_fn(**bound.arguments)
+            if fingerprint is None:
+                return fn(*args, **kwargs)
+            key = _cache_key(fn.__name__, bound.arguments)
+            with _cache_lock:
+                cached = _cache.get(key)
+                if cached is not None:
+                    _cache.move_to_end(key)  # mark as most recently used
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+            result = fn(*args, **kwargs)
+            with _cache_lock:
+                _cache[key] = (fingerprint, result)
+                _cache.move_to_end(key)
+                while len(_cache) > TOOL_CACHE_SIZE:
+                    _cache.popitem(last=False)
+            return result
+        return wrapper
+    return decorator
+
+
+def result_fingerprint(tool_name: str, tool_args: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    The current fingerprint of a tool call's result, or None if the tool is not memoized.
+    Two calls with the same arguments and fingerprint return the same result, which
+    lets the agent say "unchanged since step N" instead of repeating it.
+    """
+    fingerprint_fn = _fingerprint_fns.get(tool_name)
+    if not TOOL_CACHE or fingerprint_fn is None:
+        return None
+    try:
+        return fingerprint_fn(**tool_args)
+    except TypeError:
+        return None  # arguments the tool would reject anyway
+
+
+def invalidate_path(file_path: str) -> None:
+    """Drops cached results of every file tool for `file_path`."""
+    path = os.path.abspath(file_path)
+    entry = ("file_path", path)
+    with _cache_lock:
+        _path_generations[path] = _path_generations.get(path, 0) + 1
+        for key in [k for k in _cache if entry in k[1]]:
+            del _cache[key]
 
 # --- Tool Implementation Functions ---
 
-def read_file(file_path: str) -> str:
+# --- Paged File Reading ---
+# Whatever a tool returns goes straight into the LLM context. Returning a whole
+# multi-megabyte export costs memory, tokens and latency, and usually overflows the
+# context window. So files are read one *page* at a time, and the agent asks for the
+# slices it needs (or searches first, see `search_file`).
+# - AGENT_READ_PAGE_BYTES: default page size (~4 bytes per token).
+# - AGENT_READ_MAX_BYTES: the most a single read may return, whatever the agent asks.
+READ_PAGE_BYTES = int(os.getenv("AGENT_READ_PAGE_BYTES", "8000"))
+READ_MAX_BYTES = int(os.getenv("AGENT_READ_MAX_BYTES", "32000"))
+SEARCH_MAX_MATCHES = 20
+
+
+@contextmanager
+def _mapped(file_path: str) -> Iterator[Union[mmap.mmap, bytes]]:
+    """
+    Memory-maps a file: slicing it only loads the touched pages from disk, so a page
+    of a 2 GB file costs a page of memory, not 2 GB. (Empty files cannot be mapped.)
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
+
+
+def _line_offset(mm: Union[mmap.mmap, bytes], line: int) -> int:
+    """Byte offset where 1-based `line` starts (len(mm) if the file is shorter)."""
+    position = 0
+    for _ in range(line - 1):
+        newline = mm.find(b"\n", position)
+        if newline == -1:
+            return len(mm)
+        position = newline + 1
+    return position
+
+
+@memoize(file_fingerprint)
+def read_file(
+    file_path: str,
+    offset: int = 0,
+    length: int = READ_PAGE_BYTES,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+) -> str:
     """
-    Reads the content of a file from the filesystem.
+    Reads a page of a file from the filesystem.
     Useful for reading context, previous plans, or guidelines.
+
+    By default returns `length` bytes starting at byte `offset`. With start_line
+    (and optionally end_line, 1-based and inclusive), returns those lines instead.
+    Small files are returned whole; otherwise a header reports the file size, the
+    page count and the offset of the next page.
     """
     try:
         if not os.path.exists(file_path):
             return f"Error: File '{file_path}' does not exist."
-        
-        with open(file_path, "r") as f:
-            content = f.read()
-        return content
+
+        length = max(1, min(length, READ_MAX_BYTES))
+        with _mapped(file_path) as mm:
+            size = len(mm)
+            if start_line is not None:
+                start = _line_offset(mm, max(1, start_line))
+                end = len(mm) if end_line is None else _line_offset(mm, end_line + 1)
+                # Line ranges are capped too: a "range" may not sneak in the whole file.
+                end = min(end, start + READ_MAX_BYTES)
+            else:
+                start = min(max(0, offset), size)
+                end = min(start + length, size)
+            content = bytes(mm[start:end]).decode("utf-8", errors="replace")
+
+        # Small file, read from the start: same plain output as a simple `f.read()`.
+        if start == 0 and end == size:
+            return content
+
+        pages = max(1, math.ceil(size / length))
+        page = start // length + 1
+        next_page = f", next offset={end}" if end < size else ", end of file"
+        header = f"[{file_path}: {size} bytes, page {page}/{pages} (bytes {start}-{end}){next_page}]"
+        return f"{header}\n{content}"
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
+@memoize(file_fingerprint)
+def search_file(file_path: str, pattern: str, ignore_case: bool = True, max_matches: int = SEARCH_MAX_MATCHES) -> str:
+    """
+    Searches a file for a regular expression, grep-style.
+    Returns matching lines with their line number and byte offset, so the relevant
+    part can then be fetched with read_file (offset or start_line).
+    """
+    try:
+        if not os.path.exists(file_path):
+            return f"Error: File '{file_path}' does not exist."
+        regex = re.compile(pattern.encode("utf-8"), re.IGNORECASE if ignore_case else 0)
+
+        matches = []
+        with _mapped(file_path) as mm:
+            # Scan line by line over the mapping: memory stays flat whatever the file size.
+            position, line_number = 0, 0
+            while position < len(mm) and len(matches) < max_matches:
+                newline = mm.find(b"\n", position)
+                end = len(mm) if newline == -1 else newline
+                line_number += 1
+                line = mm[position:end]
+                if regex.search(line):
+                    text = bytes(line[:300]).decode("utf-8", errors="replace")
+                    matches.append(f"line {line_number} (offset {position}): {text}")
+                position = end + 1
+
+        if not matches:
+            return f"No match for '{pattern}' in '{file_path}'."
+        more = " (more matches not shown)" if len(matches) == max_matches else ""
+        return f"{len(matches)} match(es) for '{pattern}' in '{file_path}'{more}:\n" + "\n".join(matches)
+    except re.error as e:
+        return f"Error: invalid pattern: {e}"
+    except Exception as e:
+        return f"Error searching file: {str(e)}"
+
 def save_plan(file_path: str, content: str) -> str:
     """
     Saves the given content (text) to a file.
@@ -26,15 +243,18 @@ def save_plan(file_path: str, content: str) -> str:
     try:
         # Ensure directory exists
         directory = os.path.dirname(file_path)
-        if directory and not os.path.exists(directory):
-            os.makedirs(directory)
+        if directory:
+            os.makedirs(directory, exist_ok=True)  # two agents may create it at once
             
         with open(file_path, "w") as f:
             f.write(content)
+        # Cached reads of this path are stale now (even if mtime and size look equal).
+        invalidate_path(file_path)
         return f"Successfully saved content to '{file_path}'."
     except Exception as e:
         return f"Error saving file: {str(e)}"
 
+@memoize(lambda: PURE)
 def get_okr_guidelines() -> str:
     """
     Returns the official guidelines for writing OKRs (Objectives and Key Results).
@@ -57,13 +277,30 @@ def get_okr_guidelines() -> str:
     **KR 2:** Increase unit test coverage from 60% to 85%.
     """
 
+# Tools without side effects: the agent may run them side by side in one step.
+# Anything else (save_plan, or a tool you add) runs alone, in call order.
+READ_ONLY_TOOLS = frozenset({"read_file", "search_file", "get_okr_guidelines"})
+
 # --- LlamaIndex Tool Definitions ---
 # We wrap the python functions in FunctionTool so the LLM can understand them.
 
 read_file_tool = FunctionTool.from_defaults(
     fn=read_file,
     name="read_file",
-    description="Read the content of a file. Input: file_path."
+    description=(
+        "Read a file page by page. Inputs: file_path; optionally offset and length (bytes) "
+        "or start_line and end_line (1-based, inclusive). Large files return one page with "
+        "a header giving the total size, page count and next offset."
+    )
+)
+
+search_file_tool = FunctionTool.from_defaults(
+    fn=search_file,
+    name="search_file",
+    description=(
+        "Search a file for a regular expression. Inputs: file_path, pattern. Returns matching "
+        "lines with line numbers and byte offsets to read next with read_file."
+    )
 )
 
 save_plan_tool = FunctionTool.from_defaults(
@@ -78,5 +315,35 @@ okr_guidelines_tool = FunctionTool.from_defaults(
     description="Get the official guidelines for writing OKRs."
 )
 
-ALL_TOOLS = [read_file_tool, save_plan_tool, okr_guidelines_tool]
+ALL_TOOLS = [read_file_tool, search_file_tool, save_plan_tool, okr_guidelines_tool]
+
+
+def _is_within(path: str, directory: str) -> bool:
+    return os.path.commonpath([path, directory]) == directory
+
+
+def tools_with_output_dir(output_dir: str) -> List[FunctionTool]:
+    """
+    ALL_TOOLS, with a `save_plan` that only writes under `output_dir`.
+
+    Batch runs give every task its own directory, so hundreds of agents saving
+    "okr_plan.md" don't overwrite each other. Relative paths are saved inside the
+    directory; paths outside of it are refused.
+    """
+    root = os.path.abspath(output_dir)
+
+    def save_plan_in_output_dir(file_path: str, content: str) -> str:
+        path = os.path.abspath(file_path)
+        if not _is_within(path, root):
+            path = os.path.abspath(os.path.join(root, file_path))
+        if not _is_within(path, root):
+            return f"Error: files can only be saved under '{output_dir}'."
+        return save_plan(path, content)
+
+    bound_save_plan_tool = FunctionTool.from_defaults(
+        fn=save_plan_in_output_dir,
+        name="save_plan",
+        description=f"Save text content to a file under '{output_dir}'. Inputs: file_path, content.",
+    )
+    return [bound_save_plan_tool if tool is save_plan_tool else tool for tool in ALL_TOOLS]
 
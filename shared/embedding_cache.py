@@ -0,0 +1,235 @@
+import os
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional
+
+from pydantic import PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text before hashing so trivial differences do not cause cache misses.
+
+    We apply Unicode NFKC and collapse whitespace, but keep the case: casing can
+    change the embedding, so "MFA" and "mfa" stay separate entries.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class EmbeddingCache:
+    """
+    An on-disk, size-bounded LRU store of embedding vectors backed by SQLite.
+
+    Why SQLite? It is in the standard library, safe for several processes to share
+    (WAL mode), and gives us an index on `last_used` for cheap LRU eviction.
+    Vectors are stored as raw float32 bytes: 4 bytes per dimension instead of a
+    JSON list of floats.
+
+    A hit must not cost a disk write: every query embedding is looked up here, and an
+    `UPDATE` + `commit` per hit would put a synchronous fsync on the query path. Hits
+    only note their new `last_used` in memory; the notes are written in one batch
+    every `touch_batch` hits or `touch_flush_s` seconds, before every eviction (so the
+    LRU order is up to date when it matters) and at exit. A crash loses nothing but
+    some recency, i.e. a recently used vector may be evicted a little early.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 100_000,
+        touch_batch: int = 1000,
+        touch_flush_s: float = 60.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_batch = touch_batch
+        self.touch_flush_s = touch_flush_s
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}  # key -> last_used not yet written
+        self._touched_since = time.monotonic()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(model: str, kind: str, text: str) -> str:
+        """Key = SHA-256 of (model, text|query, normalized text)."""
+        raw = f"{model}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[Embedding]]:
+        """Looks up several keys at once and refreshes their LRU timestamp."""
+        if not keys:
+            return []
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look up in slices.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                if not self._touched:
+                    self._touched_since = time.monotonic()
+                self._touched.update((key, now) for key in found)
+                if (
+                    len(self._touched) >= self.touch_batch
+                    or time.monotonic() - self._touched_since >= self.touch_flush_s
+                ):
+                    self._write_touches()
+                    self._conn.commit()
+        return [found.get(key) for key in keys]
+
+    def _write_touches(self) -> None:
+        """Writes the pending `last_used` updates (caller holds the lock and commits)."""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def flush(self) -> None:
+        """Writes the pending `last_used` updates now."""
+        with self._lock:
+            if self._touched:
+                self._write_touches()
+                self._conn.commit()
+
+    def put_many(self, model: str, keys: List[str], vectors: List[Embedding]) -> None:
+        """Stores new vectors, then evicts the least recently used ones if over budget."""
+        now = time.time()
+        with self._lock:
+            # Same transaction: recent hits must count before we pick what to evict.
+            self._write_touches()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                [(key, model, array("f", vector).tobytes(), now) for key, vector in zip(keys, vectors)],
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN ("
+                    " SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps any LlamaIndex embedding model with a persistent `EmbeddingCache`.
+
+    Only texts that were never embedded by this model go to the wrapped model;
+    everything else is served from disk. This makes re-ingestion, chunking experiments
+    and collection migrations free for chunks we have already paid for.
+
+    Why not `BaseEmbedding.embeddings_cache`? The built-in cache keys entries by raw
+    text only (switching models would return wrong vectors), stores JSON and never evicts.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _cache_model: str = PrivateAttr()
+    _query_kind: str = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._cache = cache
+        # Include the class and output size so e.g. two providers serving a model
+        # with the same name, or a truncated `dimensions`, never share vectors.
+        # A wrapper that only changes *how* the model is called (the gateway) is looked
+        # through, so turning it on or off keeps the cached vectors.
+        model = getattr(inner, "inner", inner)
+        dimensions = getattr(model, "dimensions", None)
+        self._cache_model = f"{type(model).__name__}:{model.model_name}:{dimensions}"
+        # A query instruction (LocalEmbedding's EMBED_QUERY_INSTRUCTION) changes query
+        # vectors only: it is part of the query key, and chunk vectors stay cached.
+        instruction = getattr(model, "query_instruction", None) or ""
+        self._query_kind = f"query:{instruction}" if instruction else "query"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _lookup(self, kind: str, texts: List[str]):
+        keys = [EmbeddingCache.make_key(self._cache_model, kind, t) for t in texts]
+        vectors = self._cache.get_many(keys)
+        misses = [i for i, v in enumerate(vectors) if v is None]
+        return keys, vectors, misses
+
+    def _store(self, keys, vectors, misses, computed: List[Embedding]) -> List[Embedding]:
+        for i, vector in zip(misses, computed):
+            vectors[i] = vector
+        self._cache.put_many(self._cache_model, [keys[i] for i in misses], computed)
+        return vectors
+
+    # We call the wrapped model's private `_get_*` methods on purpose: the public
+    # ones would emit a second set of embedding events for the same batch.
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        keys, vectors, misses = self._lookup(self._query_kind, [query])
+        if misses:
+            self._store(keys, vectors, misses, [self._inner._get_query_embedding(query)])
+        return vectors[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        keys, vectors, misses = self._lookup(self._query_kind, [query])
+        if misses:
+            self._store(keys, vectors, misses, [await self._inner._aget_query_embedding(query)])
+        return vectors[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, vectors, misses = self._lookup("text", texts)
+        if misses:
+            computed = self._inner._get_text_embeddings([texts[i] for i in misses])
+            self._store(keys, vectors, misses, computed)
+        return vectors
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        keys, vectors, misses = self._lookup("text", texts)
+        if misses:
+            computed = await self._inner._aget_text_embeddings([texts[i] for i in misses])
+            self._store(keys, vectors, misses, computed)
+        return vectors
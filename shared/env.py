@@ -0,0 +1,23 @@
+import threading
+
+from dotenv import load_dotenv
+
+# --- Configuration from .env ---
+# Settings are read with os.getenv, many of them at import time (e.g. `RETRIEVAL_MODE`
+# in pipeline.py). `.env` must therefore be loaded before those modules read them,
+# not later in `init_settings()`. Every module with module-level settings calls
+# `load_env()` right above them: whichever is imported first loads the file.
+# Variables already set in the real environment win over `.env`.
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_env() -> None:
+    """Loads `.env` into `os.environ`, once per process."""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            load_dotenv()
+            _loaded = True
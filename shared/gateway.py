@@ -0,0 +1,593 @@
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from pydantic import PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.llms.function_calling import FunctionCallingLLM
+
+from shared.rate_limit import TokenBucket
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and server errors.
+# Anything else (400 bad request, 401 bad key...) would fail again: it is raised at once.
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = ("Timeout", "Connect", "RateLimit", "ServiceUnavailable")
+
+
+@dataclass
+class GatewayConfig:
+    """
+    Traffic policy for one provider, read from `<PREFIX>_*` environment variables
+    (PREFIX is "LLM" or "EMBED"):
+
+    - RPM / TPM: requests and (estimated) tokens per minute, 0 = unlimited.
+    - MAX_RETRIES, BACKOFF_BASE_S, BACKOFF_MAX_S: retry policy for transient errors.
+    - HEDGE_AFTER_S: send a duplicate request if the first has not answered after
+      this many seconds, and keep whichever answers first (0 = off).
+    - COALESCE: identical requests in flight at the same time share one call.
+    """
+    rpm: float = 0
+    tpm: float = 0
+    max_retries: int = 4
+    backoff_base_s: float = 0.5
+    backoff_max_s: float = 30.0
+    hedge_after_s: float = 0.0
+    coalesce: bool = True
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "GatewayConfig":
+        return cls(
+            rpm=float(os.getenv(f"{prefix}_RPM", "0")),
+            tpm=float(os.getenv(f"{prefix}_TPM", "0")),
+            max_retries=int(os.getenv(f"{prefix}_MAX_RETRIES", "4")),
+            backoff_base_s=float(os.getenv(f"{prefix}_BACKOFF_BASE_S", "0.5")),
+            backoff_max_s=float(os.getenv(f"{prefix}_BACKOFF_MAX_S", "30")),
+            hedge_after_s=float(os.getenv(f"{prefix}_HEDGE_AFTER_S", "0")),
+            coalesce=os.getenv(f"{prefix}_COALESCE", "on").lower() == "on",
+        )
+
+
+def is_retryable(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_ERROR_NAMES)
+
+
+def _retry_after_s(error: BaseException) -> Optional[float]:
+    """The server's Retry-After hint (seconds), if the error carries one."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def request_key(*parts: Any) -> str:
+    """A digest identifying a request: same prompt + same parameters -> same key."""
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(texts: Sequence[str]) -> int:
+    # ~4 characters per token: exact counts would need the provider's tokenizer,
+    # and the rate limiter only needs the right order of magnitude.
+    return sum(len(t or "") for t in texts) // 4 + 1
+
+
+# Set by `no_retries()`: calls made in this thread / asyncio task are never retried.
+_retries_off: contextvars.ContextVar[bool] = contextvars.ContextVar("gateway_retries_off", default=False)
+
+
+@contextmanager
+def no_retries() -> Iterator[None]:
+    """
+    Within this block, gateway calls fail at once instead of being retried.
+
+    For callers that would rather fail fast than wait through backoffs of up to
+    BACKOFF_MAX_S, e.g. the app's readiness self-test.
+    """
+    token = _retries_off.set(True)
+    try:
+        yield
+    finally:
+        _retries_off.reset(token)
+
+
+# --- Hedged Attempts ---
+# A hedged request runs the same call twice, and both attempts emit LlamaIndex events
+# (LLM end, tokens...). Only one answer is used, so only one should be counted.
+# Each attempt runs with its own (group, attempt) in this context variable; the first
+# attempt to finish claims the group, and instrumentation skips the others' events.
+
+class _HedgeGroup:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.winner: Optional[int] = None
+
+
+_hedge_attempt: contextvars.ContextVar[Optional[Tuple[_HedgeGroup, int]]] = contextvars.ContextVar(
+    "gateway_hedge_attempt", default=None
+)
+
+
+def claim_hedge_win() -> bool:
+    """
+    Called by instrumentation when a call finishes: False if this is a hedged attempt
+    that lost the race (its answer is discarded), True otherwise.
+    """
+    attempt = _hedge_attempt.get()
+    if attempt is None:
+        return True
+    group, index = attempt
+    with group.lock:
+        if group.winner is None:
+            group.winner = index
+        return group.winner == index
+
+
+class _InFlight:
+    """An async call shared by every caller of the same request (see `Gateway.acall`)."""
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class Gateway:
+    """
+    The traffic policy between this process and one model provider.
+
+    Every request goes through, in this order:
+    1. **Coalescing**: if an identical request is already in flight, wait for its result
+       instead of paying for it twice (many users asking the same thing at once).
+    2. **Rate limiting**: take one request and the estimated tokens from token buckets,
+       waiting if the per-minute budget is spent, instead of collecting 429s.
+    3. **Hedging**: if the call is slower than `hedge_after_s`, fire a second one and
+       keep the first answer. Trades a few extra calls for a much shorter tail.
+    4. **Retries**: transient errors (429, 5xx, timeouts) are retried with exponential
+       backoff and full jitter, so clients that failed together don't retry together.
+    """
+
+    def __init__(self, name: str, config: GatewayConfig):
+        self.name = name
+        self.config = config
+        # Allow bursts of ~10 seconds worth of budget, then settle to the average rate.
+        self._requests = TokenBucket(config.rpm, capacity=max(1.0, config.rpm / 6)) if config.rpm > 0 else None
+        self._tokens = TokenBucket(config.tpm, capacity=max(1.0, config.tpm / 6)) if config.tpm > 0 else None
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._ainflight: Dict[Tuple[int, str], _InFlight] = {}
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.stats = {"calls": 0, "retries": 0, "coalesced": 0, "hedged": 0}
+
+    # --- Helpers ---
+
+    def _count(self, stat: str) -> None:
+        # Calls come from many threads at once (app workers, hedge pool).
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _backoff_s(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.config.backoff_max_s, self.config.backoff_base_s * 2 ** attempt))
+        retry_after = _retry_after_s(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def _should_retry(self, attempt: int, error: BaseException) -> bool:
+        if attempt >= self.config.max_retries or _retries_off.get() or not is_retryable(error):
+            return False
+        self._count("retries")
+        return True
+
+    def _hedge_pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix=f"{self.name}-hedge")
+            return self._pool
+
+    def _submit(self, fn: Callable[[], T]) -> Future:
+        # Run in a copy of the caller's context, so instrumentation (e.g. the RAG
+        # metrics trace) still sees which request a hedged call belongs to.
+        return self._hedge_pool().submit(contextvars.copy_context().run, fn)
+
+    # --- Sync Path ---
+
+    def call(self, fn: Callable[[], T], key: Optional[str] = None, tokens: int = 0, hedge: bool = True) -> T:
+        """Runs `fn` (one provider call) under the gateway's policy."""
+        if key is None or not self.config.coalesce:
+            return self._call_with_retries(fn, tokens, hedge)
+
+        with self._lock:
+            shared = self._inflight.get(key)
+            if shared is None:
+                shared = self._inflight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            self._count("coalesced")
+            return shared.result()
+
+        try:
+            result = self._call_with_retries(fn, tokens, hedge)
+            shared.set_result(result)
+            return result
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _throttle(self, tokens: int) -> None:
+        if self._requests is not None:
+            self._requests.acquire()
+        if self._tokens is not None and tokens:
+            self._tokens.acquire(tokens)
+
+    def _call_with_retries(self, fn: Callable[[], T], tokens: int, hedge: bool) -> T:
+        attempt = 0
+        while True:
+            self._throttle(tokens)
+            self._count("calls")
+            try:
+                return self._hedged(fn) if hedge and self.config.hedge_after_s > 0 else fn()
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._backoff_s(attempt, e)
+                attempt += 1
+                print(f"⏳ {self.name}: {type(e).__name__}, retry {attempt}/{self.config.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _hedged(self, fn: Callable[[], T]) -> T:
+        group = _HedgeGroup()
+
+        def attempt(index: int) -> Callable[[], T]:
+            def run() -> T:
+                _hedge_attempt.set((group, index))  # _submit runs us in a context copy
+                return fn()
+            return run
+
+        futures = [self._submit(attempt(0))]
+        done, _ = wait(futures, timeout=self.config.hedge_after_s)
+        if not done:
+            self._count("hedged")
+            futures.append(self._submit(attempt(1)))
+        # The first success wins; the slower call finishes in the background, ignored.
+        error = None
+        for future in as_completed(futures):
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        raise error
+
+    # --- Async Path ---
+
+    async def acall(
+        self, fn: Callable[[], Awaitable[T]], key: Optional[str] = None, tokens: int = 0, hedge: bool = True
+    ) -> T:
+        """Async twin of `call`: `fn` returns a fresh awaitable each time it is called."""
+        if key is None or not self.config.coalesce:
+            return await self._acall_with_retries(fn, tokens, hedge)
+
+        # Tasks belong to an event loop: coalesce only within the same loop.
+        loop_key = (id(asyncio.get_running_loop()), key)
+        inflight = self._ainflight.get(loop_key)
+        if inflight is None:
+            # The call runs in its own task, owned by no caller in particular: the first
+            # caller disconnecting must not abort the others' identical request.
+            task = asyncio.ensure_future(self._acall_with_retries(fn, tokens, hedge))
+            inflight = self._ainflight[loop_key] = _InFlight(task)
+            task.add_done_callback(lambda done: self._aforget(loop_key, inflight))
+        else:
+            self._count("coalesced")
+
+        inflight.waiters += 1
+        try:
+            return await asyncio.shield(inflight.task)
+        finally:
+            inflight.waiters -= 1
+            # Cancelled callers leave; the call itself is cancelled with the last one.
+            if inflight.waiters == 0 and not inflight.task.done():
+                inflight.task.cancel()
+
+    def _aforget(self, loop_key: Tuple[int, str], inflight: _InFlight) -> None:
+        if self._ainflight.get(loop_key) is inflight:
+            del self._ainflight[loop_key]
+        if not inflight.task.cancelled():
+            inflight.task.exception()  # mark as retrieved when every caller had left
+
+    async def _athrottle(self, tokens: int) -> None:
+        if self._requests is not None:
+            await self._requests.aacquire()
+        if self._tokens is not None and tokens:
+            await self._tokens.aacquire(tokens)
+
+    async def _acall_with_retries(self, fn: Callable[[], Awaitable[T]], tokens: int, hedge: bool) -> T:
+        attempt = 0
+        while True:
+            await self._athrottle(tokens)
+            self._count("calls")
+            try:
+                return await (self._ahedged(fn) if hedge and self.config.hedge_after_s > 0 else fn())
+            except Exception as e:
+                if not self._should_retry(attempt, e):
+                    raise
+                delay = self._backoff_s(attempt, e)
+                attempt += 1
+                print(f"⏳ {self.name}: {type(e).__name__}, retry {attempt}/{self.config.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _ahedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        group = _HedgeGroup()
+
+        async def attempt(index: int) -> T:
+            _hedge_attempt.set((group, index))  # each task runs in its own context copy
+            return await fn()
+
+        tasks = [asyncio.ensure_future(attempt(0))]
+        done, _ = await asyncio.wait(tasks, timeout=self.config.hedge_after_s)
+        if not done:
+            self._count("hedged")
+            tasks.append(asyncio.ensure_future(attempt(1)))
+        try:
+            error = None
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as e:
+                    error = e
+            raise error
+        finally:
+            # Unlike threads, tasks can be cancelled: the loser stops consuming the provider.
+            for task in tasks:
+                task.cancel()
+
+
+_gateways: Dict[str, Gateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_gateway(prefix: str) -> Gateway:
+    """
+    The process-wide gateway for "LLM" or "EMBED" traffic.
+
+    One per process, not one per model instance: the provider's limits apply to our
+    API key as a whole, so every caller (RAG queries, agents, ingestion) must draw
+    from the same buckets.
+    """
+    with _gateways_lock:
+        if prefix not in _gateways:
+            _gateways[prefix] = Gateway(prefix.lower(), GatewayConfig.from_env(prefix))
+        return _gateways[prefix]
+
+
+# --- LlamaIndex Wrappers ---
+# `Settings.llm` / `Settings.embed_model` are replaced by these wrappers in init_settings,
+# so the RAG pipeline and the agent go through the gateway without any code change.
+#
+# As in CachedEmbedding, the wrapped model is called through the methods that emit
+# LlamaIndex's instrumentation events, and the wrappers emit none: each call is still
+# observed exactly once.
+
+def _chat_key(kind: str, messages: Sequence[ChatMessage], kwargs: Dict[str, Any]) -> str:
+    return request_key(kind, [(m.role, m.content, m.additional_kwargs) for m in messages], sorted(kwargs.items(), key=str))
+
+
+def _messages_tokens(messages: Sequence[ChatMessage]) -> int:
+    return estimate_tokens([m.content or "" for m in messages])
+
+
+class GatewayLLM(FunctionCallingLLM):
+    """Routes every call of a function-calling LLM (OpenAI, Ollama) through a `Gateway`."""
+
+    _inner: FunctionCallingLLM = PrivateAttr()
+    _gateway: Gateway = PrivateAttr()
+
+    def __init__(self, inner: FunctionCallingLLM, gateway: Gateway, **kwargs: Any):
+        super().__init__(
+            callback_manager=inner.callback_manager,
+            system_prompt=inner.system_prompt,
+            messages_to_prompt=inner.messages_to_prompt,
+            completion_to_prompt=inner.completion_to_prompt,
+            pydantic_program_mode=inner.pydantic_program_mode,
+            **kwargs,
+        )
+        self._inner = inner
+        self._gateway = gateway
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "GatewayLLM"
+
+    @property
+    def inner(self) -> FunctionCallingLLM:
+        return self._inner
+
+    @property
+    def gateway(self) -> Gateway:
+        return self._gateway
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._inner.metadata
+
+    # Tool calling is provider-specific: the wrapped LLM formats tools and parses calls.
+
+    def _prepare_chat_with_tools(self, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        return self._inner._prepare_chat_with_tools(*args, **kwargs)
+
+    def _validate_chat_with_tools_response(self, *args: Any, **kwargs: Any) -> ChatResponse:
+        return self._inner._validate_chat_with_tools_response(*args, **kwargs)
+
+    def get_tool_calls_from_response(self, *args: Any, **kwargs: Any):
+        return self._inner.get_tool_calls_from_response(*args, **kwargs)
+
+    # --- Complete responses: coalesced, rate limited, hedged, retried ---
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._gateway.call(
+            lambda: self._inner.chat(messages, **kwargs),
+            key=_chat_key("chat", messages, kwargs),
+            tokens=_messages_tokens(messages),
+        )
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self._gateway.call(
+            lambda: self._inner.complete(prompt, formatted=formatted, **kwargs),
+            key=request_key("complete", prompt, formatted, sorted(kwargs.items(), key=str)),
+            tokens=estimate_tokens([prompt]),
+        )
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._gateway.acall(
+            lambda: self._inner.achat(messages, **kwargs),
+            key=_chat_key("chat", messages, kwargs),
+            tokens=_messages_tokens(messages),
+        )
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self._gateway.acall(
+            lambda: self._inner.acomplete(prompt, formatted=formatted, **kwargs),
+            key=request_key("complete", prompt, formatted, sorted(kwargs.items(), key=str)),
+            tokens=estimate_tokens([prompt]),
+        )
+
+    # --- Streams: rate limited and retried until the first chunk ---
+    # A stream can't be shared or raced once tokens flow to the user, so there is no
+    # coalescing or hedging. But most failures (429, connection refused) happen
+    # before the first chunk: we pull it inside the gateway, where they are retried.
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self._stream(lambda: self._inner.stream_chat(messages, **kwargs), _messages_tokens(messages))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self._stream(lambda: self._inner.stream_complete(prompt, formatted=formatted, **kwargs), estimate_tokens([prompt]))
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return await self._astream(lambda: self._inner.astream_chat(messages, **kwargs), _messages_tokens(messages))
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        return await self._astream(
+            lambda: self._inner.astream_complete(prompt, formatted=formatted, **kwargs), estimate_tokens([prompt])
+        )
+
+    def _stream(self, open_stream: Callable[[], Any], tokens: int):
+        def start():
+            stream = open_stream()
+            return next(stream, None), stream
+
+        first, stream = self._gateway.call(start, tokens=tokens, hedge=False)
+
+        def gen():
+            if first is not None:
+                yield first
+            yield from stream
+
+        return gen()
+
+    async def _astream(self, open_stream: Callable[[], Awaitable[Any]], tokens: int):
+        async def start():
+            stream = await open_stream()
+            try:
+                return await stream.__anext__(), stream
+            except StopAsyncIteration:
+                return None, stream
+
+        first, stream = await self._gateway.acall(start, tokens=tokens, hedge=False)
+
+        async def gen():
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+
+        return gen()
+
+
+class GatewayEmbedding(BaseEmbedding):
+    """Routes every call of an embedding model through a `Gateway`."""
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _gateway: Gateway = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, gateway: Gateway, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name,
+            embed_batch_size=inner.embed_batch_size,
+            **kwargs,
+        )
+        self._inner = inner
+        self._gateway = gateway
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "GatewayEmbedding"
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    @property
+    def gateway(self) -> Gateway:
+        return self._gateway
+
+    # Private `_get_*` methods of the wrapped model, for the same reason as CachedEmbedding.
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._gateway.call(
+            lambda: self._inner._get_query_embedding(query),
+            key=request_key("query", query),
+            tokens=estimate_tokens([query]),
+        )
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return await self._gateway.acall(
+            lambda: self._inner._aget_query_embedding(query),
+            key=request_key("query", query),
+            tokens=estimate_tokens([query]),
+        )
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._gateway.call(
+            lambda: self._inner._get_text_embeddings(texts),
+            key=request_key("texts", texts),
+            tokens=estimate_tokens(texts),
+        )
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._gateway.acall(
+            lambda: self._inner._aget_text_embeddings(texts),
+            key=request_key("texts", texts),
+            tokens=estimate_tokens(texts),
+        )
@@ -3,10 +3,10 @@ from reportlab.pdfgen import canvas
 import os
 
 DATA_DIR = "lab1_rag/data"
-os.makedirs(DATA_DIR, exist_ok=True)
 
-def create_pdf(filename, title, content):
-    filepath = os.path.join(DATA_DIR, filename)
+def create_pdf(filename, title, content, data_dir=DATA_DIR, verbose=True):
+    os.makedirs(data_dir, exist_ok=True)
+    filepath = os.path.join(data_dir, filename)
     c = canvas.Canvas(filepath, pagesize=LETTER)
     width, height = LETTER
     
@@ -33,7 +33,28 @@ def create_pdf(filename, title, content):
         text_y -= line_height
             
     c.save()
-    print(f"Created {filepath}")
+    if verbose:
+        print(f"Created {filepath}")
+
+def generate_corpus(data_dir, num_docs):
+    """
+    Writes `num_docs` synthetic policy PDFs to `data_dir` (used by the benchmarks).
+
+    Each document is one of the policies below, stamped with a unique region and
+    revision so that no two documents (or chunks) are byte-for-byte identical.
+    """
+    for i in range(num_docs):
+        policy = policies[i % len(policies)]
+        revision = i // len(policies)
+        region = f"Region {i % 17} / Office {i % 29}"
+        stem = policy["filename"].removesuffix(".pdf")
+        create_pdf(
+            f"{stem}_r{revision:05d}.pdf",
+            f"{policy['title']} ({region}, rev. {revision})",
+            f"Applies to: {region}\nRevision: {revision}\n" + policy["content"],
+            data_dir=data_dir,
+            verbose=False,
+        )
 
 policies = [
     {
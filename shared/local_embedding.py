@@ -0,0 +1,236 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from pydantic import Field, PrivateAttr
+
+# Dynamic batching defaults (see `MicroBatcher`).
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+
+INSTALL_HINT = "Local embeddings need sentence-transformers: run `uv sync --extra local`."
+
+
+def local_embedding_config() -> Dict[str, Any]:
+    """
+    Reads the local embedding settings (EMBED_PROVIDER=local) from the environment.
+
+    Read when a `LocalEmbedding` is created, not at import time: shared/utils.py imports
+    this module before `.env` is loaded.
+
+    - EMBED_LOCAL_MODEL: any sentence-transformers model from the Hugging Face Hub (or a local path).
+    - EMBED_LOCAL_BACKEND: "torch" or "onnx" (ONNX Runtime is usually faster on CPU).
+    - EMBED_THREADS: CPU threads used by inference (0 = let the runtime decide, usually all cores).
+    - EMBED_MAX_BATCH / EMBED_MAX_WAIT_MS: dynamic batching limits (see `MicroBatcher`).
+    - EMBED_QUERY_INSTRUCTION: prefix added to queries only, which some retrieval
+      models expect (e.g. E5, or BGE for short queries).
+    """
+    return {
+        "model_name": os.getenv("EMBED_LOCAL_MODEL", "BAAI/bge-small-en-v1.5"),
+        "backend": os.getenv("EMBED_LOCAL_BACKEND", "torch").lower(),
+        "num_threads": int(os.getenv("EMBED_THREADS", "0")),
+        "max_batch": int(os.getenv("EMBED_MAX_BATCH", str(DEFAULT_MAX_BATCH))),
+        "max_wait_ms": float(os.getenv("EMBED_MAX_WAIT_MS", str(DEFAULT_MAX_WAIT_MS))),
+        "query_instruction": os.getenv("EMBED_QUERY_INSTRUCTION", ""),
+    }
+
+
+class MicroBatcher:
+    """
+    Dynamic batching: merges concurrent embedding requests into one forward pass.
+
+    A CPU model embeds 32 texts in one call far faster than in 32 calls, but requests
+    rarely arrive that way: the Gradio app embeds one query per user, and ingestion
+    workers each send their own small batches. Every request goes into a queue; a single
+    worker thread takes the first one, waits up to `max_wait_ms` for more to arrive
+    (up to `max_batch` texts), runs one `encode` and hands each caller its slice.
+
+    One inference thread also means the runtime's own thread pool is never
+    oversubscribed by several callers running the model at the same time.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self._encode = encode_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"requests": 0, "batches": 0, "texts": 0}
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queues texts for embedding; the Future resolves to their vectors, in order."""
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_started()
+        self._queue.put((texts, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        # Started on first use, so merely importing or configuring costs nothing.
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> List[Tuple[List[str], Future]]:
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait_s
+        # Only wait for company while there is room left in the batch.
+        while size < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            # Skip callers that gave up (e.g. a cancelled async request).
+            batch = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["texts"] += len(texts)
+            try:
+                vectors = self._encode(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for item_texts, future in batch:
+                future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    A sentence-transformers model running in-process on the CPU.
+
+    No API key, no network and no per-token cost: ingestion runs as fast as the
+    machine allows. The model is loaded lazily on the first embedding (importing
+    torch and loading weights takes seconds), and all calls go through a
+    `MicroBatcher`, so concurrent callers share forward passes.
+    """
+
+    backend: str = Field(default="torch", description="torch or onnx")
+    num_threads: int = Field(default=0, description="CPU threads for inference (0 = runtime default)")
+    device: str = Field(default="cpu")
+    query_instruction: str = Field(default="", description="Prefix added to queries only")
+
+    _model: Any = PrivateAttr(default=None)
+    _load_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    _batcher: MicroBatcher = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        # Anything not passed explicitly comes from the environment (local_embedding_config).
+        config = local_embedding_config()
+        model_name = model_name or config["model_name"]
+        max_batch = max_batch or config["max_batch"]
+        max_wait_ms = config["max_wait_ms"] if max_wait_ms is None else max_wait_ms
+        for field_name in ("backend", "num_threads", "query_instruction"):
+            kwargs.setdefault(field_name, config[field_name])
+        super().__init__(model_name=model_name, embed_batch_size=max_batch, **kwargs)
+        self._batcher = MicroBatcher(self._encode, max_batch=max_batch, max_wait_ms=max_wait_ms)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    @property
+    def batcher(self) -> MicroBatcher:
+        return self._batcher
+
+    # --- Lazy Loading ---
+
+    def load(self):
+        """Loads the model now (it is otherwise loaded on the first embedding)."""
+        with self._load_lock:
+            if self._model is None:
+                self._model = self._load_model()
+        return self._model
+
+    def _load_model(self):
+        try:
+            # Deferred: sentence-transformers pulls in torch, which takes seconds to import.
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(INSTALL_HINT) from e
+
+        model_kwargs = {}
+        if self.num_threads > 0:
+            torch.set_num_threads(self.num_threads)
+            if self.backend == "onnx":
+                # ONNX Runtime has its own thread pool, configured per session.
+                import onnxruntime
+
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = self.num_threads
+                model_kwargs["session_options"] = session_options
+
+        print(f"🧠 Loading local embedding model {self.model_name} ({self.backend}, {self.device})...")
+        model = SentenceTransformer(
+            self.model_name, device=self.device, backend=self.backend, model_kwargs=model_kwargs or None
+        )
+        print(f"✅ Local embedding model ready ({model.get_sentence_embedding_dimension()} dimensions)")
+        return model
+
+    # --- Inference ---
+
+    def _encode(self, texts: List[str]) -> List[Embedding]:
+        # Runs on the batcher thread. `encode` sorts the texts by length internally,
+        # so texts of similar length share a padded batch.
+        vectors = self.load().encode(
+            texts,
+            batch_size=self.embed_batch_size,
+            normalize_embeddings=True,  # unit vectors: cosine similarity == dot product
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        return self._batcher.submit(texts).result()
+
+    async def _aembed(self, texts: List[str]) -> List[Embedding]:
+        # Wait without blocking the event loop: the work happens on the batcher thread.
+        return await asyncio.wrap_future(self._batcher.submit(texts))
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed([self.query_instruction + query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await self._aembed([self.query_instruction + query]))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aembed([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return await self._aembed(texts)
@@ -0,0 +1,47 @@
+import re
+import zlib
+import math
+from typing import List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedding(BaseEmbedding):
+    """
+    A deterministic, offline embedding model for benchmarks and evaluation.
+
+    Each word is hashed into one of `embed_dim` buckets (the "hashing trick") and the
+    resulting bag-of-words vector is L2-normalized. Texts that share words get a high
+    cosine similarity, so retrieval behaves sensibly, while embedding costs no network
+    call, no API key and no model download, and always returns the same vector.
+    """
+
+    embed_dim: int = 256
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _embed(self, text: str) -> Embedding:
+        vector = [0.0] * self.embed_dim
+        for word in WORD_PATTERN.findall(text.lower()):
+            bucket = zlib.crc32(word.encode("utf-8"))
+            # One hash bit picks the sign, so colliding words tend to cancel out
+            # instead of always adding up.
+            vector[bucket % self.embed_dim] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm > 0 else vector
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return [self._embed(text) for text in texts]
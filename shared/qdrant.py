@@ -0,0 +1,104 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import qdrant_client
+
+from shared.env import load_env
+
+# One client per process, created on first use and then shared.
+# A QdrantClient owns a connection pool (HTTP keep-alive connections or gRPC channels):
+# creating a new client per call throws that pool away and pays the TCP (and TLS)
+# handshake again on every request.
+_lock = threading.Lock()
+_client: Optional[qdrant_client.QdrantClient] = None
+_aclient: Optional[qdrant_client.AsyncQdrantClient] = None
+
+# Local (embedded) modes do not talk to a server, see `is_local_mode`.
+MEMORY_LOCATION = ":memory:"
+
+
+def qdrant_config() -> Dict[str, Any]:
+    """
+    Reads the Qdrant connection settings from the environment.
+
+    - QDRANT_URL: server URL, or ":memory:" for an in-process store (tests, benchmarks).
+    - QDRANT_PREFER_GRPC: "on" to use gRPC (port QDRANT_GRPC_PORT) instead of HTTP/JSON.
+      gRPC sends vectors as binary protobuf instead of JSON floats, which is much
+      cheaper for bulk upserts and noticeably faster per search.
+    - QDRANT_TIMEOUT: request timeout in seconds.
+    - QDRANT_POOL_SIZE: max pooled HTTP connections / number of gRPC channels.
+    """
+    load_env()
+    return {
+        "url": os.getenv("QDRANT_URL", "http://localhost:6333"),
+        "api_key": os.getenv("QDRANT_API_KEY") or None,
+        "prefer_grpc": os.getenv("QDRANT_PREFER_GRPC", "off").lower() == "on",
+        "grpc_port": int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+        "timeout": int(os.getenv("QDRANT_TIMEOUT", "10")),
+        "pool_size": int(os.getenv("QDRANT_POOL_SIZE", "16")),
+    }
+
+
+def is_local_mode(config: Optional[Dict[str, Any]] = None) -> bool:
+    """True when Qdrant runs in-process instead of behind a server."""
+    return (config or qdrant_config())["url"] == MEMORY_LOCATION
+
+
+def _client_kwargs(config: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "url": config["url"],
+        "api_key": config["api_key"],
+        "prefer_grpc": config["prefer_grpc"],
+        "grpc_port": config["grpc_port"],
+        "timeout": config["timeout"],
+        "pool_size": config["pool_size"],
+        # Keep idle gRPC channels alive with pings, so the first query after a quiet
+        # period does not pay for a new connection (or hit a half-closed one).
+        "grpc_options": {
+            "grpc.keepalive_time_ms": 30_000,
+            "grpc.keepalive_timeout_ms": 10_000,
+            "grpc.keepalive_permit_without_calls": 1,
+        },
+    }
+
+
+def get_qdrant_client() -> qdrant_client.QdrantClient:
+    """Returns the process-wide QdrantClient, creating it on first call."""
+    global _client
+    with _lock:
+        if _client is None:
+            config = qdrant_config()
+            if is_local_mode(config):
+                _client = qdrant_client.QdrantClient(location=MEMORY_LOCATION)
+            else:
+                transport = "gRPC" if config["prefer_grpc"] else "HTTP"
+                print(f"Creating shared Qdrant client ({transport}, pool of {config['pool_size']})")
+                _client = qdrant_client.QdrantClient(**_client_kwargs(config))
+        return _client
+
+
+def get_async_qdrant_client() -> qdrant_client.AsyncQdrantClient:
+    """
+    Returns the process-wide AsyncQdrantClient, creating it on first call.
+
+    In local (":memory:") mode a new in-process async client would be a second, empty
+    store, so it is pointed at the sync client's collections instead: both clients
+    then read and write the same in-memory data.
+    The async client's connections belong to the event loop that first uses them,
+    so use it from a single loop (the Gradio server has exactly one).
+    """
+    global _aclient
+    config = qdrant_config()
+    # Created outside the lock below: `get_qdrant_client` takes the same lock.
+    client = get_qdrant_client() if is_local_mode(config) else None
+    with _lock:
+        if _aclient is None:
+            if client is not None:
+                _aclient = qdrant_client.AsyncQdrantClient(location=MEMORY_LOCATION)
+                # Both local backends keep their collections in plain dicts: share them.
+                _aclient._client.collections = client._client.collections
+                _aclient._client.aliases = client._client.aliases
+            else:
+                _aclient = qdrant_client.AsyncQdrantClient(**_client_kwargs(config))
+        return _aclient
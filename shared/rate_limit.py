@@ -0,0 +1,52 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: at most `rate_per_minute` units per minute on average,
+    with bursts of up to `capacity` units.
+
+    The bucket refills continuously. `acquire(n)` takes n units, sleeping until they
+    are available, so callers are smoothed to the rate instead of being rejected.
+    Units can be requests (RPM) or tokens (TPM).
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_s = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 60.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_s)
+        self._updated = now
+
+    def _take(self, amount: float) -> float:
+        """Takes `amount` units if available and returns 0, else the seconds to wait."""
+        # A request larger than the bucket could never fit: let it through at a full bucket.
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate_per_s
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """Blocks until `amount` units are available and takes them. Returns the seconds waited."""
+        waited = 0.0
+        while (wait_s := self._take(amount)) > 0:
+            time.sleep(wait_s)
+            waited += wait_s
+        return waited
+
+    async def aacquire(self, amount: float = 1.0) -> float:
+        """Like `acquire`, but yields to the event loop while waiting."""
+        waited = 0.0
+        while (wait_s := self._take(amount)) > 0:
+            await asyncio.sleep(wait_s)
+            waited += wait_s
+        return waited
@@ -1,13 +1,42 @@
 import os
-from dotenv import load_dotenv
+import threading
 from llama_index.core import Settings
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.ollama import Ollama
-from llama_index.embeddings.openai import OpenAIEmbedding
-# Note: For local embeddings with Ollama, we might typically use HuggingFaceEmbedding, 
-# but for this workshop we'll stick to OpenAI embeddings or a simple placeholder if strictly local is requested.
-# To keep it simple and robust for the "Zero-Magic" philosophy, we will default to OpenAI embeddings 
-# unless explicitly changed, but we'll leave room for extension.
+from shared.env import load_env
+from shared.embedding_cache import CachedEmbedding, EmbeddingCache
+from shared.mock_models import HashingEmbedding
+from shared.gateway import GatewayEmbedding, GatewayLLM, get_gateway
+from shared.local_embedding import LocalEmbedding
+
+# Embedding providers, picked with EMBED_PROVIDER. When unset, it follows the LLM:
+# OpenAI embeddings for "openai", hashing embeddings for "mock", and for "ollama"
+# OpenAI embeddings if a key is set (hybrid mode), otherwise a local model.
+EMBED_PROVIDERS = ("openai", "local", "mock")
+
+def default_embed_provider(llm_provider: str) -> str:
+    if llm_provider == "ollama":
+        return "openai" if os.getenv("OPENAI_API_KEY") else "local"
+    return llm_provider
+
+# Set once init_settings() has run in this process (see ensure_settings).
+_initialized = False
+_init_lock = threading.Lock()
+
+def ensure_settings():
+    """
+    Runs `init_settings()` once per process, on first use.
+
+    Modules no longer configure models when they are imported: importing the
+    provider SDKs and building clients costs seconds, which every CLI `--help`,
+    every worker process and every server cold start used to pay. Entry points
+    (`get_query_engine`, `ManualReActAgent`, ...) call this instead. Calling
+    `init_settings()` directly still works and counts as initialized.
+    """
+    if _initialized:
+        return Settings
+    with _init_lock:
+        if not _initialized:
+            init_settings()
+    return Settings
 
 def init_settings():
     """
@@ -18,9 +47,14 @@ def init_settings():
     LlamaIndex operations (Index creation, Query Engine, etc.) will automatically
     use these configured models without needing to pass them explicitly.
     """
-    load_dotenv()
+    load_env()
     
     llm_provider = os.getenv("LLM_PROVIDER", "openai").lower()
+    embed_provider = os.getenv("EMBED_PROVIDER", "").lower() or default_embed_provider(llm_provider)
+    # Remote providers sit behind the shared gateway (see the end of this function).
+    # It owns retries, so the provider clients' own retry loops are turned off.
+    gateway_on = os.getenv("LLM_GATEWAY", "on").lower() == "on"
+    use_gateway = gateway_on and llm_provider != "mock"
     
     # --- LLM Configuration ---
     if llm_provider == "openai":
@@ -30,42 +64,85 @@ def init_settings():
         
         if not api_key:
             raise ValueError("OPENAI_API_KEY is required when LLM_PROVIDER is 'openai'")
+        # Provider SDKs are imported only when selected: each one adds to startup time.
+        from llama_index.llms.openai import OpenAI
             
         print(f"Initializing Settings with OpenAI LLM: {model}")
-        Settings.llm = OpenAI(model=model, api_key=api_key)
-        
-        # For OpenAI, we also use their embeddings by default
-        print("Initializing Settings with OpenAI Embeddings")
-        Settings.embed_model = OpenAIEmbedding(api_key=api_key)
+        Settings.llm = OpenAI(model=model, api_key=api_key, max_retries=0 if use_gateway else 3)
 
     elif llm_provider == "ollama":
         base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         model = os.getenv("OLLAMA_MODEL", "llama3")
+        from llama_index.llms.ollama import Ollama
         
         print(f"Initializing Settings with Ollama LLM: {model} ({base_url})")
         Settings.llm = Ollama(
             model=model, 
             base_url=base_url,
-            request_timeout=120.0 # Longer timeout for local inference
+            # Longer timeout for local inference (a cold model load can take a while)
+            request_timeout=float(os.getenv("OLLAMA_REQUEST_TIMEOUT", "120")),
         )
-        
-        # For a purely local setup, we would ideally use HuggingFaceEmbedding.
-        # However, to avoid adding heavy torch dependencies just for this step if not needed,
-        # we will warn the user. For now, we assume OpenAI embeddings are acceptable even with Ollama 
-        # (Hybrid) OR the user must install `llama-index-embeddings-huggingface` and configure it here.
-        # For this workshop's simplicity, we'll default to OpenAI embeddings if available, or raise an error.
-        if os.getenv("OPENAI_API_KEY"):
-             print("Using OpenAI Embeddings with Ollama (Hybrid Mode)")
-             Settings.embed_model = OpenAIEmbedding(api_key=os.getenv("OPENAI_API_KEY"))
-        else:
-            # Educational note: This is where we'd plug in a local embedding model.
-            print("WARNING: No OpenAI API key found for embeddings. Using LlamaIndex default (Mock/OpenAI) which may fail.")
-            # In a real local-only setup:
-            # from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-            # Settings.embed_model = HuggingFaceEmbedding(model_name="BAAI/bge-small-en-v1.5")
-            
+
+    elif llm_provider == "mock":
+        # Deterministic, offline models: no API key, no network, same output every run.
+        # Used by the benchmark and evaluation harnesses so numbers are reproducible.
+        from llama_index.core.llms import MockLLM
+
+        print("Initializing Settings with Mock LLM (offline)")
+        Settings.llm = MockLLM(max_tokens=int(os.getenv("MOCK_LLM_MAX_TOKENS", "64")))
+
     else:
         raise ValueError(f"Unsupported LLM_PROVIDER: {llm_provider}")
 
+    # --- Embedding Configuration ---
+    # Chosen independently of the LLM, e.g. a local embedding model with an OpenAI LLM.
+    # Switching embedding models changes the vectors (and often their size):
+    # re-ingest into a fresh collection afterwards.
+    if embed_provider == "openai":
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is required when EMBED_PROVIDER is 'openai'")
+        from llama_index.embeddings.openai import OpenAIEmbedding
+        print("Initializing Settings with OpenAI Embeddings")
+        embed_model = OpenAIEmbedding(api_key=api_key, max_retries=0 if gateway_on else 10)
+
+    elif embed_provider == "local":
+        # In-process CPU model: no key, no network. Loaded on the first embedding.
+        embed_model = LocalEmbedding()
+        print(f"Initializing Settings with local embeddings: {embed_model.model_name} ({embed_model.backend})")
+
+    elif embed_provider == "mock":
+        # Deterministic, offline hashing embeddings (see shared/mock_models.py).
+        print("Initializing Settings with Hashing Embeddings (offline)")
+        embed_model = HashingEmbedding()
+
+    else:
+        raise ValueError(f"Unsupported EMBED_PROVIDER: {embed_provider} (expected one of {EMBED_PROVIDERS})")
+
+    # --- Gateway ---
+    # Rate limits (RPM/TPM), retries with jittered backoff, coalescing of identical
+    # in-flight requests and hedging, shared by everything in this process
+    # (shared/gateway.py). The wrappers keep the LlamaIndex interfaces, so callers don't change.
+    if use_gateway:
+        print("Routing LLM calls through the gateway")
+        Settings.llm = GatewayLLM(Settings.llm, get_gateway("LLM"))
+    # Only the remote embedding API needs it: a local model has no quota to respect.
+    if gateway_on and embed_provider == "openai":
+        print("Routing embedding calls through the gateway")
+        embed_model = GatewayEmbedding(embed_model, get_gateway("EMBED"))
+
+    # --- Embedding Cache ---
+    # Embedding the same chunk twice with the same model always gives the same vector,
+    # so we wrap whichever embed model was chosen above with a persistent on-disk cache.
+    # Rebuilding the index or trying a new chunking strategy then only pays for new text.
+    if os.getenv("EMBED_CACHE", "on").lower() == "on":
+        cache_path = os.getenv("EMBED_CACHE_PATH", ".cache/embeddings.sqlite")
+        max_entries = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "100000"))
+        print(f"Caching embeddings in {cache_path} (max {max_entries} entries)")
+        embed_model = CachedEmbedding(embed_model, EmbeddingCache(cache_path, max_entries))
+    Settings.embed_model = embed_model
+
+    global _initialized
+    _initialized = True
     return Settings
 
@@ -0,0 +1,25 @@
+from lab1_rag.startup_check import (
+    CLI_BUDGET_S,
+    LISTEN_BUDGET_S,
+    READY_BUDGET_S,
+    check_env,
+    measure_cli,
+    measure_server,
+)
+
+# Cold-start budgets (see lab1_rag/startup_check.py), offline: mock models and an
+# in-process Qdrant, so no API key, Docker or network is needed.
+PORT = 7862
+
+
+def test_app_ready_within_budget():
+    # `/ready` only answers 200 once the app has answered a real question.
+    server = measure_server(check_env(PORT), PORT, timeout_s=LISTEN_BUDGET_S + READY_BUDGET_S)
+    assert server["listen_s"] is not None, "the app never bound its port"
+    assert server["listen_s"] <= LISTEN_BUDGET_S
+    assert server["ready_s"] is not None, "the app never became ready"
+    assert server["ready_s"] <= READY_BUDGET_S
+
+
+def test_cli_help_within_budget():
+    assert measure_cli(check_env(PORT), runs=3) <= CLI_BUDGET_S